@@ -0,0 +1,33 @@
+import sys
+import argparse
+from config import BATCH_CONCURRENT_GAMES
+from stage.batch import run_batch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate the games of a theme queue without interaction"
+    )
+    parser.add_argument(
+        "queue",
+        help='JSONL file, one {"theme": ..., "output": ..., "export": ...} per line',
+    )
+    parser.add_argument(
+        "--games",
+        type=int,
+        default=BATCH_CONCURRENT_GAMES,
+        help="Number of games generated at once",
+    )
+    parser.add_argument(
+        "--log-dir",
+        default="./batch_logs",
+        help="Directory for the batch, LLM usage and ComfyUI job reports",
+    )
+    parser.add_argument(
+        "--cleanup",
+        action="store_true",
+        help="Remove the workspace of each game once its project is exported",
+    )
+    args = parser.parse_args()
+    results = run_batch(args.queue, args.games, args.log_dir, args.cleanup)
+    sys.exit(any(result["status"] != "done" for result in results))
@@ -1,70 +1,1216 @@
 import websocket  # NOTE: websocket-client (https://github.com/websocket-client/websocket-client)
+import asyncio
 import uuid
 import json
-import urllib.request
+import hashlib
+import shutil
+import http.client
+import queue
 import urllib.parse
 import random
+import os
 from PIL import Image
 import io
-from typing import List
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Literal, NamedTuple
 
 
-class ComfyUI:
-    def __init__(self, server_address: str):
+def _select_outputs(outputs, output_type):
+    selected = {}
+    for node_id, data_list in outputs.items():
+        selected[node_id] = [
+            data for data_type, data in data_list if data_type == output_type
+        ]
+    return selected
+
+
+DEFAULT_NEGATIVE_PROMPT = "(nsfw:1.1), text, watermark, nude, lowres, worst quality, bad quality, bad, jpeg artifacts, unfinished, extra digits, scan, [abstract], sketch, bad anatomy, artistic error, duplicate, mutation, deformed, disfigured, artist name, ai-generated, ai-assisted"
+
+# Node id of the output (save) node in every workflow template
+OUTPUT_NODE = "13"
+
+
+class Slot(NamedTuple):
+    """A named workflow parameter: which node input it writes and its type"""
+
+    node_id: str
+    input_name: str
+    type: type | tuple[type, ...]
+
+
+IMAGE_SLOTS = {
+    "prompt": Slot("6", "text", str),
+    "negative": Slot("7", "text", str),
+    "seed": Slot("3", "seed", int),
+    "batch_size": Slot("5", "batch_size", int),
+    "width": Slot("5", "width", int),
+    "height": Slot("5", "height", int),
+}
+
+AUDIO_SLOTS = {
+    "prompt": Slot("6", "text", str),
+    "negative": Slot("7", "text", str),
+    "seed": Slot("3", "seed", int),
+    "batch_size": Slot("11", "batch_size", int),
+    "duration": Slot("11", "seconds", (int, float)),
+}
+
+
+class WorkflowTemplate:
+    """A workflow graph parsed once, from which per-request graphs are built"""
+
+    def __init__(self, path: str, graph: dict, slots: dict[str, Slot]):
+        self.path = path
+        self.graph = graph
+        self.slots = slots
+        self._validate()
+
+    def _validate(self):
+        for name, slot in self.slots.items():
+            node = self.graph.get(slot.node_id)
+            if node is None:
+                raise ValueError(
+                    f"Workflow {self.path}: node {slot.node_id} for slot '{name}' does not exist"
+                )
+            if slot.input_name not in node.get("inputs", {}):
+                raise ValueError(
+                    f"Workflow {self.path}: node {slot.node_id} ({node.get('class_type')}) has no input '{slot.input_name}' for slot '{name}'"
+                )
+        if OUTPUT_NODE not in self.graph:
+            raise ValueError(
+                f"Workflow {self.path}: output node {OUTPUT_NODE} does not exist"
+            )
+
+    def build(self, **params) -> dict:
+        """Return a new graph with the given slots filled in
+
+        Only the nodes that are written to are copied, the rest of the graph is
+        shared with the template and must not be modified.
+        """
+        graph = dict(self.graph)
+        for name, value in params.items():
+            if value is None:
+                continue
+            slot = self.slots.get(name)
+            if slot is None:
+                raise KeyError(f"Workflow {self.path} has no parameter slot '{name}'")
+            if not isinstance(value, slot.type) or isinstance(value, bool):
+                raise TypeError(
+                    f"Workflow {self.path}: slot '{name}' expects {slot.type}, got {type(value).__name__}"
+                )
+            node = graph[slot.node_id]
+            if node is self.graph[slot.node_id]:
+                node = dict(node, inputs=dict(node["inputs"]))
+                graph[slot.node_id] = node
+            node["inputs"][slot.input_name] = value
+        return graph
+
+
+class TemplateRegistry:
+    """Thread-safe cache of parsed workflow templates, keyed by file path"""
+
+    def __init__(self):
+        self._templates: dict[tuple[str, str], WorkflowTemplate] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str, kind: Literal["image", "audio"]) -> WorkflowTemplate:
+        key = (os.path.abspath(path), kind)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                with open(path, "r", encoding="utf-8") as file:
+                    graph = json.load(file)
+                slots = IMAGE_SLOTS if kind == "image" else AUDIO_SLOTS
+                template = WorkflowTemplate(path, graph, slots)
+                self._templates[key] = template
+            return template
+
+
+templates = TemplateRegistry()
+
+
+def _build_image_prompt(
+    prompt_file: str,
+    positive_prompt: str,
+    negative_prompt: str | None = None,
+    seed: int | None = None,
+    batch_size: int = 1,
+    width: int | None = None,
+    height: int | None = None,
+):
+    return templates.get(prompt_file, "image").build(
+        prompt=positive_prompt,
+        negative=negative_prompt
+        if negative_prompt is not None
+        else DEFAULT_NEGATIVE_PROMPT,
+        seed=seed if seed is not None else random.randint(0, 1000000),
+        batch_size=batch_size,
+        width=width,
+        height=height,
+    )
+
+
+def _build_audio_prompt(
+    prompt_file: str,
+    positive_prompt: str,
+    negative_prompt: str | None = None,
+    seed: int | None = None,
+    duration_seconds: int = 10,
+    batch_size: int = 1,
+):
+    return templates.get(prompt_file, "audio").build(
+        prompt=positive_prompt,
+        negative=negative_prompt,
+        seed=seed if seed is not None else random.randint(0, 1000000),
+        duration=duration_seconds,
+        batch_size=batch_size,
+    )
+
+
+# Save nodes whose files have to be fetched through /history and /view
+FILE_OUTPUT_NODES = {"SaveImage", "SaveImageExtended", "SaveAudio"}
+STREAM_OUTPUT_NODE = "SaveImageWebsocket"
+# Binary websocket event carrying an encoded image (see server.BinaryEventTypes)
+PREVIEW_IMAGE_EVENT = 1
+# Websocket events that end a job
+TERMINAL_EVENTS = {"execution_error", "execution_interrupted"}
+# Prompts whose events are kept while their POST /prompt has not returned
+EARLY_EVENT_PROMPTS = 64
+
+
+def _stream_image_outputs(graph: dict) -> dict:
+    """Replace a plain SaveImage output node with SaveImageWebsocket
+
+    SaveImageWebsocket always sends PNG, so templates saving through
+    SaveImageExtended (e.g. lossy WEBP, like the bundled image templates) keep
+    it and are fetched from /history.
+    """
+    node = graph[OUTPUT_NODE]
+    if node["class_type"] != "SaveImage":
+        return graph
+    graph = dict(graph)
+    graph[OUTPUT_NODE] = {
+        "class_type": STREAM_OUTPUT_NODE,
+        "inputs": {"images": node["inputs"]["images"]},
+    }
+    return graph
+
+
+# Nodes whose `progress` events are sampler steps
+SAMPLER_NODES = {
+    "KSampler",
+    "KSamplerAdvanced",
+    "SamplerCustom",
+    "SamplerCustomAdvanced",
+}
+
+# Input values that name model files
+MODEL_FILE_EXTENSIONS = (".safetensors", ".ckpt", ".pt", ".pth", ".bin", ".gguf")
+
+
+def _model_key(graph: dict) -> tuple[str, ...]:
+    """Models a workflow graph loads, jobs with equal keys reuse resident models
+
+    Loader nodes are keyed by their model files, or by their class when the
+    model is fixed (e.g. BRIA_RMBG_ModelLoader_Zho).
+    """
+    models = set()
+    for node in graph.values():
+        files = [
+            value
+            for value in node["inputs"].values()
+            if isinstance(value, str) and value.lower().endswith(MODEL_FILE_EXTENSIONS)
+        ]
+        if files:
+            models.update(files)
+        elif "Loader" in node["class_type"]:
+            models.add(node["class_type"])
+    return tuple(sorted(models))
+
+
+class _Job:
+    """Client-side state of a queued prompt"""
+
+    def __init__(self, prompt: dict, future, label=None, on_progress=None):
+        self.prompt = prompt
+        self.future = future
+        # Name used in throughput statistics, usually the template name
+        self.label = label or "workflow"
+        # Called as on_progress(step, total_steps) for every sampler step
+        self.on_progress = on_progress
+        # Images of SaveImageWebsocket nodes arrive as binary frames
+        self.streamed = {
+            node_id: []
+            for node_id, node in prompt.items()
+            if node["class_type"] == STREAM_OUTPUT_NODE
+        }
+        self.needs_history = any(
+            node["class_type"] in FILE_OUTPUT_NODES for node in prompt.values()
+        )
+        self.sampler_nodes = {
+            node_id
+            for node_id, node in prompt.items()
+            if node["class_type"] in SAMPLER_NODES
+        }
+        self.model_key = _model_key(prompt)
+        # Whether the server had other models loaded when the job started
+        self.model_swap = None
+        self.reset()
+
+    def add_frame(self, node_id, frame: bytes) -> bool:
+        """Keep an image frame sent while node_id was executing, ignore previews"""
+        if node_id not in self.streamed:
+            return False
+        event = int.from_bytes(frame[:4], "big")
+        if event != PREVIEW_IMAGE_EVENT:
+            return False
+        # 4 bytes event type + 4 bytes image format, then the encoded image
+        self.streamed[node_id].append(("image", frame[8:]))
+        return True
+
+    def reset(self):
+        """Forget streamed frames and timings before the prompt is queued (again)"""
+        for frames in self.streamed.values():
+            frames.clear()
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.first_step = None  # (timestamp, step)
+        self.last_step = None
+        self.total_steps = 0
+        self.cached_nodes = 0
+
+    def handle_event(self, message_type: str, data: dict):
+        """Track execution_start, execution_cached and progress events"""
+        now = time.time()
+        if message_type == "execution_start":
+            self.started_at = now
+        elif message_type == "execution_cached":
+            self.cached_nodes += len(data.get("nodes", []))
+        elif message_type == "progress":
+            if data.get("node") not in self.sampler_nodes:
+                return  # e.g. progress of a background removal node
+            if self.first_step is None:
+                self.first_step = (now, data["value"])
+            self.last_step = (now, data["value"])
+            self.total_steps = data["max"]
+
+    def report_progress(self, data: dict):
+        """Pass a sampler progress event on to on_progress"""
+        if self.on_progress is None or data.get("node") not in self.sampler_nodes:
+            return
+        try:
+            self.on_progress(data["value"], data["max"])
+        except Exception:
+            pass  # a broken display must not break the job
+
+    def stats(self, prompt_id: str, server: str, outputs: dict) -> dict:
+        """Timing summary of the finished job, one line of the throughput log"""
+        finished_at = self.finished_at or time.time()
+        started_at = self.started_at or self.queued_at
+        output_count = sum(len(data_list) for data_list in outputs.values())
+        its = None
+        if self.first_step and self.last_step:
+            sampling_seconds = self.last_step[0] - self.first_step[0]
+            if sampling_seconds > 0:
+                its = (self.last_step[1] - self.first_step[1]) / sampling_seconds
+        # Time between the start of the prompt and its first sampler step,
+        # mostly loading models and encoding the prompts
+        load_seconds = self.first_step[0] - started_at if self.first_step else None
+        run_seconds = finished_at - started_at
+        return {
+            "prompt_id": prompt_id,
+            "server": server,
+            "template": self.label,
+            "queued_at": self.queued_at,
+            "queue_seconds": started_at - self.queued_at,
+            "run_seconds": run_seconds,
+            "load_seconds": load_seconds,
+            "steps": self.total_steps,
+            "its": its,
+            "cached_nodes": self.cached_nodes,
+            "model_swap": self.model_swap,
+            "outputs": output_count,
+            "seconds_per_output": run_seconds / output_count if output_count else None,
+        }
+
+
+class ThroughputMonitor:
+    """Collects per-job statistics and appends them to a JSON Lines log"""
+
+    def __init__(self, log_path: str | None = None):
+        self.log_path = log_path
+        self._records: list[dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, stats: dict):
+        with self._lock:
+            self._records.append(stats)
+            if self.log_path:
+                os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(stats) + "\n")
+
+    def records(self) -> list[dict]:
+        with self._lock:
+            return list(self._records)
+
+    def summary(self) -> dict[tuple[str, str], dict]:
+        """Aggregate by (template, server): jobs, outputs, s/output and it/s"""
+        summary: dict[tuple[str, str], dict] = {}
+        for stats in self.records():
+            key = (stats["template"], stats["server"])
+            total = summary.setdefault(
+                key,
+                {"jobs": 0, "outputs": 0, "run_seconds": 0.0, "its": []},
+            )
+            total["jobs"] += 1
+            total["outputs"] += stats["outputs"]
+            total["run_seconds"] += stats["run_seconds"]
+            if stats["its"]:
+                total["its"].append(stats["its"])
+        for total in summary.values():
+            its = total.pop("its")
+            total["its"] = sum(its) / len(its) if its else None
+            total["seconds_per_output"] = (
+                total["run_seconds"] / total["outputs"] if total["outputs"] else None
+            )
+        return summary
+
+    def model_load_seconds(self) -> tuple[float | None, float | None]:
+        """Mean time before the first sampler step, with and without a model swap
+
+        The difference is what loading other models costs per job.
+        """
+        swapped, resident = [], []
+        for stats in self.records():
+            if stats["load_seconds"] is None or stats["model_swap"] is None:
+                continue
+            (swapped if stats["model_swap"] else resident).append(stats["load_seconds"])
+        return (
+            sum(swapped) / len(swapped) if swapped else None,
+            sum(resident) / len(resident) if resident else None,
+        )
+
+
+class OutputCache:
+    """Size-bounded on-disk LRU cache of job outputs keyed by the workflow graph
+
+    Each entry is a directory holding the output files and a manifest. Reading
+    an entry refreshes its mtime, the least recently used entries are deleted
+    once the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._sizes = {
+            key: self._entry_size(key)
+            for key in os.listdir(directory)
+            if os.path.exists(os.path.join(directory, key, "manifest.json"))
+        }
+
+    @staticmethod
+    def key(graph: dict) -> str:
+        """Hash of the patched graph: template, prompts, seed, models, size"""
+        canonical = json.dumps(graph, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _entry_size(self, key) -> int:
+        entry = os.path.join(self.directory, key)
+        return sum(
+            os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry)
+        )
+
+    def get(self, key: str) -> dict | None:
+        """Outputs stored for key, in the format returned by submit()"""
+        with self._lock:
+            if key not in self._sizes:
+                self.misses += 1
+                return None
+            entry = os.path.join(self.directory, key)
+            try:
+                with open(os.path.join(entry, "manifest.json"), encoding="utf-8") as f:
+                    manifest = json.load(f)
+                outputs = {}
+                for node_id, files in manifest.items():
+                    outputs[node_id] = []
+                    for data_type, filename in files:
+                        with open(os.path.join(entry, filename), "rb") as f:
+                            outputs[node_id].append((data_type, f.read()))
+                os.utime(entry)
+            except (OSError, ValueError):
+                # Damaged entry, e.g. deleted by hand
+                self._sizes.pop(key)
+                shutil.rmtree(entry, ignore_errors=True)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return outputs
+
+    def put(self, key: str, outputs: dict):
+        with self._lock:
+            entry = os.path.join(self.directory, key)
+            # Write to a temporary directory first so readers never see a
+            # half-written entry
+            partial = entry + ".partial"
+            shutil.rmtree(partial, ignore_errors=True)
+            os.makedirs(partial)
+            manifest = {}
+            for node_id, data_list in outputs.items():
+                manifest[node_id] = []
+                for k, (data_type, data) in enumerate(data_list):
+                    filename = f"{node_id}_{k}.{data_type}"
+                    with open(os.path.join(partial, filename), "wb") as f:
+                        f.write(data)
+                    manifest[node_id].append((data_type, filename))
+            with open(
+                os.path.join(partial, "manifest.json"), "w", encoding="utf-8"
+            ) as f:
+                json.dump(manifest, f)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(partial, entry)
+            self._sizes[key] = self._entry_size(key)
+            self._evict()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        by_age = sorted(
+            self._sizes,
+            key=lambda key: os.path.getmtime(os.path.join(self.directory, key)),
+        )
+        for key in by_age:
+            if total <= self.max_bytes:
+                break
+            total -= self._sizes.pop(key)
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+
+def replay_key(graph: dict) -> str:
+    """Key of a recorded job: the graph without seeds and output node type
+
+    Recorded runs use random seeds and may stream their outputs, a replay
+    must still find the job by its prompts, models and sizes.
+    """
+    graph = json.loads(json.dumps(graph))
+    for node_id, node in graph.items():
+        node.pop("_meta", None)  # node titles
+        if node["class_type"] in SAMPLER_NODES:
+            node["inputs"].pop("seed", None)
+            node["inputs"].pop("noise_seed", None)
+        elif node["class_type"] in FILE_OUTPUT_NODES | {STREAM_OUTPUT_NODE}:
+            graph[node_id] = {"class_type": "output", "inputs": {}}
+    return OutputCache.key(graph)
+
+
+def _stable_seed(*parts) -> int:
+    """Seed derived from the job parameters, so that reruns hit the cache"""
+    digest = hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % 1000001
+
+
+def _template_label(prompt_file: str) -> str:
+    """Name of a workflow template in statistics, e.g. "sprite" """
+    return os.path.splitext(os.path.basename(prompt_file))[0]
+
+
+def _image_outputs(outputs) -> List[Image.Image]:
+    return [
+        Image.open(io.BytesIO(image))
+        for image in _select_outputs(outputs, "image").get(OUTPUT_NODE, [])
+    ]
+
+
+def _audio_outputs(outputs) -> List[bytes]:
+    return _select_outputs(outputs, "audio").get(OUTPUT_NODE, [])
+
+
+class LatencyStats:
+    """Thread-safe request count, error count and latency per endpoint"""
+
+    def __init__(self):
+        self._stats: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, nbytes: int = 0, error=False):
+        with self._lock:
+            stats = self._stats.setdefault(
+                endpoint,
+                {
+                    "count": 0,
+                    "errors": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "bytes": 0,
+                },
+            )
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["bytes"] += nbytes
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {endpoint: dict(stats) for endpoint, stats in self._stats.items()}
+
+    @staticmethod
+    def merge(snapshots) -> dict[str, dict]:
+        merged: dict[str, dict] = {}
+        for snapshot in snapshots:
+            for endpoint, stats in snapshot.items():
+                total = merged.setdefault(endpoint, dict.fromkeys(stats, 0))
+                for key, value in stats.items():
+                    if key == "max_seconds":
+                        total[key] = max(total[key], value)
+                    else:
+                        total[key] += value
+        return merged
+
+
+class ComfyUIHTTPError(RuntimeError):
+    """The server answered a REST call with an error status"""
+
+    def __init__(self, status: int, path: str, body: bytes):
+        self.status = status
+        super().__init__(
+            "ComfyUI {} returned HTTP {}: {}".format(
+                path, status, body[:500].decode("utf-8", errors="replace")
+            )
+        )
+
+
+class HTTPSession:
+    """Pool of keep-alive HTTP connections to one ComfyUI server"""
+
+    def __init__(self, server_address: str, timeout: float = 60.0):
         self.server_address = server_address
-        self.client_id = str(uuid.uuid4())
-        self.ws = websocket.WebSocket()
-        self.ws.connect(
-            "ws://{}/ws?clientId={}".format(self.server_address, self.client_id)
+        self.timeout = timeout
+        self.latency = LatencyStats()
+        self._idle: queue.LifoQueue[http.client.HTTPConnection] = queue.LifoQueue()
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+    def request(self, method: str, path: str, body: bytes | None = None) -> bytes:
+        # Latency is reported per endpoint, e.g. /view or /history
+        endpoint = "/" + path.lstrip("/").split("/")[0].split("?")[0]
+        start = time.perf_counter()
+        try:
+            data = self._request(method, path, body)
+        except Exception:
+            self.latency.record(endpoint, time.perf_counter() - start, error=True)
+            raise
+        self.latency.record(endpoint, time.perf_counter() - start, len(data))
+        return data
+
+    def _request(self, method, path, body):
+        try:
+            connection = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            connection = http.client.HTTPConnection(
+                self.server_address, timeout=self.timeout
+            )
+            reused = False
+
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (
+            http.client.RemoteDisconnected,
+            BrokenPipeError,
+            ConnectionResetError,
+        ):
+            connection.close()
+            if not reused:
+                raise
+            # The server closed an idle keep-alive connection, the request
+            # never reached it, so it is safe to send it again
+            return self._request(method, path, body)
+        except Exception:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._idle.put(connection)
+        if response.status >= 400:
+            raise ComfyUIHTTPError(response.status, path, data)
+        return data
+
+
+class WorkflowClient:
+    """Builds workflow graphs from templates; subclasses decide where they run"""
+
+    # Receive images as websocket frames instead of saving them on the server
+    stream_outputs = False
+    # Receives the statistics of every finished job
+    monitor: ThroughputMonitor | None = None
+    # Outputs of earlier runs of the same graph, see OutputCache
+    cache: OutputCache | None = None
+    # Stores every job's outputs under replay_key() for scripts/replay_server.py
+    recorder: OutputCache | None = None
+
+    def http_stats(self) -> dict[str, dict]:
+        """Latency of REST calls per endpoint, see LatencyStats"""
+        return {}
+
+    def submit(self, prompt, label=None, on_progress=None) -> Future:
+        """Queue a workflow graph without waiting for it to run
+
+        Args:
+            prompt (dict): workflow graph in API format
+            label (str): name of the job kind in throughput statistics
+            on_progress (Callable): called as on_progress(step, total_steps)
+
+        Returns:
+            Future: resolves to a dict mapping output node ids to lists of
+                ("image" | "audio", bytes) tuples
+        """
+        raise NotImplementedError
+
+    def _submit_cached(self, prompt, label=None, on_progress=None) -> Future:
+        """submit() unless the outputs of this exact graph are in the cache
+
+        With a recorder, the outputs are also kept as a replay fixture.
+        """
+        key = self.cache.key(prompt) if self.cache is not None else None
+        outputs = self.cache.get(key) if key is not None else None
+        if outputs is not None:
+            future = Future()
+            future.set_result(outputs)
+        else:
+            future = self.submit(prompt, label=label, on_progress=on_progress)
+            if self.cache is not None:
+                future.add_done_callback(
+                    lambda done: self._store(self.cache, key, done)
+                )
+        if self.recorder is not None:
+            record_key = replay_key(prompt)
+            future.add_done_callback(
+                lambda done: self._store(self.recorder, record_key, done)
+            )
+        return future
+
+    @staticmethod
+    def _store(cache: OutputCache, key: str, done: Future):
+        if done.exception() is None:
+            try:
+                cache.put(key, done.result())
+            except OSError as e:
+                print(f"Cannot write ComfyUI outputs to {cache.directory}: {e}")
+
+    def _seed(self, seed, *parts):
+        """Random seeds defeat the cache, derive one from the job when caching"""
+        if seed is not None or self.cache is None:
+            return seed
+        return _stable_seed(*parts)
+
+    def submit_many(self, prompts) -> List[Future]:
+        """Queue several workflow graphs back to back so the server queue never drains"""
+        return [self.submit(prompt) for prompt in prompts]
+
+    @staticmethod
+    def _then(future: Future, fn: Callable) -> Future:
+        """Return a future resolving to fn(result) of the given future"""
+        chained = Future()
+
+        def _callback(done: Future):
+            try:
+                chained.set_result(fn(done.result()))
+            except Exception as e:
+                chained.set_exception(e)
+
+        future.add_done_callback(_callback)
+        return chained
+
+    def submit_image(
+        self,
+        prompt_file: str,
+        positive_prompt: str,
+        negative_prompt: str | None = None,
+        seed: int | None = None,
+        batch_size: int = 1,
+        width: int | None = None,
+        height: int | None = None,
+        on_progress: Callable[[int, int], None] | None = None,
+    ) -> Future:
+        """Queue an image job, the returned future resolves to List[Image.Image]"""
+        seed = self._seed(seed, prompt_file, positive_prompt, negative_prompt)
+        prompt = _build_image_prompt(
+            prompt_file,
+            positive_prompt,
+            negative_prompt,
+            seed,
+            batch_size,
+            width,
+            height,
+        )
+        if self.stream_outputs:
+            prompt = _stream_image_outputs(prompt)
+        future = self._submit_cached(
+            prompt, label=_template_label(prompt_file), on_progress=on_progress
+        )
+        return self._then(future, _image_outputs)
+
+    def submit_audio(
+        self,
+        prompt_file: str,
+        positive_prompt: str,
+        negative_prompt: str | None = None,
+        seed: int | None = None,
+        duration_seconds: int = 10,
+        batch_size: int = 1,
+        on_progress: Callable[[int, int], None] | None = None,
+    ) -> Future:
+        """Queue an audio job, the returned future resolves to List[bytes]"""
+        seed = self._seed(seed, prompt_file, positive_prompt, negative_prompt)
+        prompt = _build_audio_prompt(
+            prompt_file,
+            positive_prompt,
+            negative_prompt,
+            seed,
+            duration_seconds,
+            batch_size,
+        )
+        future = self._submit_cached(
+            prompt, label=_template_label(prompt_file), on_progress=on_progress
+        )
+        return self._then(future, _audio_outputs)
+
+    def generate_image(
+        self,
+        prompt_file: str,
+        positive_prompt: str,
+        negative_prompt: str | None = None,
+        seed: int | None = None,
+        batch_size: int = 1,
+        width: int | None = None,
+        height: int | None = None,
+    ) -> List[Image.Image]:
+        return self.submit_image(
+            prompt_file,
+            positive_prompt,
+            negative_prompt,
+            seed,
+            batch_size,
+            width,
+            height,
+        ).result()
+
+    def generate_audio(
+        self,
+        prompt_file: str,
+        positive_prompt: str,
+        negative_prompt: str | None = None,
+        seed: int | None = None,
+        duration_seconds: int = 10,
+        batch_size: int = 1,
+    ) -> List[bytes]:
+        return self.submit_audio(
+            prompt_file,
+            positive_prompt,
+            negative_prompt,
+            seed,
+            duration_seconds,
+            batch_size,
+        ).result()
+
+    async def agenerate_image(
+        self,
+        prompt_file: str,
+        positive_prompt: str,
+        negative_prompt: str | None = None,
+        seed: int | None = None,
+        batch_size: int = 1,
+        width: int | None = None,
+        height: int | None = None,
+        on_progress: Callable[[int, int], None] | None = None,
+    ) -> List[Image.Image]:
+        """generate_image() for asyncio code
+
+        Awaits the job's future, so any number of jobs can be in flight from
+        one event loop next to LLM calls, through the same servers, cache and
+        reconnect handling as submit_image(). Queueing (POST /prompt, cache
+        lookups) runs in a worker thread to keep the loop responsive.
+        """
+        future = await asyncio.to_thread(
+            self.submit_image,
+            prompt_file,
+            positive_prompt,
+            negative_prompt,
+            seed,
+            batch_size,
+            width,
+            height,
+            on_progress,
         )
+        return await asyncio.wrap_future(future)
+
+    async def agenerate_audio(
+        self,
+        prompt_file: str,
+        positive_prompt: str,
+        negative_prompt: str | None = None,
+        seed: int | None = None,
+        duration_seconds: int = 10,
+        batch_size: int = 1,
+        on_progress: Callable[[int, int], None] | None = None,
+    ) -> List[bytes]:
+        """generate_audio() for asyncio code, see agenerate_image()"""
+        future = await asyncio.to_thread(
+            self.submit_audio,
+            prompt_file,
+            positive_prompt,
+            negative_prompt,
+            seed,
+            duration_seconds,
+            batch_size,
+            on_progress,
+        )
+        return await asyncio.wrap_future(future)
+
+
+class ComfyUI(WorkflowClient):
+    """Client of one ComfyUI server
+
+    The websocket is read by a background thread. If it drops, the thread
+    reconnects and recovers the jobs that were in flight: jobs the server
+    finished are collected from /history, jobs still queued keep waiting, and
+    only jobs the server really lost are queued again.
+    """
+
+    def __init__(
+        self,
+        server_address: str,
+        stream_outputs: bool = False,
+        timeout: float = 60.0,
+        heartbeat_interval: float = 20.0,
+        max_reconnect_attempts: int = 10,
+        monitor: ThroughputMonitor | None = None,
+        cache: OutputCache | None = None,
+        recorder: OutputCache | None = None,
+    ):
+        self.server_address = server_address
+        self.client_id = str(uuid.uuid4())
+        self.stream_outputs = stream_outputs
+        self.monitor = monitor
+        self.cache = cache
+        self.recorder = recorder
+        self.heartbeat_interval = heartbeat_interval
+        self.max_reconnect_attempts = max_reconnect_attempts
+        # All REST calls share keep-alive connections
+        self.session = HTTPSession(server_address, timeout)
+
+        # Jobs queued by this client, keyed by prompt_id
+        self._jobs: dict[str, _Job] = {}
+        # prompt_id -> [(message type, data)] received before the job was
+        # registered, see _register()
+        self._early: OrderedDict[str, list] = OrderedDict()
+        # Set once the websocket is lost for good
+        self._broken: Exception | None = None
+        # Guards _jobs, _early and _broken only: no I/O and no future is
+        # resolved while it is held
+        self._jobs_lock = threading.Lock()
+        # (prompt_id, node) currently executing, binary frames belong to it
+        self._executing = (None, None)
+        # Model key of the last job that started, see _model_key()
+        self._loaded_models = None
+        # Fetching /history and /view happens off the reader thread so that
+        # websocket events for the next jobs keep being consumed
+        self._fetch_executor = ThreadPoolExecutor(max_workers=4)
+        self._closing = False
+
+        self.ws = None
+        self.ws = self._connect_ws()
+        self._reader = threading.Thread(target=self._read_events, daemon=True)
+        self._reader.start()
 
     def __del__(self):
-        self.ws.close()
+        self.close()
+
+    def close(self):
+        self._closing = True
+        if self.ws is not None:
+            self.ws.close()
+        self._fetch_executor.shutdown(wait=False)
+        self.session.close()
+
+    def _connect_ws(self) -> websocket.WebSocket:
+        ws = websocket.WebSocket()
+        # Without a timeout a blackholed host hangs until the OS gives up
+        ws.connect(
+            "ws://{}/ws?clientId={}".format(self.server_address, self.client_id),
+            timeout=self.session.timeout,
+        )
+        # recv() wakes up regularly so that a ping can be sent on idle links
+        ws.settimeout(self.heartbeat_interval)
+        return ws
+
+    def http_stats(self) -> dict[str, dict]:
+        return self.session.latency.snapshot()
 
     def _queue_prompt(self, prompt):
         p = {"prompt": prompt, "client_id": self.client_id}
         data = json.dumps(p).encode("utf-8")
-        req = urllib.request.Request(
-            "http://{}/prompt".format(self.server_address), data=data
-        )
-        return json.loads(urllib.request.urlopen(req).read())
+        return json.loads(self.session.request("POST", "/prompt", data))
 
-    def _get_image(self, filename, subfolder, folder_type):
+    def _get_view(self, filename, subfolder, folder_type):
         data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
         url_values = urllib.parse.urlencode(data)
-        with urllib.request.urlopen(
-            "http://{}/view?{}".format(self.server_address, url_values)
-        ) as response:
-            return response.read()
+        return self.session.request("GET", "/view?{}".format(url_values))
 
-    def _get_audio(self, filename, subfolder, folder_type):
-        data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-        url_values = urllib.parse.urlencode(data)
-        with urllib.request.urlopen(
-            "http://{}/view?{}".format(self.server_address, url_values)
-        ) as response:
-            return response.read()
+    def _get_queue(self):
+        return json.loads(self.session.request("GET", "/queue"))
+
+    def get_queue_depth(self) -> int:
+        """Number of jobs running or pending on the server, from any client"""
+        queue = self._get_queue()
+        return len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
 
     def _get_history(self, prompt_id):
-        with urllib.request.urlopen(
-            "http://{}/history/{}".format(self.server_address, prompt_id)
-        ) as response:
-            return json.loads(response.read())
+        return json.loads(self.session.request("GET", "/history/{}".format(prompt_id)))
 
-    def _generate_outputs(self, ws, prompt):
-        prompt_id = self._queue_prompt(prompt)["prompt_id"]
-        output_data = {}
+    def _recv(self):
+        """Receive the next data frame, sending pings while the link is idle
+
+        Raises ConnectionError if nothing (not even a pong) arrived for three
+        heartbeat intervals.
+        """
+        last_received = time.monotonic()
         while True:
-            out = ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
-                if message["type"] == "executing":
-                    data = message["data"]
-                    if data["node"] is None and data["prompt_id"] == prompt_id:
-                        break  # Execution is done
-            else:
-                continue  # previews are binary data
+            try:
+                opcode, data = self.ws.recv_data(control_frame=True)
+            except websocket.WebSocketTimeoutException:
+                if time.monotonic() - last_received > 3 * self.heartbeat_interval:
+                    raise ConnectionError("ComfyUI websocket heartbeat timed out")
+                self.ws.ping()
+                continue
+            last_received = time.monotonic()
+            if opcode == websocket.ABNF.OPCODE_TEXT:
+                return data.decode("utf-8")
+            if opcode == websocket.ABNF.OPCODE_BINARY:
+                return data
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                raise ConnectionError("ComfyUI websocket closed by the server")
+            # Pings are answered by websocket-client, pongs only prove liveness
+
+    def _reconnect(self) -> bool:
+        for attempt in range(self.max_reconnect_attempts):
+            if self._closing:
+                return False
+            time.sleep(min(2**attempt, 30))
+            try:
+                self.ws = self._connect_ws()
+            except Exception as e:
+                print(f"Reconnecting to ComfyUI {self.server_address} failed: {e}")
+                continue
+            self._executing = (None, None)
+            self._recover_jobs()
+            return True
+        return False
 
+    def _recover_jobs(self):
+        """Find out what happened to in-flight jobs while the websocket was down
+
+        Only the snapshot of the jobs and their removal hold _jobs_lock; the
+        HTTP calls and the futures run without it, since resolving a future
+        runs callbacks (e.g. ComfyUIPool._on_done) that take their own locks.
+        """
+        with self._jobs_lock:
+            jobs = dict(self._jobs)
+        try:
+            queue = self._get_queue()
+        except Exception as e:
+            print(f"Cannot read ComfyUI queue while recovering jobs: {e}")
+            return
+        queued = {
+            item[1]
+            for item in queue.get("queue_running", []) + queue.get("queue_pending", [])
+        }
+        for prompt_id, job in jobs.items():
+            try:
+                history = self._get_history(prompt_id).get(prompt_id)
+            except Exception:
+                continue  # keep waiting, the job is not known to be lost
+            if history is not None:
+                if self._pop_job(prompt_id) is None:
+                    continue  # settled meanwhile
+                if history.get("status", {}).get("status_str") == "error":
+                    job.future.set_exception(
+                        RuntimeError(f"ComfyUI job {prompt_id} failed")
+                    )
+                elif job.streamed:
+                    # Streamed images were sent to the dropped socket and
+                    # are not stored on the server
+                    self._requeue(prompt_id, job)
+                else:
+                    self._fetch_executor.submit(self._resolve_outputs, prompt_id, job)
+            elif prompt_id not in queued or any(job.streamed.values()):
+                # Lost by the server, or the frames of its output node were
+                # cut off: render it again
+                if self._pop_job(prompt_id) is not None:
+                    self._requeue(prompt_id, job)
+
+    def _requeue(self, old_prompt_id, job: _Job):
+        # Called without _jobs_lock, the job was already removed from _jobs
+        job.reset()
+        try:
+            prompt_id = self._queue_prompt(job.prompt)["prompt_id"]
+        except Exception as e:
+            job.future.set_exception(e)
+            return
+        print(f"ComfyUI job {old_prompt_id} was lost, queued again as {prompt_id}")
+        self._register(prompt_id, job)
+
+    def _read_events(self):
+        """Dispatch websocket events to the futures of the jobs they belong to"""
+        while True:
+            try:
+                out = self._recv()
+            except Exception as e:
+                if self._closing:
+                    return
+                print(f"ComfyUI websocket to {self.server_address} dropped: {e}")
+                self.ws.close()
+                if self._reconnect():
+                    continue
+                self._fail_pending(e)
+                return
+            if not isinstance(out, str):
+                # Output images of SaveImageWebsocket nodes, or previews
+                prompt_id, node_id = self._executing
+                self._dispatch(prompt_id, "binary", {"node": node_id, "frame": out})
+                continue
+
+            message = json.loads(out)
+            data = message.get("data", {})
+            prompt_id = data.get("prompt_id")
+            if message["type"] == "executing":
+                self._executing = (prompt_id, data["node"])
+            if message["type"] in (
+                "execution_start",
+                "execution_cached",
+                "progress",
+                "executing",
+                *TERMINAL_EVENTS,
+            ):
+                self._dispatch(prompt_id, message["type"], data)
+
+    def _dispatch(self, prompt_id, message_type, data):
+        if prompt_id is None:
+            return
+        with self._jobs_lock:
+            job = self._jobs.get(prompt_id)
+            if job is None:
+                # POST /prompt has not returned yet, _register() replays them
+                self._early.setdefault(prompt_id, []).append((message_type, data))
+                while len(self._early) > EARLY_EVENT_PROMPTS:
+                    self._early.popitem(last=False)
+                return
+            finished = self._track(prompt_id, job, message_type, data)
+        if finished:
+            self._settle(prompt_id, job, message_type, data)
+        elif message_type == "progress":
+            job.report_progress(data)
+
+    def _track(self, prompt_id, job: _Job, message_type, data) -> bool:
+        """Apply one event to the job, True (and the job removed) when it ended
+
+        Called with _jobs_lock held: bookkeeping only, no I/O and no futures.
+        """
+        if message_type == "binary":
+            job.add_frame(data["node"], data["frame"])
+            return False
+        if message_type in ("execution_start", "execution_cached", "progress"):
+            if message_type == "execution_start":
+                job.model_swap = job.model_key != self._loaded_models
+                self._loaded_models = job.model_key
+            job.handle_event(message_type, data)
+            return False
+        if message_type == "executing":
+            if data["node"] is not None:
+                return False
+            # Execution is done
+            job.finished_at = time.time()
+        del self._jobs[prompt_id]
+        return True
+
+    def _settle(self, prompt_id, job: _Job, message_type, data):
+        # Called without _jobs_lock, after _track() removed the job
+        if message_type == "executing":
+            self._fetch_executor.submit(self._resolve_outputs, prompt_id, job)
+        else:
+            job.future.set_exception(
+                RuntimeError(
+                    "ComfyUI job {} failed: {}".format(
+                        prompt_id, data.get("exception_message", message_type)
+                    )
+                )
+            )
+
+    def _register(self, prompt_id, job: _Job):
+        """Track a job POST /prompt just queued
+
+        Events the reader received for it before the POST returned are
+        replayed; the job may even have finished already.
+        """
+        finished = None
+        with self._jobs_lock:
+            broken = self._broken
+            if broken is None:
+                self._jobs[prompt_id] = job
+                for message_type, data in self._early.pop(prompt_id, []):
+                    if self._track(prompt_id, job, message_type, data):
+                        finished = (message_type, data)
+                        break
+        if broken is not None:
+            job.future.set_exception(broken)
+        elif finished is not None:
+            self._settle(prompt_id, job, *finished)
+
+    def _pop_job(self, prompt_id):
+        with self._jobs_lock:
+            return self._jobs.pop(prompt_id, None)
+
+    def _fail_pending(self, error):
+        error = ConnectionError("ComfyUI websocket closed: {}".format(error))
+        with self._jobs_lock:
+            # Jobs whose POST is still in flight are failed by _register()
+            self._broken = error
+            jobs, self._jobs = self._jobs, {}
+            self._early.clear()
+        for job in jobs.values():
+            job.future.set_exception(error)
+
+    def _resolve_outputs(self, prompt_id, job: _Job):
+        try:
+            outputs = dict(job.streamed)
+            if job.needs_history or not job.streamed:
+                outputs.update(self._fetch_outputs(prompt_id))
+        except Exception as e:
+            job.future.set_exception(e)
+            return
+        if self.monitor is not None:
+            self.monitor.record(job.stats(prompt_id, self.server_address, outputs))
+        job.future.set_result(outputs)
+
+    def _fetch_outputs(self, prompt_id):
+        output_data = {}
         history = self._get_history(prompt_id)[prompt_id]
         for node_id in history["outputs"]:
             node_output = history["outputs"][node_id]
@@ -73,7 +1219,7 @@ class ComfyUI:
             # 处理图像输出
             if "images" in node_output:
                 for image in node_output["images"]:
-                    data = self._get_image(
+                    data = self._get_view(
                         image["filename"], image["subfolder"], image["type"]
                     )
                     outputs.append(("image", data))
@@ -81,7 +1227,7 @@ class ComfyUI:
             # 处理音频输出
             if "audio" in node_output:
                 for audio in node_output["audio"]:
-                    data = self._get_audio(
+                    data = self._get_view(
                         audio["filename"], audio["subfolder"], audio["type"]
                     )
                     outputs.append(("audio", data))
@@ -90,83 +1236,315 @@ class ComfyUI:
 
         return output_data
 
-    def _generate_images(self, ws, prompt):
-        outputs = self._generate_outputs(ws, prompt)
-        output_images = {}
+    def submit(self, prompt, label=None, on_progress=None) -> Future:
+        job = _Job(prompt, Future(), label, on_progress)
+        # The POST runs without _jobs_lock so that the reader thread keeps
+        # consuming events; those of this prompt wait in _early meanwhile
+        try:
+            prompt_id = self._queue_prompt(prompt)["prompt_id"]
+        except Exception as e:
+            job.future.set_exception(e)
+            return job.future
+        self._register(prompt_id, job)
+        return job.future
 
-        for node_id, data_list in outputs.items():
-            images_output = []
-            for data_type, data in data_list:
-                if data_type == "image":
-                    images_output.append(data)
-            output_images[node_id] = images_output
 
-        return output_images
+class _PoolJob(NamedTuple):
+    """A job waiting in ComfyUIPool for a server"""
 
-    def _generate_audio_files(self, ws, prompt):
-        outputs = self._generate_outputs(ws, prompt)
-        output_audio = {}
+    prompt: dict
+    options: dict  # keyword arguments of ComfyUI.submit()
+    future: Future
+    tried: frozenset  # addresses of servers that failed to run it
+    model_key: tuple
+    seq: int  # submission order
 
-        for node_id, data_list in outputs.items():
-            audio_output = []
-            for data_type, data in data_list:
-                if data_type == "audio":
-                    audio_output.append(data)
-            output_audio[node_id] = audio_output
 
-        return output_audio
+def _count_changes(keys) -> int:
+    changes, previous = 0, None
+    for key in keys:
+        if key != previous:
+            changes += 1
+        previous = key
+    return changes
 
-    def generate_image(
+
+class ComfyUIPool(WorkflowClient):
+    """Spread jobs over several ComfyUI servers
+
+    Jobs are kept in a local queue and handed to the least-loaded server (its
+    /queue depth plus our own in-flight jobs) whenever that server has fewer
+    than `per_server_depth` of our jobs queued, so faster GPUs naturally take
+    more work. A job whose server dies is moved to another server.
+
+    Each server is given the pending job that best matches the models it
+    loaded last (see _model_key), so jobs run grouped by checkpoint instead
+    of evicting and reloading models between templates.
+    """
+
+    def __init__(
         self,
-        prompt_file: str,
-        positive_prompt: str,
-        negative_prompt: str | None = None,
-        seed: int | None = None,
-        batch_size: int = 1,
-    ) -> List[Image.Image]:
-        with open(prompt_file, "r", encoding="utf-8") as file:
-            self.prompt = json.loads(file.read())
-        self.prompt["6"]["inputs"]["text"] = positive_prompt
-        if negative_prompt is not None:
-            self.prompt["7"]["inputs"]["text"] = negative_prompt
-        else:
-            self.prompt["7"]["inputs"]["text"] = (
-                "(nsfw:1.1), text, watermark, nude, lowres, worst quality, bad quality, bad, jpeg artifacts, unfinished, extra digits, scan, [abstract], sketch, bad anatomy, artistic error, duplicate, mutation, deformed, disfigured, artist name, ai-generated, ai-assisted"
+        server_addresses: List[str],
+        per_server_depth: int = 2,
+        queue_poll_interval: float = 2.0,
+        revive_interval: float = 30.0,
+        stream_outputs: bool = False,
+        timeout: float = 60.0,
+        monitor: ThroughputMonitor | None = None,
+        cache: OutputCache | None = None,
+        recorder: OutputCache | None = None,
+    ):
+        self.server_addresses = list(server_addresses)
+        self.stream_outputs = stream_outputs
+        self.timeout = timeout
+        self.monitor = monitor
+        # Checked before jobs are queued, the servers themselves do not cache
+        self.cache = cache
+        self.recorder = recorder
+        self.per_server_depth = per_server_depth
+        self.queue_poll_interval = queue_poll_interval
+        self.revive_interval = revive_interval
+
+        self._lock = threading.RLock()
+        self._pending: deque[_PoolJob] = deque()
+        self._submitted = 0
+        self._clients: dict[str, ComfyUI | None] = {}
+        self._in_flight = {address: 0 for address in self.server_addresses}
+        # address -> (jobs from other clients at poll time, poll timestamp)
+        self._foreign_depth = {address: (0, 0.0) for address in self.server_addresses}
+        self._dead_since: dict[str, float] = {}
+        # Model key of the last job handed to each server
+        self._resident: dict[str, tuple | None] = {
+            address: None for address in self.server_addresses
+        }
+        # (submission number, model key) of the jobs handed to each server
+        self._dispatched = {address: [] for address in self.server_addresses}
+
+        # Servers being reconnected or polled in the background, see _pump()
+        self._reviving: set[str] = set()
+        self._polling: set[str] = set()
+        self._background = ThreadPoolExecutor(max_workers=4)
+        self._closing = False
+
+        for address in self.server_addresses:
+            self._set_client(address, self._open(address))
+        if not any(self._clients.values()):
+            raise ConnectionError(
+                "None of the ComfyUI servers is reachable: {}".format(
+                    ", ".join(self.server_addresses)
+                )
             )
-        if seed is None:
-            self.prompt["3"]["inputs"]["seed"] = random.randint(0, 1000000)
-        else:
-            self.prompt["3"]["inputs"]["seed"] = seed
 
-        self.prompt["5"]["inputs"]["batch_size"] = batch_size
+    def close(self):
+        self._closing = True
+        self._background.shutdown(wait=False)
+        for client in self._clients.values():
+            if client is not None:
+                client.close()
 
-        images = self._generate_images(self.ws, self.prompt)
-        return [Image.open(io.BytesIO(image)) for image in images.get("13", [])]
+    def http_stats(self) -> dict[str, dict]:
+        with self._lock:
+            clients = [client for client in self._clients.values() if client]
+        return LatencyStats.merge(client.http_stats() for client in clients)
 
-    def generate_audio(
-        self,
-        prompt_file: str,
-        positive_prompt: str,
-        negative_prompt: str | None = None,
-        seed: int | None = None,
-        duration_seconds: int = 10,
-        batch_size: int = 1,
-    ) -> List[bytes]:
-        with open(prompt_file, "r", encoding="utf-8") as file:
-            self.prompt = json.loads(file.read())
+    def _open(self, address) -> ComfyUI | None:
+        """Connect to a server, None when it is unreachable
 
-        self.prompt["6"]["inputs"]["text"] = positive_prompt
-        if negative_prompt is not None:
-            self.prompt["7"]["inputs"]["text"] = negative_prompt
+        Called without the lock, connecting can take up to `timeout`.
+        """
+        try:
+            # Give up on a dropped server quickly, its jobs are rerouted
+            return ComfyUI(
+                address,
+                timeout=self.timeout,
+                max_reconnect_attempts=3,
+                monitor=self.monitor,
+            )
+        except Exception as e:
+            print(f"ComfyUI server {address} is unavailable: {e}")
+            return None
 
-        if seed is None:
-            self.prompt["3"]["inputs"]["seed"] = random.randint(0, 1000000)
+    def _set_client(self, address, client: ComfyUI | None):
+        # Called with the lock held
+        self._clients[address] = client
+        if client is None:
+            self._dead_since[address] = time.monotonic()
         else:
-            self.prompt["3"]["inputs"]["seed"] = seed
+            self._dead_since.pop(address, None)
+
+    def _pick_job(self, address):
+        """Pending job for `address`: same models first, then most shared models"""
+        resident = self._resident[address] or ()
+        candidates = [job for job in self._pending if address not in job.tried]
+        if not candidates:
+            return None
+        return max(
+            candidates,
+            key=lambda job: (
+                job.model_key == resident,
+                len(set(job.model_key) & set(resident)),
+                -job.seq,
+            ),
+        )
+
+    def _revive(self, address):
+        """Reconnect to a dead server, in the background"""
+        client = self._open(address)
+        with self._lock:
+            self._set_client(address, client)
+            self._reviving.discard(address)
+        self._pump()
 
-        # Set duration and batch size
-        self.prompt["11"]["inputs"]["seconds"] = duration_seconds
-        self.prompt["11"]["inputs"]["batch_size"] = batch_size
+    def _poll(self, address, client: ComfyUI):
+        """Refresh the number of jobs other clients queued on a server
 
-        audio_files = self._generate_audio_files(self.ws, self.prompt)
-        return audio_files.get("13", [])
+        Only jobs from other clients are read from /queue, our own are
+        counted locally so that bursts of submissions are spread at once.
+        """
+        try:
+            depth = client.get_queue_depth()
+        except Exception:
+            depth = None
+        with self._lock:
+            if depth is None:
+                depth = self._in_flight[address]
+            foreign = max(0, depth - self._in_flight[address])
+            self._foreign_depth[address] = (foreign, time.monotonic())
+            self._polling.discard(address)
+
+    def _pump(self):
+        """Hand pending jobs to servers that have room for them
+
+        The lock only guards the bookkeeping. Reconnecting to dead servers
+        and polling /queue run on background threads, POST /prompt and the
+        callers' futures after the lock is released, so that a slow or
+        blackholed server cannot hold up submit() or the completions of the
+        other servers.
+        """
+        now = time.monotonic()
+        failed = []  # (job, error)
+        assigned = []  # (client, address, job)
+        with self._lock:
+            revive = [
+                address
+                for address, dead_since in self._dead_since.items()
+                if now - dead_since > self.revive_interval
+                and address not in self._reviving
+            ]
+            poll = [
+                (address, client)
+                for address, client in self._clients.items()
+                if client is not None
+                and now - self._foreign_depth[address][1] > self.queue_poll_interval
+                and address not in self._polling
+            ]
+            self._reviving.update(revive)
+            self._polling.update(address for address, _ in poll)
+
+            for job in list(self._pending):
+                if job.tried >= set(self.server_addresses):
+                    self._pending.remove(job)
+                    failed.append(
+                        (job, ConnectionError("No ComfyUI server could run the job"))
+                    )
+
+            servers = sorted(
+                (address for address, client in self._clients.items() if client),
+                key=lambda address: (
+                    self._foreign_depth[address][0] + self._in_flight[address]
+                ),
+            )
+            for address in servers:
+                while self._in_flight[address] < self.per_server_depth:
+                    job = self._pick_job(address)
+                    if job is None:
+                        break
+                    self._pending.remove(job)
+                    self._in_flight[address] += 1
+                    self._resident[address] = job.model_key
+                    self._dispatched[address].append((job.seq, job.model_key))
+                    assigned.append((self._clients[address], address, job))
+
+            if (
+                self._pending
+                and not any(self._in_flight.values())
+                and not self._reviving
+            ):
+                # No server can take the remaining jobs and nothing in flight
+                # (or reconnecting) will trigger another attempt
+                while self._pending:
+                    failed.append(
+                        (
+                            self._pending.popleft(),
+                            ConnectionError("No available ComfyUI server for the job"),
+                        )
+                    )
+
+        if not self._closing:
+            for address in revive:
+                self._background.submit(self._revive, address)
+            for address, client in poll:
+                self._background.submit(self._poll, address, client)
+        for client, address, job in assigned:
+            inner = client.submit(job.prompt, **job.options)
+            # Runs right away, on this thread, if the POST already failed
+            inner.add_done_callback(
+                lambda done, address=address, job=job: self._on_done(address, job, done)
+            )
+        for job, error in failed:
+            job.future.set_exception(error)
+
+    def _on_done(self, address, job: _PoolJob, done: Future):
+        future = job.future
+        error = done.exception()
+        dead = None
+        with self._lock:
+            self._in_flight[address] -= 1
+            rerouted = isinstance(error, OSError)
+            if rerouted:
+                # The server died (or is unreachable), retry elsewhere
+                print(f"ComfyUI server {address} failed ({error}), rerouting job")
+                dead = self._clients.get(address)
+                if dead is not None:
+                    self._set_client(address, None)
+                self._pending.appendleft(job._replace(tried=job.tried | {address}))
+        # Closing the websocket and resolving the caller's future both happen
+        # after the lock is released
+        if dead is not None:
+            dead.close()
+        if not rerouted:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(done.result())
+        self._pump()
+
+    def model_swaps(self) -> tuple[int, int]:
+        """Model changes of the dispatched jobs, and in submission (FIFO) order
+
+        Both count per server over the same jobs, the first load included.
+        """
+        swaps = fifo_swaps = 0
+        with self._lock:
+            for dispatched in self._dispatched.values():
+                swaps += _count_changes(key for _, key in dispatched)
+                fifo_swaps += _count_changes(key for _, key in sorted(dispatched))
+        return swaps, fifo_swaps
+
+    def submit(self, prompt, label=None, on_progress=None) -> Future:
+        future = Future()
+        options = {"label": label, "on_progress": on_progress}
+        with self._lock:
+            self._submitted += 1
+            self._pending.append(
+                _PoolJob(
+                    prompt,
+                    options,
+                    future,
+                    frozenset(),
+                    _model_key(prompt),
+                    self._submitted,
+                )
+            )
+        self._pump()
+        return future
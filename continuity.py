@@ -0,0 +1,195 @@
+import os
+import re
+import json
+import math
+import hashlib
+from typing import Callable
+from models.limits import estimate_tokens
+
+
+def _tokenize(text: str) -> list[str]:
+    """Words for Latin text, character bigrams for Chinese/Japanese text"""
+    tokens = re.findall(r"[a-z0-9]+", text.lower())
+    for run in re.findall(r"[\u3040-\u30ff\u4e00-\u9fff]+", text):
+        if len(run) == 1:
+            tokens.append(run)
+        tokens.extend(run[k : k + 2] for k in range(len(run) - 1))
+    return tokens
+
+
+class BM25:
+    """Okapi BM25 over a growing list of documents"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents: list[dict[str, int]] = []
+        self.lengths: list[int] = []
+        self.document_frequency: dict[str, int] = {}
+
+    def add(self, tokens: list[str]):
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token in counts:
+            self.document_frequency[token] = self.document_frequency.get(token, 0) + 1
+        self.documents.append(counts)
+        self.lengths.append(len(tokens))
+
+    def scores(self, query: list[str]) -> list[float]:
+        if not self.documents:
+            return []
+        n = len(self.documents)
+        average_length = sum(self.lengths) / n or 1
+        scores = []
+        for counts, length in zip(self.documents, self.lengths):
+            score = 0.0
+            for token in set(query):
+                frequency = counts.get(token)
+                if not frequency:
+                    continue
+                df = self.document_frequency[token]
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                score += (
+                    idf
+                    * frequency
+                    * (self.k1 + 1)
+                    / (
+                        frequency
+                        + self.k1 * (1 - self.b + self.b * length / average_length)
+                    )
+                )
+            scores.append(score)
+        return scores
+
+
+class ContinuityMemory:
+    """What earlier chapters established, within a fixed token budget
+
+    Every finished chapter (or script) adds a rolling summary and its
+    passages to a BM25 index. context() returns the most recent summaries
+    plus the passages most relevant to the next chapter, so prompts stay the
+    same size however long the story gets.
+
+    Without a summarizer (e.g. for Ren'Py scripts) the opening of the latest
+    entry is included instead, as a format and style reference.
+    """
+
+    def __init__(
+        self,
+        token_budget: int,
+        summarizer: Callable[[str, str], str] | None = None,
+        summary_file: str | None = None,
+        passage_chars: int = 600,
+        recent_entries: int = 3,
+    ):
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+        self.summary_file = summary_file
+        self.passage_chars = passage_chars
+        self.recent_entries = recent_entries
+        self.entries: list[dict] = []
+        # (entry index, passage text), in the order of self.index
+        self.passages: list[tuple[int, str]] = []
+        self.index = BM25()
+        # sha1 of the entry name and text -> summary, survives reruns
+        self._summaries = {}
+        if summary_file and os.path.exists(summary_file):
+            with open(summary_file, "r", encoding="utf-8") as f:
+                self._summaries = json.load(f)
+
+    def _split(self, text: str) -> list[str]:
+        """Passages of about passage_chars, cut at paragraph boundaries"""
+        passages, current = [], ""
+        for paragraph in re.split(r"\n\s*\n", text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if current and len(current) + len(paragraph) > self.passage_chars:
+                passages.append(current)
+                current = ""
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+            while len(current) > 2 * self.passage_chars:
+                passages.append(current[: self.passage_chars])
+                current = current[self.passage_chars :]
+        if current:
+            passages.append(current)
+        return passages
+
+    def add(self, name: str, text: str):
+        """Remember a finished chapter"""
+        summary = None
+        if self.summarizer is not None:
+            digest = hashlib.sha1(f"{name}\n{text}".encode("utf-8")).hexdigest()
+            summary = self._summaries.get(digest)
+            if summary is None:
+                summary = self.summarizer(name, text)
+                self._summaries[digest] = summary
+                if self.summary_file:
+                    os.makedirs(os.path.dirname(self.summary_file), exist_ok=True)
+                    with open(self.summary_file, "w", encoding="utf-8") as f:
+                        json.dump(self._summaries, f, ensure_ascii=False, indent=2)
+
+        entry_index = len(self.entries)
+        self.entries.append({"name": name, "text": text, "summary": summary})
+        for passage in self._split(text):
+            self.passages.append((entry_index, passage))
+            self.index.add(_tokenize(f"{name}\n{passage}"))
+
+    def context(self, query: str) -> str:
+        """Recent summaries plus passages relevant to query, within token_budget"""
+        if not self.entries:
+            return ""
+        budget = self.token_budget
+        sections = []
+
+        # Half the budget at most for the latest entries, newest first
+        recent = []
+        recent_budget = budget // 2
+        for entry in reversed(self.entries[-self.recent_entries :]):
+            if entry["summary"] is not None:
+                block = f"[{entry['name']} summary]:\n{entry['summary']}"
+            else:
+                # Opening of the latest entry as a format reference
+                header = f"[{entry['name']} excerpt]:\n"
+                block = header + _truncate(
+                    entry["text"], recent_budget - estimate_tokens(header)
+                )
+            cost = estimate_tokens(block)
+            if cost > recent_budget:
+                break
+            recent.insert(0, block)
+            recent_budget -= cost
+            budget -= cost
+            if entry["summary"] is None:
+                break  # one excerpt is enough for the format
+        sections.extend(recent)
+
+        # The rest for the passages most relevant to the next chapter
+        scores = self.index.scores(_tokenize(query))
+        ranked = sorted(
+            (k for k, score in enumerate(scores) if score > 0),
+            key=lambda k: scores[k],
+            reverse=True,
+        )
+        chosen = []
+        for k in ranked:
+            entry_index, passage = self.passages[k]
+            block = f"[{self.entries[entry_index]['name']}]:\n{passage}"
+            cost = estimate_tokens(block)
+            if cost > budget:
+                continue
+            chosen.append(k)
+            budget -= cost
+        # Story order reads better than score order
+        sections.extend(
+            f"[{self.entries[self.passages[k][0]]['name']}]:\n{self.passages[k][1]}"
+            for k in sorted(chosen)
+        )
+        return "\n\n".join(sections)
+
+
+def _truncate(text: str, token_budget: int) -> str:
+    """Cut text to roughly token_budget tokens, see estimate_tokens()"""
+    limit = max(0, token_budget * 2 - 20)
+    return text if len(text) <= limit else text[:limit] + "\n..."
@@ -3,6 +3,7 @@ REASONING_MODEL_API_BASE_URL = "https://api.deepseek.com/v1"
 REASONING_MODEL_API_KEY = "sk-abcdefghijklmnopqrstuvwxyz1234567890"
 REASONING_MODEL_NAME = "deepseek-reasoner"      # Recommended: DeepSeek-R1-0528、Gemini 2.5 Pro/Flash
 REASONING_MODEL_TEMPERATURE = 0.7
+REASONING_MODEL_MAX_TOKENS = None     # Max output tokens per request, None for the provider default
 
 GENERAL_MODEL_API_BASE_URL = "https://api.deepseek.com/v1"
 GENERAL_MODEL_API_KEY = "sk-abcdefghijklmnopqrstuvwxyz1234567890"
@@ -25,8 +26,93 @@ LINT_MODEL_NAME = "Qwen/Qwen2.5-72B-Instruct"
 LINT_MODEL_TEMPERATURE = 0.7
 
 COMFY_UI_SERVER_ADDRESS = "127.0.0.1:8188"
+# All ComfyUI servers to use; image/audio jobs go to the least busy one
+COMFY_UI_SERVER_ADDRESSES = [COMFY_UI_SERVER_ADDRESS]
+# Receive images of templates ending in a plain SaveImage node over the websocket
+# (SaveImageWebsocket) instead of saving them on the server. Has NO effect with the
+# bundled image/*.json templates, which save WEBP through SaveImageExtended; only
+# useful with your own SaveImage templates. Sampling previews are not turned off
+# per job, start ComfyUI with --preview-method none for that
+COMFY_UI_STREAM_OUTPUTS = False
+COMFY_UI_HTTP_TIMEOUT = 60      # Seconds, for every REST call to ComfyUI
+# Reuse images/audio generated from identical workflow parameters, off by default.
+# While it is set (e.g. "./cache/comfyui"), seeds are derived from the prompts
+# instead of being random, so rerunning a theme gives the same pictures.
+COMFY_UI_CACHE_DIR = None
+COMFY_UI_CACHE_MAX_MB = 2048
 
-MAX_CONCURRENT_REQUESTS = 1     # No need to change
+# Opt-in SQLite cache of LLM responses, e.g. "./cache/llm.sqlite3"; None to disable.
+# Rerunning the workflow then only pays for prompts that changed.
+LLM_CACHE_PATH = None
+LLM_CACHE_TTL_HOURS = 24 * 7    # None to keep entries forever
+LLM_CACHE_MAX_ENTRIES = 20000   # Least recently used entries are dropped first
+# Stages that always call the models, e.g. ["draft"] for a fresh story on every run.
+# Names: draft, parse, chapters, scripts, image_prompts, audio_prompts, images, lint
+LLM_CACHE_BYPASS_STAGES = []
+
+# Run steps 4-9 as per-chapter tasks (chapter text -> script -> image/audio prompts
+# -> images/audio) that start as soon as their inputs exist, so ComfyUI renders the
+# first chapters while later ones are still being written. False runs the steps
+# one after another.
+PIPELINE_SCHEDULER = True
+PIPELINE_LLM_WORKERS = 4    # Chapter tasks calling the language models at once
+PIPELINE_GPU_WORKERS = 2    # Chapter tasks rendering on ComfyUI at once
+
+# Render each character's base sprite and the key location backgrounds right
+# after the draft is parsed, while the chapters are still being written; the
+# scripts are told to reuse these image names
+EARLY_ASSETS = True
+EARLY_BACKGROUND_COUNT = 6  # Key locations drawn from the draft at most
+
+# Games generated at once by batch.py, which reads a JSONL queue of themes and
+# output directories and never asks for input
+BATCH_CONCURRENT_GAMES = 2
+
+# Directory holding every file generated by main.py for the current game.
+# Point it at fast local storage (an NVMe disk or tmpfs) to speed up the many
+# small reads and writes; two runs cannot share one workspace at a time
+WORKSPACE_ROOT = "./temp"
+
+# Tokens of earlier chapters/scripts included when generating the next one
+# (recent summaries plus the most relevant passages), independent of story length
+CONTINUITY_TOKEN_BUDGET = 6000
+
+# Limits of each API endpoint (the *_API_BASE_URL values, "gemini" for the default
+# Gemini endpoint) for the model calls sent to it.
+# Concurrency starts at initial_concurrency, grows while requests succeed and halves
+# when the provider rate limits or fails, never exceeding concurrency.
+# rpm: requests per minute, tpm: tokens per minute, None for no limit.
+DEFAULT_PROVIDER_LIMITS = {"concurrency": 16, "initial_concurrency": 4, "rpm": 60, "tpm": None}
+PROVIDER_LIMITS = {
+    # "https://api-inference.modelscope.cn/v1/": {"concurrency": 8, "rpm": 120, "tpm": 400000},
+}
+# Rate limits (429), server errors and dropped connections are retried with
+# exponential backoff and jitter, waiting at least as long as Retry-After asks.
+MODEL_RETRY_ATTEMPTS = 5                # Attempts per call, including the first
+MODEL_RETRY_BACKOFF_SECONDS = 2         # Doubled for every further attempt...
+MODEL_RETRY_MAX_BACKOFF_SECONDS = 60    # ...up to this
+# Retries each stage may spend over all of its calls (stage names as for
+# LLM_CACHE_BYPASS_STAGES); stages not listed use "default", None for no budget.
+STAGE_RETRY_BUDGETS = {"default": 30}
+# Endpoints (*_API_BASE_URL values) that accept a JSON schema as response_format,
+# e.g. "https://api.openai.com/v1/"; the others are asked for plain JSON mode.
+# Malformed JSON is repaired locally first, then with a short "fix this JSON" request.
+JSON_SCHEMA_ENDPOINTS = []
+# Long system prompts (outline, world view, character settings) sent to Gemini are
+# stored as explicit context caches for this many seconds; None sends them inline.
+# Gemini rejects caches below a minimum size, 4096 tokens for the 2.5 Pro models.
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = 3600
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = 4096
+
+# USD per million input/output tokens by model name, for the cost column of the
+# LLM usage report (./temp/logs/llm_usage.json). Models not listed show no cost.
+MODEL_PRICES = {
+    "deepseek-reasoner": {"input": 0.55, "output": 2.19},
+    "deepseek-chat": {"input": 0.27, "output": 1.10},
+}
+# Directory to record every LLM request/response and ComfyUI job of a run into,
+# for replaying it offline with scripts/replay_server.py. None disables recording.
+RECORD_FIXTURES_DIR = None
 MAX_RETRY_TIMES = 3     # Max retry times for image self-correction
 
 RENPY_PATH = "D:\\Tools\\renpy-8.3.4-sdk\\lib\\py3-windows-x86_64\\python.exe D:\\Tools\\renpy-8.3.4-sdk\\renpy.py"
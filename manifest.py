@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def file_hash(path):
+    """SHA-256 of a file's content, None when it does not exist"""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def input_hash(*inputs):
+    """Hash of everything an artifact is generated from
+
+    inputs: prompt templates, upstream artifact hashes, model_inputs(), ...;
+    anything JSON serializable.
+    """
+    payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def model_inputs(model):
+    """Name and sampling parameters of a ReasoningModel, GeneralModel, ..."""
+    llm = model.llm
+    return {
+        "model": llm.model,
+        "temperature": getattr(llm, "temperature", None),
+        "max_tokens": getattr(llm, "max_tokens", None),
+    }
+
+
+class BuildManifest:
+    """The inputs each artifact of a workspace was generated from
+
+    Every generated file is recorded with the input_hash() of its prompt
+    template, the hashes of the upstream files it was built from, and the
+    model and parameters used. A file is regenerated when that hash changes,
+    make-style: an edited chapter changes the inputs of its script, a new
+    script those of its prompts, and so on down to the images, while
+    everything that does not depend on the edit is kept.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(path)
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _key(self, artifact):
+        return os.path.relpath(artifact, self.root).replace(os.sep, "/")
+
+    def _load(self):
+        # Called with the lock held
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._entries = json.load(f)
+                except (OSError, ValueError):
+                    # A damaged manifest only costs regenerating artifacts
+                    self._entries = {}
+        return self._entries
+
+    def _save(self):
+        # Called with the lock held; replaced atomically, never half-written
+        os.makedirs(self.root or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+    def is_fresh(self, artifact, inputs):
+        """True when the artifact exists and was generated from `inputs`
+
+        A file with no record, e.g. left by a run before the manifest
+        existed, is taken as generated from `inputs` and recorded so.
+        """
+        if not os.path.exists(artifact):
+            return False
+        with self._lock:
+            entry = self._load().get(self._key(artifact))
+        if entry is None:
+            self.record(artifact, inputs)
+            return True
+        return entry["inputs"] == inputs
+
+    def record(self, artifact, inputs):
+        """Note that the artifact was just generated from `inputs`"""
+        entry = {"inputs": inputs, "output": file_hash(artifact)}
+        with self._lock:
+            self._load()[self._key(artifact)] = entry
+            self._save()
+
+    def reset(self):
+        """Forget every record, after the workspace was cleared"""
+        with self._lock:
+            self._entries = {}
@@ -0,0 +1,144 @@
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from config import (
+    LLM_CACHE_PATH,
+    LLM_CACHE_TTL_HOURS,
+    LLM_CACHE_MAX_ENTRIES,
+)
+
+
+class ResponseCache:
+    """SQLite cache of LLM responses
+
+    Entries older than `ttl_seconds` are ignored, and once more than
+    `max_entries` are stored the least recently used ones are deleted.
+    """
+
+    def __init__(self, path, ttl_seconds=None, max_entries=None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # While set, lookups miss and responses are not stored. A context
+        # variable, so that bypassing one stage does not affect stages that
+        # run concurrently in the pipeline scheduler
+        self._bypass = contextvars.ContextVar("llm_cache_bypass", default=False)
+        # model -> [hits, misses]
+        self.counts = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, value TEXT, "
+            "created_at REAL, accessed_at REAL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(model, messages, temperature, response_format=None):
+        """Hash of everything that determines the response"""
+        payload = json.dumps(
+            {
+                "model": model,
+                "messages": _normalize(messages),
+                "temperature": temperature,
+                "response_format": response_format,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, model):
+        """Stored response text, or None on a miss"""
+        with self._lock:
+            counts = self.counts.setdefault(model, [0, 0])
+            if self._bypass.get():
+                counts[1] += 1
+                return None
+            row = self._db.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or (
+                self.ttl_seconds is not None and now - row[1] > self.ttl_seconds
+            ):
+                counts[1] += 1
+                return None
+            self._db.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._db.commit()
+            counts[0] += 1
+            return row[0]
+
+    def put(self, key, model, value):
+        with self._lock:
+            if self._bypass.get():
+                return
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, model, value, now, now),
+            )
+            if self.max_entries is not None:
+                self._db.execute(
+                    "DELETE FROM responses WHERE key NOT IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+            self._db.commit()
+
+    @contextmanager
+    def bypassing(self, enabled=True):
+        """Skip the cache inside the block, e.g. for one stage of the workflow"""
+        token = self._bypass.set(enabled)
+        try:
+            yield
+        finally:
+            self._bypass.reset(token)
+
+
+def _normalize(messages):
+    """Make equivalent inputs hash alike: role names and surrounding whitespace"""
+    if isinstance(messages, str):
+        return messages.strip()
+    normalized = []
+    for message in messages:
+        if isinstance(message, dict):
+            role = message.get("role", "user").lower()
+            content = message.get("content")
+        else:
+            role, content = message
+            role = role.lower()
+        if role == "human":
+            role = "user"
+        if isinstance(content, str):
+            content = content.strip()
+        normalized.append({"role": role, "content": content})
+    return normalized
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The cache configured by LLM_CACHE_PATH, or None when it is disabled"""
+    global _response_cache
+    if not LLM_CACHE_PATH:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                LLM_CACHE_PATH,
+                ttl_seconds=LLM_CACHE_TTL_HOURS * 3600 if LLM_CACHE_TTL_HOURS else None,
+                max_entries=LLM_CACHE_MAX_ENTRIES,
+            )
+        return _response_cache
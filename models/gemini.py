@@ -1,18 +1,226 @@
+import asyncio
+import hashlib
+import itertools
+import threading
+import time
 from google import genai
 from google.genai import types
+from models.limits import get_limiter, estimate_tokens
+from models.retry import send, asend, send_stream
+from models.telemetry import get_telemetry
+from models.recorder import get_recorder
+from config import GEMINI_CONTEXT_CACHE_TTL_SECONDS, GEMINI_CONTEXT_CACHE_MIN_TOKENS
 
 
 class ChatGemini:
-    def __init__(self, model, api_key, base_url=None, temperature=0.7):
+    def __init__(
+        self,
+        model,
+        api_key,
+        base_url=None,
+        temperature=0.7,
+        cache=None,
+        max_tokens=None,
+    ):
         self.model = model
         self.temperature = temperature
+        # None leaves the output length to the provider's default
+        self.max_tokens = max_tokens
         self.client = genai.Client(
             api_key=api_key, http_options=types.HttpOptions(base_url=base_url)
         )
+        # Optional models.cache.ResponseCache
+        self.cache = cache
+        # Shared by every model on the same endpoint, see models.limits
+        self.limiter = get_limiter(base_url or "gemini")
+        # Tokens, latency and cost of every call, see models.telemetry
+        self.telemetry = get_telemetry()
+        # Writes requests and responses to RECORD_FIXTURES_DIR, see models.recorder
+        self.recorder = get_recorder()
+        # sha256 of a system instruction -> (context cache name or None, expiry)
+        self._context_caches = {}
+        self._context_caches_lock = threading.Lock()
+
+    def _prepare_contents(self, input_data):
+        """Split input into (system instruction or None, contents)
+
+        Input is a prompt string, or (role, content) tuples like ChatOpenAI accepts.
+        """
+        if isinstance(input_data, str):
+            return None, [input_data]
+        system, contents = None, []
+        for role, content in input_data:
+            if role.lower() == "system":
+                system = content if system is None else f"{system}\n\n{content}"
+                continue
+            role = "model" if role.lower() in ("assistant", "ai", "model") else "user"
+            contents.append(
+                types.Content(role=role, parts=[types.Part.from_text(text=content)])
+            )
+        return system, contents
+
+    def _context_cache(self, system):
+        """Name of an explicit context cache holding `system`, or None
+
+        Gemini only caches prompts above a minimum size, shorter system
+        instructions are sent inline. A cache is created once per instruction
+        and replaced shortly before its TTL runs out.
+        """
+        if (
+            not GEMINI_CONTEXT_CACHE_TTL_SECONDS
+            or estimate_tokens(system) < GEMINI_CONTEXT_CACHE_MIN_TOKENS
+        ):
+            return None
+        key = hashlib.sha256(system.encode("utf-8")).hexdigest()
+        with self._context_caches_lock:
+            entry = self._context_caches.get(key)
+            if entry is None or entry[1] <= time.time():
+                try:
+                    cached_content = self.client.caches.create(
+                        model=self.model,
+                        config=types.CreateCachedContentConfig(
+                            system_instruction=system,
+                            ttl=f"{GEMINI_CONTEXT_CACHE_TTL_SECONDS}s",
+                            display_name=f"cvv2025-{key[:16]}",
+                        ),
+                    )
+                    entry = (
+                        cached_content.name,
+                        time.time() + GEMINI_CONTEXT_CACHE_TTL_SECONDS - 60,
+                    )
+                except Exception as e:
+                    # e.g. a model without explicit caching, don't try again
+                    print(f"Gemini context cache unavailable ({e}), sending inline")
+                    entry = (None, float("inf"))
+                self._context_caches[key] = entry
+            return entry[0]
+
+    def _config(self, system=None):
+        options = {}
+        if self.temperature is not None:
+            options["temperature"] = self.temperature
+        if self.max_tokens is not None:
+            options["max_output_tokens"] = self.max_tokens
+        if system is not None:
+            cache_name = self._context_cache(system)
+            if cache_name is not None:
+                options["cached_content"] = cache_name
+            else:
+                options["system_instruction"] = system
+        return types.GenerateContentConfig(**options) if options else None
 
     def invoke(self, input_data):
-        response = self.client.models.generate_content(
-            model=self.model, contents=[input_data]
-        )
+        with self.telemetry.call(self.model) as call:
+            if self.cache is not None:
+                key = self.cache.key(self.model, input_data, self.temperature)
+                cached = self.cache.get(key, self.model)
+                if cached is not None:
+                    call.cache_hit = True
+                    if self.recorder is not None:
+                        self.recorder.record(self.model, input_data, cached, call)
+                    return cached
+
+            system, contents = self._prepare_contents(input_data)
+            config = self._config(system)
+            response, slot = send(
+                self.limiter,
+                lambda: self.client.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                    config=config,
+                ),
+                estimate_tokens(input_data),
+            )
+            if response.usage_metadata is not None:
+                slot.report(response.usage_metadata.total_token_count or 0)
+            _report_usage(call, response.usage_metadata)
+            if self.recorder is not None and response.text is not None:
+                self.recorder.record(self.model, input_data, response.text, call)
+
+        if self.cache is not None and response.text is not None:
+            self.cache.put(key, self.model, response.text)
+        return response.text
+
+    async def ainvoke(self, input_data):
+        """Async invoke(), waits for the endpoint's concurrency and rate limits"""
+        with self.telemetry.call(self.model) as call:
+            if self.cache is not None:
+                key = self.cache.key(self.model, input_data, self.temperature)
+                cached = self.cache.get(key, self.model)
+                if cached is not None:
+                    call.cache_hit = True
+                    if self.recorder is not None:
+                        self.recorder.record(self.model, input_data, cached, call)
+                    return cached
 
+            system, contents = self._prepare_contents(input_data)
+            # Creating a context cache is a blocking request
+            config = await asyncio.to_thread(self._config, system)
+            response, slot = await asend(
+                self.limiter,
+                lambda: self.client.aio.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                    config=config,
+                ),
+                estimate_tokens(input_data),
+            )
+            if response.usage_metadata is not None:
+                slot.report(response.usage_metadata.total_token_count or 0)
+            _report_usage(call, response.usage_metadata)
+            if self.recorder is not None and response.text is not None:
+                self.recorder.record(self.model, input_data, response.text, call)
+
+        if self.cache is not None and response.text is not None:
+            self.cache.put(key, self.model, response.text)
         return response.text
+
+    def stream_invoke(self, input_data):
+        """Yield the response text chunk by chunk, input as for invoke()"""
+        with self.telemetry.call(self.model, streaming=True) as call:
+            output = []
+            system, contents = self._prepare_contents(input_data)
+            config = self._config(system)
+
+            def open_stream():
+                # The request is only sent when the first chunk is read
+                stream = self.client.models.generate_content_stream(
+                    model=self.model,
+                    contents=contents,
+                    config=config,
+                )
+                first = next(stream, None)
+                return stream if first is None else itertools.chain([first], stream)
+
+            # Retries cover opening the stream, stream_to_file() resumes
+            # streams that break later; the slot is held until the stream ends
+            with send_stream(
+                self.limiter, open_stream, estimate_tokens(input_data)
+            ) as (stream, slot):
+                for chunk in stream:
+                    # Every chunk carries the usage so far, the last one is final
+                    if chunk.usage_metadata is not None:
+                        slot.report(chunk.usage_metadata.total_token_count or 0)
+                    _report_usage(call, chunk.usage_metadata)
+                    if chunk.text:
+                        call.first_token()
+                        output.append(chunk.text)
+                        yield chunk.text
+            call.estimate(input_data, "".join(output))
+            if self.recorder is not None:
+                self.recorder.record(self.model, input_data, "".join(output), call)
+
+
+def _report_usage(call, usage_metadata):
+    """Pass the token counts of Gemini usage metadata to telemetry"""
+    if usage_metadata is None:
+        return
+    call.usage(
+        prompt_tokens=usage_metadata.prompt_token_count,
+        # Gemini counts thinking tokens apart from the candidates, but bills
+        # them as output like OpenAI's completion_tokens do
+        completion_tokens=(usage_metadata.candidates_token_count or 0)
+        + (usage_metadata.thoughts_token_count or 0),
+        reasoning_tokens=usage_metadata.thoughts_token_count,
+        cached_tokens=usage_metadata.cached_content_token_count,
+    )
@@ -1,4 +1,5 @@
 from models.openai import ChatOpenAI
+from models.cache import get_response_cache
 from config import (
     GENERAL_MODEL_API_BASE_URL,
     GENERAL_MODEL_API_KEY,
@@ -14,13 +15,17 @@ class GeneralModel:
             api_key=GENERAL_MODEL_API_KEY,
             base_url=GENERAL_MODEL_API_BASE_URL,
             temperature=GENERAL_MODEL_TEMPERATURE,
+            cache=get_response_cache(),
         )
 
     def run(self, input_text: str, stream=False):
         if stream:
             return self.stream_run(input_text)
         return self.llm.invoke(input_text)
-        
+
+    async def arun(self, input_text: str):
+        return await self.llm.ainvoke(input_text)
+
     def stream_run(self, input_text: str):
         for chunk in self.llm.stream_invoke(input_text):
             yield chunk
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from config import PROVIDER_LIMITS, DEFAULT_PROVIDER_LIMITS
+
+
+class Slot:
+    """A request admitted by ProviderLimiter"""
+
+    def __init__(self, limiter, entry, epoch):
+        self._limiter = limiter
+        self._entry = entry
+        # Congestion epoch the request was sent in, see ProviderLimiter.throttled()
+        self.epoch = epoch
+
+    def report(self, tokens):
+        """Replace the estimated token count with the provider's"""
+        with self._limiter._lock:
+            self._entry[1] = tokens
+
+
+class ProviderLimiter:
+    """Concurrency, requests-per-minute and tokens-per-minute limits of one endpoint
+
+    Model calls wait in limit() (async) or slot() (blocking) until the
+    endpoint has a free slot and the last minute of traffic leaves room for
+    the request. The number of slots adapts AIMD-style: it grows by one per
+    window of successful requests, up to `concurrency`, and halves when the
+    provider rate limits or fails, see models.retry.
+    """
+
+    WINDOW_SECONDS = 60.0
+    # How often waiting coroutines check for a free slot
+    POLL_SECONDS = 0.05
+
+    def __init__(self, name, concurrency=16, initial_concurrency=4, rpm=None, tpm=None):
+        self.name = name
+        self.max_concurrency = concurrency
+        self.concurrency = float(max(1, min(initial_concurrency, concurrency)))
+        self.rpm = rpm
+        self.tpm = tpm
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        # [timestamp, tokens] of the requests sent in the last minute
+        self._window = deque()
+        # Incremented on every decrease, so that the requests that were in
+        # flight together when the provider pushed back only halve it once
+        self._epoch = 0
+        # No requests before this time, set from Retry-After
+        self._paused_until = 0.0
+
+    def _reserve(self, tokens):
+        """Admit a request, or return how long to wait (None: for a free slot)"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return None, self._paused_until - now
+            if self.in_flight >= int(self.concurrency):
+                return None, None
+
+            while self._window and now - self._window[0][0] >= self.WINDOW_SECONDS:
+                self._window.popleft()
+            wait = 0.0
+            if self.rpm is not None and len(self._window) >= self.rpm:
+                wait = self._window[0][0] + self.WINDOW_SECONDS - now
+            if self.tpm is not None and self._window:
+                excess = sum(entry[1] for entry in self._window) + tokens - self.tpm
+                # Wait until enough of the oldest requests leave the window
+                for timestamp, used in self._window:
+                    if excess <= 0:
+                        break
+                    excess -= used
+                    wait = max(wait, timestamp + self.WINDOW_SECONDS - now)
+            if wait > 0:
+                return None, wait
+
+            entry = [now, tokens]
+            self._window.append(entry)
+            self.in_flight += 1
+            return Slot(self, entry, self._epoch), 0.0
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._released.notify_all()
+
+    @asynccontextmanager
+    async def limit(self, estimated_tokens=0):
+        """Hold a request slot; yields a Slot to report the actual token count"""
+        while True:
+            slot, wait = self._reserve(estimated_tokens)
+            if slot is not None:
+                break
+            await asyncio.sleep(self.POLL_SECONDS if wait is None else wait)
+        try:
+            yield slot
+        finally:
+            self._release()
+
+    @contextmanager
+    def slot(self, estimated_tokens=0):
+        """Blocking limit(), for invoke() and streams"""
+        while True:
+            slot, wait = self._reserve(estimated_tokens)
+            if slot is not None:
+                break
+            with self._released:
+                self._released.wait(1.0 if wait is None else wait)
+        try:
+            yield slot
+        finally:
+            self._release()
+
+    def succeeded(self):
+        """Additive increase: one more slot per window of successes"""
+        with self._lock:
+            self.concurrency = min(
+                self.max_concurrency, self.concurrency + 1 / self.concurrency
+            )
+
+    def throttled(self, slot, retry_after=None):
+        """Multiplicative decrease after a rate limit or server error
+
+        retry_after (seconds) also pauses every request to the endpoint.
+        """
+        with self._lock:
+            if slot.epoch == self._epoch:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self._epoch += 1
+            if retry_after:
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + retry_after
+                )
+
+
+def estimate_tokens(messages):
+    """Rough token count of a prompt, before the provider reports usage
+
+    About two characters per token covers mixed Chinese and English text.
+    """
+    if isinstance(messages, str):
+        return len(messages) // 2
+    total = 0
+    for message in messages:
+        if isinstance(message, dict):
+            content = message.get("content")
+        elif isinstance(message, tuple):
+            content = message[1]  # (role, content)
+        else:
+            content = message
+        if isinstance(content, str):
+            total += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "text":
+                    total += len(part.get("text", ""))
+    return total // 2
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(endpoint):
+    """Shared limiter of an API endpoint, configured by PROVIDER_LIMITS"""
+    with _limiters_lock:
+        limiter = _limiters.get(endpoint)
+        if limiter is None:
+            limits = {**DEFAULT_PROVIDER_LIMITS, **PROVIDER_LIMITS.get(endpoint, {})}
+            limiter = _limiters[endpoint] = ProviderLimiter(endpoint, **limits)
+        return limiter
@@ -1,12 +1,36 @@
-from openai import OpenAI
+import asyncio
+import weakref
+from openai import OpenAI, AsyncOpenAI
+from openai.types.chat import ChatCompletionMessage
+from models.limits import get_limiter, estimate_tokens
+from models.retry import send, asend, send_stream
+from models.telemetry import get_telemetry
+from models.recorder import get_recorder
 
 
 class ChatOpenAI:
-    def __init__(self, model, api_key, base_url, temperature):
+    def __init__(
+        self, model, api_key, base_url, temperature, cache=None, max_tokens=None
+    ):
         # Initialize openai library configuration
         self.model = model
         self.temperature = temperature
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # None leaves the output length to the provider's default
+        self.max_tokens = max_tokens
+        self.api_key = api_key
+        self.base_url = base_url
+        # Retries are left to models.retry, which also adapts the concurrency
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        # Optional models.cache.ResponseCache, used by invoke()/ainvoke() only
+        self.cache = cache
+        # Shared by every model on the same endpoint, see models.limits
+        self.limiter = get_limiter(base_url)
+        # One AsyncOpenAI per event loop, its connections belong to the loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        # Tokens, latency and cost of every call, see models.telemetry
+        self.telemetry = get_telemetry()
+        # Writes requests and responses to RECORD_FIXTURES_DIR, see models.recorder
+        self.recorder = get_recorder()
 
     def bind(self, response_format=None):
         self.response_format = response_format
@@ -26,32 +50,155 @@ class ChatOpenAI:
                 messages.append({"role": role, "content": content})
         return messages
 
-    def invoke(self, input_data, stream=False):
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = AsyncOpenAI(
+                api_key=self.api_key, base_url=self.base_url, max_retries=0
+            )
+        return client
+
+    def _cache_lookup(self, messages, response_format):
+        """Return (cache key, cached message or None)"""
+        if self.cache is None:
+            return None, None
+        key = self.cache.key(self.model, messages, self.temperature, response_format)
+        cached = self.cache.get(key, self.model)
+        if cached is not None:
+            return key, ChatCompletionMessage.model_validate_json(cached)
+        return key, None
+
+    def _cache_store(self, key, message):
+        if self.cache is not None:
+            self.cache.put(key, self.model, message.model_dump_json())
+
+    def _record(self, messages, message, call):
+        if self.recorder is not None:
+            self.recorder.record(
+                self.model,
+                messages,
+                message.content,
+                call,
+                reasoning_content=getattr(message, "reasoning_content", None),
+            )
+
+    def invoke(self, input_data, stream=False, response_format=None):
+        """Send a request; response_format overrides the one set with bind()"""
         messages = self._prepare_messages(input_data)
 
         if stream:
-            return self.stream_invoke(messages)
-
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=self.temperature,
-            response_format=getattr(self, "response_format", None),
-        )
-        return response.choices[0].message
-
-    def stream_invoke(self, messages):
-        messages = self._prepare_messages(messages)
-
-        stream_response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=self.temperature,
-            response_format=getattr(self, "response_format", None),
-            stream=True,
-            max_tokens=8000,
-        )
-
-        for chunk in stream_response:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
+            return self.stream_invoke(input_data)
+
+        response_format = response_format or getattr(self, "response_format", None)
+        with self.telemetry.call(self.model) as call:
+            key, cached = self._cache_lookup(messages, response_format)
+            if cached is not None:
+                call.cache_hit = True
+                self._record(messages, cached, call)
+                return cached
+
+            response, slot = send(
+                self.limiter,
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    response_format=response_format,
+                    **self._length_options(),
+                ),
+                estimate_tokens(messages),
+            )
+            if response.usage is not None:
+                slot.report(response.usage.total_tokens)
+            _report_usage(call, response.usage)
+            message = response.choices[0].message
+            self._record(messages, message, call)
+        self._cache_store(key, message)
+        return message
+
+    async def ainvoke(self, input_data, response_format=None):
+        """Async invoke(), waits for the endpoint's concurrency and rate limits"""
+        messages = self._prepare_messages(input_data)
+        response_format = response_format or getattr(self, "response_format", None)
+        with self.telemetry.call(self.model) as call:
+            key, cached = self._cache_lookup(messages, response_format)
+            if cached is not None:
+                call.cache_hit = True
+                self._record(messages, cached, call)
+                return cached
+
+            # Latency includes the time spent waiting for the limiter and retries
+            response, slot = await asend(
+                self.limiter,
+                lambda: self._async_client().chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    response_format=response_format,
+                    **self._length_options(),
+                ),
+                estimate_tokens(messages),
+            )
+            if response.usage is not None:
+                slot.report(response.usage.total_tokens)
+            _report_usage(call, response.usage)
+            message = response.choices[0].message
+            self._record(messages, message, call)
+        self._cache_store(key, message)
+        return message
+
+    def _length_options(self):
+        return {} if self.max_tokens is None else {"max_tokens": self.max_tokens}
+
+    def stream_invoke(self, input_data):
+        """Yield the response text chunk by chunk, input as for invoke()"""
+        messages = self._prepare_messages(input_data)
+
+        with self.telemetry.call(self.model, streaming=True) as call:
+            # Retries cover opening the stream, stream_to_file() resumes
+            # streams that break later; the slot is held until the stream ends
+            with send_stream(
+                self.limiter,
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    response_format=getattr(self, "response_format", None),
+                    stream=True,
+                    # Token usage arrives in a final chunk without choices
+                    stream_options={"include_usage": True},
+                    **self._length_options(),
+                ),
+                estimate_tokens(messages),
+            ) as (stream_response, slot):
+                output = []
+                for chunk in stream_response:
+                    if getattr(chunk, "usage", None) is not None:
+                        slot.report(chunk.usage.total_tokens)
+                        _report_usage(call, chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        call.first_token()
+                        output.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            call.estimate(messages, "".join(output))
+            if self.recorder is not None:
+                self.recorder.record(self.model, messages, "".join(output), call)
+
+
+def _report_usage(call, usage):
+    """Pass the token counts of an OpenAI-style usage object to telemetry"""
+    if usage is None:
+        return
+    completion_details = getattr(usage, "completion_tokens_details", None)
+    prompt_details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(prompt_details, "cached_tokens", None)
+    if cached_tokens is None:
+        # DeepSeek reports its context cache separately
+        cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+    call.usage(
+        prompt_tokens=usage.prompt_tokens,
+        completion_tokens=usage.completion_tokens,
+        reasoning_tokens=getattr(completion_details, "reasoning_tokens", None),
+        cached_tokens=cached_tokens,
+    )
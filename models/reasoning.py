@@ -1,4 +1,5 @@
 from models.openai import ChatOpenAI
+from models.cache import get_response_cache
 from models.gemini import ChatGemini
 from config import (
     REASONING_MODEL_PROVIDER,
@@ -6,6 +7,7 @@ from config import (
     REASONING_MODEL_API_KEY,
     REASONING_MODEL_NAME,
     REASONING_MODEL_TEMPERATURE,
+    REASONING_MODEL_MAX_TOKENS,
 )
 
 
@@ -17,6 +19,8 @@ class ReasoningModel:
                 api_key=REASONING_MODEL_API_KEY,
                 base_url=REASONING_MODEL_API_BASE_URL,
                 temperature=REASONING_MODEL_TEMPERATURE,
+                cache=get_response_cache(),
+                max_tokens=REASONING_MODEL_MAX_TOKENS,
             )
         elif REASONING_MODEL_PROVIDER == "Gemini":
             self.llm = ChatGemini(
@@ -24,6 +28,8 @@ class ReasoningModel:
                 api_key=REASONING_MODEL_API_KEY,
                 base_url=REASONING_MODEL_API_BASE_URL,
                 temperature=REASONING_MODEL_TEMPERATURE,
+                cache=get_response_cache(),
+                max_tokens=REASONING_MODEL_MAX_TOKENS,
             )
 
     def run(self, input_text: str, stream=False):
@@ -32,6 +38,10 @@ class ReasoningModel:
         message = self.llm.invoke(input_text)
         return message.content if hasattr(message, "content") else message
 
+    async def arun(self, input_text: str):
+        message = await self.llm.ainvoke(input_text)
+        return message.content if hasattr(message, "content") else message
+
     def stream_run(self, input_text: str):
         for chunk in self.llm.stream_invoke(input_text):
             yield chunk
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import threading
+from config import RECORD_FIXTURES_DIR
+
+
+def canonical_messages(messages):
+    """Messages as [{"role": system | user | assistant, "content": ...}]
+
+    Accepts a prompt string, (role, content) tuples or OpenAI-style dicts, so
+    that the recording client and the replay server derive the same key from
+    a ChatOpenAI call, a ChatGemini call or the HTTP request either one sends.
+    """
+    if isinstance(messages, str):
+        return [{"role": "user", "content": messages}]
+    canonical = []
+    for message in messages:
+        if isinstance(message, dict):
+            role, content = message.get("role", "user"), message.get("content")
+        else:
+            role, content = message
+        role = role.lower()
+        if role in ("assistant", "ai", "model"):
+            role = "assistant"
+        elif role != "system":
+            role = "user"
+        canonical.append({"role": role, "content": content})
+    return canonical
+
+
+def request_key(model, messages):
+    """Fixture key of a request: model and messages
+
+    Temperature and response format are left out, the stand-in server
+    answers with whatever the recorded run received.
+    """
+    payload = json.dumps(
+        {"model": model, "messages": canonical_messages(messages)},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class FixtureRecorder:
+    """Writes every LLM request and response of a run to a fixture directory
+
+    Each request is stored in llm/<request_key>.json together with its token
+    usage and timing. Identical requests append to the same file, and
+    scripts/replay_server.py answers them in the recorded order.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.join(directory, "llm")
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def record(self, model, messages, content, call=None, reasoning_content=None):
+        """Store one response; `call` is the models.telemetry.CallTimer of the call"""
+        key = request_key(model, messages)
+        response = {
+            "content": content,
+            "reasoning_content": reasoning_content,
+            "usage": None,
+            "ttft_seconds": None,
+            "latency_seconds": None,
+        }
+        if call is not None and not call.cache_hit:
+            response["usage"] = {
+                "prompt_tokens": call.prompt_tokens,
+                "completion_tokens": call.completion_tokens,
+                "reasoning_tokens": call.reasoning_tokens,
+                "cached_tokens": call.cached_tokens,
+            }
+            response["ttft_seconds"] = call.first_token_seconds()
+            response["latency_seconds"] = call.elapsed_seconds()
+
+        path = os.path.join(self.directory, f"{key}.json")
+        with self._lock:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    fixture = json.load(f)
+            else:
+                fixture = {
+                    "model": model,
+                    "messages": canonical_messages(messages),
+                    "responses": [],
+                }
+            fixture["responses"].append(response)
+            with open(path + ".partial", "w", encoding="utf-8") as f:
+                json.dump(fixture, f, indent=2, ensure_ascii=False)
+            os.replace(path + ".partial", path)
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """The recorder writing to RECORD_FIXTURES_DIR, or None when not recording"""
+    global _recorder
+    if not RECORD_FIXTURES_DIR:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = FixtureRecorder(RECORD_FIXTURES_DIR)
+        return _recorder
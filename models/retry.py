@@ -0,0 +1,230 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager
+from models.telemetry import current_stage
+from config import (
+    MODEL_RETRY_ATTEMPTS,
+    MODEL_RETRY_BACKOFF_SECONDS,
+    MODEL_RETRY_MAX_BACKOFF_SECONDS,
+    STAGE_RETRY_BUDGETS,
+)
+
+# Transient failures without an HTTP status, by exception class name so that
+# both the openai and google-genai clients are covered
+_TRANSIENT_ERRORS = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "ConnectError",
+    "ConnectTimeout",
+    "ReadError",
+    "ReadTimeout",
+    "RemoteProtocolError",
+    "ServerDisconnectedError",
+}
+
+
+def _status(error):
+    status = getattr(error, "status_code", None)  # openai
+    if status is None:
+        status = getattr(error, "code", None)  # google-genai
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error):
+    """Rate limits, overload, server errors and dropped connections"""
+    status = _status(error)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return (
+        isinstance(error, (ConnectionError, TimeoutError))
+        or type(error).__name__ in _TRANSIENT_ERRORS
+    )
+
+
+def retry_after(error):
+    """Seconds the provider asked to wait, from Retry-After or Gemini's RetryInfo"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = headers.get("retry-after")
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                try:
+                    date = email.utils.parsedate_to_datetime(value)
+                except (TypeError, ValueError):
+                    # Malformed header, fall back to the computed backoff
+                    date = None
+                if date is not None:
+                    return max(0.0, date.timestamp() - time.time())
+
+    def find_delay(details):
+        if isinstance(details, dict):
+            if str(details.get("@type", "")).endswith("RetryInfo"):
+                return details.get("retryDelay")
+            details = list(details.values())
+        if isinstance(details, list):
+            for item in details:
+                delay = find_delay(item)
+                if delay is not None:
+                    return delay
+        return None
+
+    delay = find_delay(getattr(error, "details", None))  # e.g. "13s"
+    if isinstance(delay, str) and delay.endswith("s"):
+        try:
+            return float(delay[:-1])
+        except ValueError:
+            pass
+    return None
+
+
+def backoff_seconds(attempt, wait=None):
+    """Full-jitter exponential backoff, at least `wait` seconds when given"""
+    cap = min(MODEL_RETRY_MAX_BACKOFF_SECONDS, MODEL_RETRY_BACKOFF_SECONDS * 2**attempt)
+    if wait is not None:
+        # A little jitter keeps the waiting requests from returning at once
+        return wait + random.uniform(0, MODEL_RETRY_BACKOFF_SECONDS)
+    return random.uniform(0, cap)
+
+
+class RetryBudget:
+    """Retries left per workflow stage, shared by all calls of the stage
+
+    Stops a stage from retrying every one of its calls against a provider
+    that is down; stages not in `budgets` use budgets["default"].
+    """
+
+    def __init__(self, budgets):
+        self.budgets = budgets
+        self.used = {}
+        self._lock = threading.Lock()
+
+    def take(self, stage):
+        """Spend one retry of `stage`, False when none are left"""
+        stage = stage or "default"
+        limit = self.budgets.get(stage, self.budgets.get("default"))
+        with self._lock:
+            used = self.used.get(stage, 0)
+            if limit is not None and used >= limit:
+                return False
+            self.used[stage] = used + 1
+            return True
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_retry_budget():
+    """The process-wide RetryBudget, configured by STAGE_RETRY_BUDGETS"""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = RetryBudget(STAGE_RETRY_BUDGETS)
+        return _budget
+
+
+def _after_failure(limiter, slot, error, attempt):
+    """Seconds to wait before the next attempt, or None to give up"""
+    if not is_retryable(error):
+        return None
+    wait = retry_after(error)
+    limiter.throttled(slot, wait)
+    if attempt + 1 >= MODEL_RETRY_ATTEMPTS:
+        return None
+    stage = current_stage()
+    if not get_retry_budget().take(stage):
+        print(f"Retry budget of stage {stage or 'default'} used up, not retrying")
+        return None
+    delay = backoff_seconds(attempt, wait)
+    print(
+        f"{limiter.name}: {type(error).__name__} ({_status(error) or 'no status'}), "
+        f"retrying in {delay:.1f}s ({attempt + 1}/{MODEL_RETRY_ATTEMPTS - 1})"
+    )
+    return delay
+
+
+def send(limiter, request, estimated_tokens=0):
+    """Call request() in a slot of limiter, retrying transient failures
+
+    Returns:
+        (response, Slot): the Slot of the successful attempt, to report usage
+    """
+    attempt = 0
+    while True:
+        with limiter.slot(estimated_tokens) as slot:
+            try:
+                response = request()
+            except Exception as e:
+                delay = _after_failure(limiter, slot, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                limiter.succeeded()
+                return response, slot
+        time.sleep(delay)
+        attempt += 1
+
+
+@contextmanager
+def send_stream(limiter, request, estimated_tokens=0):
+    """send() for streaming responses, as `with send_stream(...) as (stream, slot)`
+
+    The slot is held until the with block ends, i.e. until the stream is
+    consumed or closed, so streamed tokens count against the endpoint's
+    concurrency like any other request. Retries cover opening the stream.
+    The limiter learns the outcome when the stream ends: a rate limit or
+    server error in the middle of the body halves its concurrency like one
+    on opening, and a stream closed early by the caller counts as neither.
+    """
+    attempt = 0
+    while True:
+        with limiter.slot(estimated_tokens) as slot:
+            try:
+                response = request()
+            except Exception as e:
+                delay = _after_failure(limiter, slot, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                try:
+                    yield response, slot
+                except GeneratorExit:
+                    raise
+                except Exception as e:
+                    # Not retried here, stream_to_file() resumes broken streams
+                    if is_retryable(e):
+                        limiter.throttled(slot, retry_after(e))
+                    raise
+                limiter.succeeded()
+                return
+        time.sleep(delay)
+        attempt += 1
+
+
+async def asend(limiter, request, estimated_tokens=0):
+    """Async send(), request() returns an awaitable"""
+    attempt = 0
+    while True:
+        async with limiter.limit(estimated_tokens) as slot:
+            try:
+                response = await request()
+            except Exception as e:
+                delay = _after_failure(limiter, slot, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                limiter.succeeded()
+                return response, slot
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -1,4 +1,12 @@
 from models.openai import ChatOpenAI
+from models.cache import get_response_cache
+from prompt_layout import layered_messages
+from structured_output import (
+    response_format,
+    SPRITE_PROMPTS_SCHEMA,
+    BACKGROUND_PROMPTS_SCHEMA,
+    CG_PROMPTS_SCHEMA,
+)
 from config import (
     SD_PROMPT_MODEL_API_BASE_URL,
     SD_PROMPT_MODEL_API_KEY,
@@ -12,69 +20,122 @@ if LANGUAGE_MODE == "zh":
         GENERATE_SPRITE_SD_PROMPT,
         GENERATE_BACKGROUND_SD_PROMPT,
         GENERATE_CG_SD_PROMPT,
+        GENERATE_KEY_BACKGROUND_SD_PROMPT,
     )
 else:
     from prompt_en import (
         GENERATE_SPRITE_SD_PROMPT,
         GENERATE_BACKGROUND_SD_PROMPT,
         GENERATE_CG_SD_PROMPT,
+        GENERATE_KEY_BACKGROUND_SD_PROMPT,
     )
 
 
 class SDPromptModel:
+    # Expected reply of each prompt kind, see structured_output
+    SCHEMAS = {
+        "sprite": SPRITE_PROMPTS_SCHEMA,
+        "background": BACKGROUND_PROMPTS_SCHEMA,
+        "cg": CG_PROMPTS_SCHEMA,
+    }
+
     def __init__(self):
         self.llm = ChatOpenAI(
             model=SD_PROMPT_MODEL_NAME,
             api_key=SD_PROMPT_MODEL_API_KEY,
             base_url=SD_PROMPT_MODEL_API_BASE_URL,
             temperature=SD_PROMPT_MODEL_TEMPERATURE,
+            cache=get_response_cache(),
         ).bind(response_format={"type": "json_object"})
 
-    def run_sprite(self, character_setting, script, stream=False):
+    def _format(self, kind):
+        return response_format(self.llm, f"{kind}_prompts", self.SCHEMAS[kind])
+
+    # World view and character settings are the same for every chapter, so
+    # they go into the system message ahead of the chapter's script
+
+    def _sprite_messages(self, character_setting, script):
         if LANGUAGE_MODE == "zh":
-            human_message = f"角色设定：{character_setting}\n\nRen'Py脚本：{script}"
+            context = [f"角色设定：{character_setting}"]
+            request = f"Ren'Py脚本：{script}"
         else:
-            human_message = (
-                f"Character Setting: {character_setting}\n\nRen'Py Script: {script}"
-            )
-        messages = [
-            ("system", GENERATE_SPRITE_SD_PROMPT),
-            ("user", human_message),
-        ]
+            context = [f"Character Setting: {character_setting}"]
+            request = f"Ren'Py Script: {script}"
+        return layered_messages(GENERATE_SPRITE_SD_PROMPT, context, request)
 
-        if stream:
-            return self.stream_invoke(messages)
-        return self.llm.invoke(messages)
+    def _background_messages(self, world_view, script):
+        if LANGUAGE_MODE == "zh":
+            context = [f"世界观设定：{world_view}"]
+            request = f"Ren'Py脚本：{script}"
+        else:
+            context = [f"World View Setting: {world_view}"]
+            request = f"Ren'Py Script: {script}"
+        return layered_messages(GENERATE_BACKGROUND_SD_PROMPT, context, request)
 
-    def run_background(self, world_view, script, stream=False):
+    def _cg_messages(self, world_view, character_setting, script):
+        if LANGUAGE_MODE == "zh":
+            context = [f"世界观设定：{world_view}", f"角色设定：{character_setting}"]
+            request = f"Ren'Py脚本：{script}"
+        else:
+            context = [
+                f"World View Setting: {world_view}",
+                f"Character Setting: {character_setting}",
+            ]
+            request = f"Ren'Py Script: {script}"
+        return layered_messages(GENERATE_CG_SD_PROMPT, context, request)
+
+    def _key_background_messages(self, world_view, outline, max_backgrounds):
         if LANGUAGE_MODE == "zh":
-            human_message = f"世界观设定：{world_view}\n\nRen'Py脚本：{script}"
+            context = [f"世界观设定：{world_view}"]
+            request = f"章节大纲：{outline}\n\n最多 {max_backgrounds} 个地点。"
         else:
-            human_message = (
-                f"World View Setting: {world_view}\n\nRen'Py Script: {script}"
+            context = [f"World View Setting: {world_view}"]
+            request = (
+                f"Chapter Outlines: {outline}\n\nAt most {max_backgrounds} locations."
             )
-        messages = [
-            ("system", GENERATE_BACKGROUND_SD_PROMPT),
-            ("user", human_message),
-        ]
+        return layered_messages(GENERATE_KEY_BACKGROUND_SD_PROMPT, context, request)
 
+    def run_sprite(self, character_setting, script, stream=False):
+        messages = self._sprite_messages(character_setting, script)
         if stream:
             return self.stream_invoke(messages)
-        return self.llm.invoke(messages)
+        return self.llm.invoke(messages, response_format=self._format("sprite"))
 
-    def run_cg(self, world_view, character_setting, script, stream=False):
-        if LANGUAGE_MODE == "zh":
-            human_message = f"世界观设定：{world_view}\n\n角色设定：{character_setting}\n\nRen'Py脚本：{script}"
-        else:
-            human_message = f"World View Setting: {world_view}\n\nCharacter Setting: {character_setting}\n\nRen'Py Script: {script}"
-        messages = [
-            ("system", GENERATE_CG_SD_PROMPT),
-            ("user", human_message),
-        ]
+    def run_background(self, world_view, script, stream=False):
+        messages = self._background_messages(world_view, script)
+        if stream:
+            return self.stream_invoke(messages)
+        return self.llm.invoke(messages, response_format=self._format("background"))
 
+    def run_cg(self, world_view, character_setting, script, stream=False):
+        messages = self._cg_messages(world_view, character_setting, script)
         if stream:
             return self.stream_invoke(messages)
-        return self.llm.invoke(messages)
+        return self.llm.invoke(messages, response_format=self._format("cg"))
+
+    async def arun_sprite(self, character_setting, script):
+        return await self.llm.ainvoke(
+            self._sprite_messages(character_setting, script),
+            response_format=self._format("sprite"),
+        )
+
+    async def arun_background(self, world_view, script):
+        return await self.llm.ainvoke(
+            self._background_messages(world_view, script),
+            response_format=self._format("background"),
+        )
+
+    async def arun_cg(self, world_view, character_setting, script):
+        return await self.llm.ainvoke(
+            self._cg_messages(world_view, character_setting, script),
+            response_format=self._format("cg"),
+        )
+
+    async def arun_key_backgrounds(self, world_view, outline, max_backgrounds):
+        return await self.llm.ainvoke(
+            self._key_background_messages(world_view, outline, max_backgrounds),
+            response_format=self._format("background"),
+        )
 
     def stream_invoke(self, messages):
         for chunk in self.llm.stream_invoke(messages):
@@ -0,0 +1,233 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from config import MODEL_PRICES
+from models.limits import estimate_tokens
+
+# Workflow stage and chapter of the calls made in the current context.
+# asyncio tasks copy the context they are created in, so a chapter tagged
+# inside a per-chapter coroutine only applies to that chapter's calls.
+_stage = contextvars.ContextVar("telemetry_stage", default=None)
+_chapter = contextvars.ContextVar("telemetry_chapter", default=None)
+# Game of the calls, when a batch generates several games side by side
+_game = contextvars.ContextVar("telemetry_game", default=None)
+
+
+@contextmanager
+def tagged(stage=None, chapter=None, game=None):
+    """Attribute the model calls made inside the block to a stage, chapter and/or game"""
+    tokens = []
+    if stage is not None:
+        tokens.append((_stage, _stage.set(stage)))
+    if chapter is not None:
+        tokens.append((_chapter, _chapter.set(chapter)))
+    if game is not None:
+        tokens.append((_game, _game.set(game)))
+    try:
+        yield
+    finally:
+        for variable, token in reversed(tokens):
+            variable.reset(token)
+
+
+def current_stage():
+    """Stage tagged for the current context, or None"""
+    return _stage.get()
+
+
+class CallTimer:
+    """Measures one model call, see Telemetry.call()"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.reasoning_tokens = None
+        self.cached_tokens = None
+        self.cache_hit = False
+        # True when the token counts are estimates, not provider usage
+        self.estimated = False
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def first_token_seconds(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.start
+
+    def elapsed_seconds(self):
+        return time.perf_counter() - self.start
+
+    def usage(
+        self,
+        prompt_tokens=None,
+        completion_tokens=None,
+        reasoning_tokens=None,
+        cached_tokens=None,
+    ):
+        """Token counts reported by the provider"""
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.reasoning_tokens = reasoning_tokens
+        self.cached_tokens = cached_tokens
+
+    def estimate(self, prompt, output):
+        """Fall back to estimated token counts when the provider sent no usage"""
+        if self.prompt_tokens is None:
+            self.usage(estimate_tokens(prompt), estimate_tokens(output))
+            self.estimated = True
+
+
+class Telemetry:
+    """Tokens, latency and estimated cost of every LLM call
+
+    Prices come from MODEL_PRICES (USD per million input/output tokens);
+    models without a price are reported with no cost.
+    """
+
+    def __init__(self, prices=None):
+        self.prices = prices or {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        price = self.prices.get(model)
+        if price is None or prompt_tokens is None or completion_tokens is None:
+            return None
+        return (
+            prompt_tokens * price.get("input", 0)
+            + completion_tokens * price.get("output", 0)
+        ) / 1_000_000
+
+    @contextmanager
+    def call(self, model, streaming=False):
+        """Record the call made inside the block, also when it raises
+
+        Yields a CallTimer for the client to report the first token and the
+        provider's usage; time to first token is only known for streams.
+        """
+        timer = CallTimer()
+        error = None
+        try:
+            yield timer
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            first_token_at = timer.first_token_at if streaming else None
+            record = {
+                "stage": _stage.get(),
+                "chapter": _chapter.get(),
+                "game": _game.get(),
+                "model": model,
+                "streaming": streaming,
+                "cache_hit": timer.cache_hit,
+                "estimated": timer.estimated,
+                "error": error,
+                "prompt_tokens": timer.prompt_tokens,
+                "completion_tokens": timer.completion_tokens,
+                "reasoning_tokens": timer.reasoning_tokens,
+                "cached_tokens": timer.cached_tokens,
+                "ttft_seconds": first_token_at - timer.start
+                if first_token_at is not None
+                else None,
+                "latency_seconds": end - timer.start,
+                "cost": None
+                if timer.cache_hit
+                else self.cost(model, timer.prompt_tokens, timer.completion_tokens),
+            }
+            with self._lock:
+                self.calls.append(record)
+
+    def summary(self):
+        """Totals per (stage, model)"""
+        totals = {}
+        with self._lock:
+            calls = list(self.calls)
+        for call in calls:
+            total = totals.setdefault(
+                (call["stage"] or "-", call["model"]),
+                {
+                    "calls": 0,
+                    "cache_hits": 0,
+                    "errors": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "reasoning_tokens": 0,
+                    "cached_tokens": 0,
+                    "latency_seconds": 0.0,
+                    "ttft": [],
+                    "cost": None,
+                },
+            )
+            total["calls"] += 1
+            total["cache_hits"] += call["cache_hit"]
+            total["errors"] += call["error"] is not None
+            total["prompt_tokens"] += call["prompt_tokens"] or 0
+            total["completion_tokens"] += call["completion_tokens"] or 0
+            total["reasoning_tokens"] += call["reasoning_tokens"] or 0
+            total["cached_tokens"] += call["cached_tokens"] or 0
+            total["latency_seconds"] += call["latency_seconds"]
+            if call["ttft_seconds"] is not None:
+                total["ttft"].append(call["ttft_seconds"])
+            if call["cost"] is not None:
+                total["cost"] = (total["cost"] or 0.0) + call["cost"]
+        for total in totals.values():
+            ttft = total.pop("ttft")
+            total["avg_ttft_seconds"] = sum(ttft) / len(ttft) if ttft else None
+            total["avg_latency_seconds"] = total["latency_seconds"] / total["calls"]
+        return totals
+
+    def game_summary(self):
+        """Calls, tokens and cost per game tagged with tagged(game=...)"""
+        totals = {}
+        with self._lock:
+            calls = list(self.calls)
+        for call in calls:
+            if call["game"] is None:
+                continue
+            total = totals.setdefault(
+                call["game"],
+                {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": None},
+            )
+            total["calls"] += 1
+            total["prompt_tokens"] += call["prompt_tokens"] or 0
+            total["completion_tokens"] += call["completion_tokens"] or 0
+            if call["cost"] is not None:
+                total["cost"] = (total["cost"] or 0.0) + call["cost"]
+        return totals
+
+    def write_report(self, path):
+        """Write every call and the per-stage totals as JSON"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            calls = list(self.calls)
+        report = {
+            "summary": [
+                {"stage": stage, "model": model, **total}
+                for (stage, model), total in sorted(self.summary().items())
+            ],
+            "calls": calls,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    """The process-wide Telemetry shared by every model client"""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry(MODEL_PRICES)
+        return _telemetry
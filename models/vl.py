@@ -1,4 +1,5 @@
 from models.openai import ChatOpenAI
+from models.cache import get_response_cache
 from config import (
     VL_MODEL_API_BASE_URL,
     VL_MODEL_API_KEY,
@@ -14,7 +15,11 @@ class VLModel:
             api_key=VL_MODEL_API_KEY,
             base_url=VL_MODEL_API_BASE_URL,
             temperature=VL_MODEL_TEMPERATURE,
+            cache=get_response_cache(),
         )
 
     def run(self, input_text: str):
         return self.llm.invoke(input_text)
+
+    async def arun(self, input_text: str):
+        return await self.llm.ainvoke(input_text)
@@ -77,7 +77,7 @@ Do not modify the names of the Keys in the example, just fill in the correspondi
 """
 
 GENERATE_CHAPTER_PROMPT = """
-Craft a detailed plot for {chapter_name} based on the following visual novel plot outline, incorporating creativity, character dialogue, scene descriptions, detailed descriptions, and event development. Write the plot as comprehensively as possible.
+Craft a detailed plot for the chapter named in the user message, based on the following visual novel plot outline, incorporating creativity, character dialogue, scene descriptions, detailed descriptions, and event development. Write the plot as comprehensively as possible.
 
 Ensure dialogues between characters last for a sufficient number of turns, avoiding abrupt endings within just a few lines.
 
@@ -103,8 +103,12 @@ Outline content:
 {draft_content}
 """
 
+GENERATE_CHAPTER_REQUEST_PROMPT = """
+Write the plot of {chapter_name}.
+"""
+
 GENERATE_CHAPTER_SCRIPT_PROMPT = r"""
-Rewrite the specific script of {chapter_name} into Ren'Py script, according to the visual novel plot outline below, to adapt to the production of visual novels.
+Rewrite the specific plot of the chapter given in the user message into Ren'Py script, according to the visual novel plot outline below, to adapt to the production of visual novels.
 Only output the script content, without asking for my opinion or discussing it with me.
 In this visual novel, the player plays one of the characters in the first person. The system should refer to the player in the second person "you".
 [Important] Do not miss any dialogues and details in the plot, you should make the logic of the script natural and smooth, and avoid generating logically confusing or jumping scripts.
@@ -139,7 +143,9 @@ If you need to insert a percent sign \% in the script, you need to escape it: \%
 
 Outline content:
 {draft_content}
+"""
 
+GENERATE_CHAPTER_SCRIPT_REQUEST_PROMPT = """
 【{chapter_name}】Specific plot:
 {chapter_content}
 """
@@ -471,3 +477,48 @@ Current file content:
 
 Please provide the complete fixed script content, only return the fixed script code, do not add any instructions or explanations, and do not return the original code.
 """
+
+CONTINUE_GENERATION_PROMPT = """
+Your previous reply was cut off. Continue exactly where it stopped and output only the remaining content, without repeating what was already written and without adding any instructions or explanations.
+"""
+
+SUMMARIZE_CHAPTER_PROMPT = """
+Below is the finished chapter "{chapter_name}" of a visual novel. Summarize it in at most 200 words so that later chapters stay consistent with it, covering:
+- The key events
+- Changes in the characters' states, relationships and goals
+- Newly introduced characters, places, items or settings
+- Unresolved foreshadowing and open questions
+Return only the summary, without any explanations.
+
+Chapter content:
+{chapter_content}
+"""
+
+FIX_JSON_PROMPT = """
+The JSON in the user message could not be used: it is malformed, truncated or does not match the JSON schema below. Return the corrected JSON only, keeping its content unchanged wherever possible. Complete truncated parts briefly, and do not add any explanation.
+"""
+
+GENERATE_KEY_BACKGROUND_SD_PROMPT = """
+you are a professional Stable Diffusion (SD) prompt writer. below, please instruct an SD model to generate the backgrounds of a visual novel before its script is written.
+based on the world view setting and the chapter outlines provided, pick the key locations where the story takes place, no more than the number given in the user message. prefer locations that several chapters return to.
+output a list of prompts in JSON format. the JSON should contain an array, with each element in the array including the following parts:
+- image_name: the name of the image. it must start with `bg`, use only lowercase ascii letters, digits and underscores after it, and be separated from `bg` by a space, e.g. "bg school_gate".
+- prompt: the list of prompts.
+
+you should organize the prompts using lowercase **english** words or sentences, separated by commas ",". you only need to output positive prompts, not negative prompts.
+generally, use "background" to indicate that the image to be generated is a background image.
+pay attention to the characteristics of the world view when writing prompts.
+note that when writing background prompts, do not describe characters or other foreground elements. generally, there should be no characters in background images.
+
+example output:
+[
+  {
+    "image_name": "bg cafe",
+    "prompt": "(omitted)"
+  },
+  {
+    "image_name": "bg forest",
+    "prompt": "(omitted)"
+  }
+]
+"""
@@ -0,0 +1,22 @@
+def layered_messages(instructions: str, context=(), request: str = ""):
+    """Chat messages ordered from the most to the least stable content
+
+    Providers with automatic prefix caching (DeepSeek context caching, OpenAI,
+    vLLM prefix caching) only reuse the longest prefix a request shares with
+    earlier ones. The instructions and the context shared by every chapter
+    (outline, world view, character settings) therefore form the system
+    message, and the chapter-specific request comes last as the user message.
+    ChatGemini turns a long system message into an explicit context cache.
+
+    Args:
+        instructions (str): the task prompt, without per-chapter placeholders
+        context (Iterable[str]): shared context blocks, most stable first
+        request (str): the part that changes with every call
+
+    Returns:
+        list[tuple[str, str]]: (role, content) messages for invoke()/stream_run()
+    """
+    system = "\n\n".join(
+        block.strip() for block in (instructions, *context) if block and block.strip()
+    )
+    return [("system", system), ("user", request.strip())]
@@ -77,7 +77,7 @@ PARSE_DRAFT_PROMPT = """
 """
 
 GENERATE_CHAPTER_PROMPT = """
-针对以下的视觉小说剧情大纲内容，发挥创造力，编写【{chapter_name}】的具体剧情，包括角色对话、场景描写、细节描写、事件发展等。尽你所能地编写详细的剧情。
+针对以下的视觉小说剧情大纲内容，发挥创造力，编写用户消息中指定章节的具体剧情，包括角色对话、场景描写、细节描写、事件发展等。尽你所能地编写详细的剧情。
 角色之间的对话需要持续一定轮数，不要使对话在短短几行内结束。
 剧情的逻辑应当连续自然，不要产生跳跃。旁白是视觉小说剧情的重要组成部分，在必要时通过旁白或角色内心独白来补充说明，使玩家明白现在正在发生什么事情。
 注意做好场景之间的衔接，及时交代场景的变化，不要使场景切换显得突兀。
@@ -93,8 +93,12 @@ GENERATE_CHAPTER_PROMPT = """
 {draft_content}
 """
 
+GENERATE_CHAPTER_REQUEST_PROMPT = """
+请编写【{chapter_name}】的具体剧情。
+"""
+
 GENERATE_CHAPTER_SCRIPT_PROMPT = r"""
-针对以下的视觉小说剧情大纲内容，将【{chapter_name}】的具体剧本改写为 Ren'Py 脚本，以适配视觉小说的制作。
+针对以下的视觉小说剧情大纲内容，将用户消息中给出的章节剧情改写为 Ren'Py 脚本，以适配视觉小说的制作。
 仅输出脚本内容，无需征求我的意见或与我讨论。
 在这个视觉小说中，玩家以第一人称扮演其中一名角色。系统应当通过第二人称“你”来称呼玩家。
 【重要】不要遗漏剧情中的任何对话和细节，你应当使脚本的逻辑自然流畅，避免产生逻辑混乱或跳跃的脚本。
@@ -129,7 +133,9 @@ play music opening_song
 
 大纲内容：
 {draft_content}
+"""
 
+GENERATE_CHAPTER_SCRIPT_REQUEST_PROMPT = """
 【{chapter_name}】的具体剧情：
 {chapter_content}
 """
@@ -461,3 +467,48 @@ SCRIPT_FIX_PROMPT = r"""
 
 请提供修复后的完整脚本内容，仅返回修复后的脚本代码，不要添加任何说明或解释，也不要返回修复前的代码。
 """
+
+CONTINUE_GENERATION_PROMPT = """
+你上一条回复在中途被截断了。请从截断处继续输出剩余内容，不要重复已经输出的部分，也不要添加任何说明或解释。
+"""
+
+SUMMARIZE_CHAPTER_PROMPT = """
+以下是视觉小说中已经完成的章节「{chapter_name}」。请用不超过 300 字概括本章，供后续章节保持剧情连贯使用，需包含：
+- 发生的关键事件
+- 角色的状态、关系和目标的变化
+- 新出现的人物、地点、物品或设定
+- 尚未解决的伏笔和悬念
+仅返回概括内容，不要添加任何说明。
+
+章节内容：
+{chapter_content}
+"""
+
+FIX_JSON_PROMPT = """
+用户消息中的 JSON 无法使用：它格式有误、被截断，或不符合下方的 JSON Schema。请只返回修正后的 JSON，尽量保持其内容不变。被截断的部分请简短地补全，不要添加任何说明。
+"""
+
+GENERATE_KEY_BACKGROUND_SD_PROMPT = """
+你是一位专业的 Stable Diffusion (SD) 提示词撰写员。下面，请你在视觉小说的脚本写成之前，指挥一个 SD 模型生成它的背景图片。
+根据提供给你的世界观设定和各章节大纲，挑选故事发生的关键地点，数量不超过用户消息中给出的上限。优先选择多个章节都会出现的地点。
+输出JSON格式的提示词列表。JSON应当包含一个数组，数组中的每个元素包含以下几个部分：
+- image_name: 图片的名称。必须以 `bg` 开头，之后用一个空格分隔，并且只使用小写英文字母、数字和下划线，例如 "bg school_gate"。
+- prompt: 提示词列表。
+
+你应该用全小写的**英文**词语或句子来组织提示词，并用逗号","分隔它们。你只需要输出正向提示词，不要输出反向提示词。
+一般来说，应该使用"background"，从而表明要生成的图片是一张背景图。
+注意根据世界观的特点撰写提示词。
+注意，在撰写背景提示词时，不要描述人物或其他前景部分。一般背景图中不应有人物出现。
+
+示例输出：
+[
+  {
+    "image_name": "bg cafe",
+    "prompt": "(略)"
+  },
+  {
+    "image_name": "bg forest",
+    "prompt": "(略)"
+  }
+]
+"""
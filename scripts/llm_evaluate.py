@@ -13,7 +13,9 @@ from config import (
     EVALUATE_MODEL_API_KEY,
     EVALUATE_MODEL_NAME,
     EVALUATE_MODEL_TEMPERATURE,
+    WORKSPACE_ROOT,
 )
+from workspace import Workspace
 
 
 def read_scripts(script_dir):
@@ -97,11 +99,17 @@ def evaluate_scripts(model_name, api_key, script_dir, temperature=0.7, base_url=
 
 def main():
     parser = argparse.ArgumentParser(description="Evaluate scripts using Gemini model")
+    parser.add_argument(
+        "--workspace",
+        type=str,
+        default=WORKSPACE_ROOT,
+        help="Workspace of the game, WORKSPACE_ROOT of config.py by default",
+    )
     parser.add_argument(
         "--script_dir",
         type=str,
-        default="./temp/script/",
-        help="Path to the directory containing scripts",
+        default=None,
+        help="Path to the directory containing scripts, the scripts of the workspace by default",
     )
     parser.add_argument(
         "--output", type=str, help="Output results to the specified JSON file"
@@ -112,7 +120,7 @@ def main():
     result = evaluate_scripts(
         model_name=EVALUATE_MODEL_NAME,
         api_key=EVALUATE_MODEL_API_KEY,
-        script_dir=args.script_dir,
+        script_dir=args.script_dir or Workspace(args.workspace).scripts_dir,
         temperature=EVALUATE_MODEL_TEMPERATURE,
         base_url=EVALUATE_MODEL_API_BASE_URL,
     )
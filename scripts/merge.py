@@ -1,5 +1,13 @@
 import os
+import sys
 import glob
+import argparse
+
+# Add the project root to the import path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import WORKSPACE_ROOT
+from workspace import Workspace
 
 
 def get_text_files(directory):
@@ -43,10 +51,21 @@ def merge_text_files(input_dir, output_file):
 
 
 def main():
-    input_dir = "./temp/translated"
-    output_file = "./temp/combined_translation.txt"
+    parser = argparse.ArgumentParser(
+        description="Merge the translated chapters of a workspace into one file"
+    )
+    parser.add_argument(
+        "--workspace",
+        type=str,
+        default=WORKSPACE_ROOT,
+        help="Workspace of the game, WORKSPACE_ROOT of config.py by default",
+    )
+    args = parser.parse_args()
+    workspace = Workspace(args.workspace)
 
-    merge_text_files(input_dir, output_file)
+    merge_text_files(
+        workspace.translated_chapters_dir, workspace.combined_translation_file
+    )
     print("Merge process completed")
 
 
@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+# Add project root directory to path for module import
+sys.path.append(str(Path(__file__).parent.parent))
+
+import config
+
+MODEL_PREFIXES = ["REASONING", "GENERAL", "VL", "SD_PROMPT", "LINT"]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def point_config_at(llm_port, comfyui_ports):
+    """Route every model and ComfyUI call of this process to the stand-ins
+
+    Must run before the stage modules are imported, they copy the values.
+    Recording and both caches are turned off so that every call is served.
+    """
+    for prefix in MODEL_PREFIXES:
+        provider = getattr(config, f"{prefix}_MODEL_PROVIDER", "OpenAI")
+        base_url = f"http://127.0.0.1:{llm_port}"
+        setattr(
+            config,
+            f"{prefix}_MODEL_API_BASE_URL",
+            base_url if provider == "Gemini" else f"{base_url}/v1",
+        )
+    config.COMFY_UI_SERVER_ADDRESSES = [f"127.0.0.1:{port}" for port in comfyui_ports]
+    config.RECORD_FIXTURES_DIR = None
+    config.LLM_CACHE_PATH = None
+    config.COMFY_UI_CACHE_DIR = None
+
+
+def start_stand_ins(args, llm_port, comfyui_ports):
+    """Serve the fixtures from a background event loop, like replay_server.py"""
+    from aiohttp import web
+    from replay_server import LLMReplay, ComfyUIReplay
+
+    started = threading.Event()
+    servers = {}
+
+    async def serve():
+        llm = LLMReplay(args.fixtures, args.latency, args.latency_scale)
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.add_routes(llm.routes())
+        runners = [(web.AppRunner(app), llm_port)]
+        comfyui_servers = []
+        for port in comfyui_ports:
+            comfyui = ComfyUIReplay(args.fixtures, args.step_seconds, args.load_seconds)
+            app = web.Application(client_max_size=64 * 1024 * 1024)
+            app.add_routes(comfyui.routes())
+            runners.append((web.AppRunner(app), port))
+            comfyui_servers.append(comfyui)
+        for runner, port in runners:
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+        for comfyui in comfyui_servers:
+            asyncio.create_task(comfyui.worker())
+        servers["llm"], servers["comfyui"] = llm, comfyui_servers
+        started.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+    if not started.wait(30):
+        raise RuntimeError("Stand-in servers did not start")
+    return servers["llm"], servers["comfyui"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a game against replayed fixtures and check its "
+        "wall time and model calls against bounds, to catch throughput regressions"
+    )
+    parser.add_argument("fixtures", help="Fixture directory of the recorded run")
+    parser.add_argument(
+        "--theme", required=True, help="Game theme of the recorded run, verbatim"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.2,
+        help="Fixed seconds per LLM response, so timings compare across machines",
+    )
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="Multiplier of the recorded LLM latency when --latency is negative",
+    )
+    parser.add_argument("--step-seconds", type=float, default=0.01)
+    parser.add_argument("--load-seconds", type=float, default=0.2)
+    parser.add_argument(
+        "--comfyui-servers", type=int, default=1, help="Stand-in GPUs to spread jobs on"
+    )
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=None,
+        help="Fail when generating the game takes longer",
+    )
+    parser.add_argument(
+        "--max-llm-calls",
+        type=int,
+        default=None,
+        help="Fail when the pipeline makes more model calls",
+    )
+    args = parser.parse_args()
+    if args.latency < 0:
+        args.latency = None
+
+    llm_port = _free_port()
+    comfyui_ports = [_free_port() for _ in range(args.comfyui_servers)]
+    point_config_at(llm_port, comfyui_ports)
+    llm, comfyui_servers = start_stand_ins(args, llm_port, comfyui_ports)
+
+    from models.telemetry import get_telemetry
+    from workspace import Workspace
+    from stage.stage import SharedClients, generate_game
+    from stage.theme_manager import get_game_theme
+
+    with tempfile.TemporaryDirectory() as root:
+        workspace = Workspace(os.path.join(root, "game"))
+        with workspace:
+            clients = SharedClients(workspace.logs_dir)
+            start_time = time.monotonic()
+            theme = get_game_theme(workspace, args.theme)
+            generate_game(
+                clients,
+                workspace,
+                theme,
+                os.path.join(root, "project"),
+                show_progress=False,
+            )
+            seconds = time.monotonic() - start_time
+            clients.comfyui.close()
+
+    llm_calls = len(get_telemetry().calls)
+    comfyui_jobs = sum(server.jobs for server in comfyui_servers)
+    comfyui_misses = sum(server.misses for server in comfyui_servers)
+    print(f"Wall time: {seconds:.1f}s")
+    print(f"LLM calls: {llm_calls} ({llm.hits} replayed, {llm.misses} not recorded)")
+    print(f"ComfyUI jobs: {comfyui_jobs} ({comfyui_misses} not recorded)")
+
+    failures = []
+    if llm.misses or comfyui_misses:
+        failures.append(
+            "requests without a recording, the prompts or theme differ from the fixtures"
+        )
+    if args.max_seconds is not None and seconds > args.max_seconds:
+        failures.append(f"wall time {seconds:.1f}s > {args.max_seconds}s")
+    if args.max_llm_calls is not None and llm_calls > args.max_llm_calls:
+        failures.append(f"{llm_calls} LLM calls > {args.max_llm_calls}")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
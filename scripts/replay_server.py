@@ -0,0 +1,534 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from pathlib import Path
+from aiohttp import web
+
+# Add project root directory to path for module import
+sys.path.append(str(Path(__file__).parent.parent))
+
+from models.recorder import request_key, canonical_messages
+from comfy import (
+    OutputCache,
+    replay_key,
+    SAMPLER_NODES,
+    STREAM_OUTPUT_NODE,
+    PREVIEW_IMAGE_EVENT,
+    _model_key,
+)
+
+
+def _delays(response, latency, latency_scale):
+    """(time to first token, total time) of a replayed response"""
+    recorded_total = response.get("latency_seconds") or 0.0
+    recorded_ttft = response.get("ttft_seconds") or 0.0
+    if latency is None:
+        return recorded_ttft * latency_scale, recorded_total * latency_scale
+    # A fixed latency keeps the recorded share of time to first token
+    share = recorded_ttft / recorded_total if recorded_total else 0.0
+    return latency * share, latency
+
+
+def _usage(response, messages):
+    """Recorded token usage, estimated for responses recorded from a cache hit"""
+    usage = dict(response.get("usage") or {})
+    if usage.get("prompt_tokens") is None:
+        usage["prompt_tokens"] = len(json.dumps(messages, ensure_ascii=False)) // 2
+    if usage.get("completion_tokens") is None:
+        usage["completion_tokens"] = len(response["content"] or "") // 2
+    return usage
+
+
+def _pieces(text, count):
+    """Split text into about `count` stream chunks"""
+    text = text or ""
+    size = max(1, -(-len(text) // max(1, count)))
+    return [text[k : k + size] for k in range(0, len(text), size)] or [""]
+
+
+class LLMReplay:
+    """OpenAI- and Gemini-compatible stand-in answering with recorded responses
+
+    Identical requests get their recorded responses in the recorded order,
+    the last one repeats. Requests that were not recorded fail with 404.
+    """
+
+    def __init__(self, directory, latency=None, latency_scale=1.0):
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.fixtures = {}
+        llm_directory = os.path.join(directory, "llm")
+        if os.path.isdir(llm_directory):
+            for name in os.listdir(llm_directory):
+                if name.endswith(".json"):
+                    with open(os.path.join(llm_directory, name), encoding="utf-8") as f:
+                        self.fixtures[name[: -len(".json")]] = json.load(f)
+        self._served = {}
+        # name -> system instruction of the Gemini context caches created
+        self._context_caches = {}
+        self.hits = 0
+        self.misses = 0
+
+    def routes(self):
+        return [
+            web.post(r"/{prefix:.*}chat/completions", self.openai_chat),
+            web.post("/{version}/cachedContents", self.gemini_create_cache),
+            web.post("/{version}/models/{call}", self.gemini_generate),
+        ]
+
+    def _next(self, model, messages):
+        key = request_key(model, messages)
+        fixture = self.fixtures.get(key)
+        if fixture is None:
+            self.misses += 1
+            canonical = canonical_messages(messages)
+            last = canonical[-1]["content"] if canonical else ""
+            preview = last if isinstance(last, str) else json.dumps(last)[:200]
+            print(f"Replay miss for {model}: {preview[:200]!r}")
+            return None
+        index = self._served.get(key, 0)
+        self._served[key] = index + 1
+        self.hits += 1
+        responses = fixture["responses"]
+        return responses[min(index, len(responses) - 1)]
+
+    @staticmethod
+    def _miss():
+        return web.json_response(
+            {
+                "error": {
+                    "message": "No recorded response for this request",
+                    "type": "replay_miss",
+                }
+            },
+            status=404,
+        )
+
+    async def openai_chat(self, request):
+        body = await request.json()
+        model, messages = body["model"], body["messages"]
+        response = self._next(model, messages)
+        if response is None:
+            return self._miss()
+        ttft, total = _delays(response, self.latency, self.latency_scale)
+        usage = _usage(response, messages)
+        openai_usage = {
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"],
+            "prompt_tokens_details": {"cached_tokens": usage.get("cached_tokens")},
+            "completion_tokens_details": {
+                "reasoning_tokens": usage.get("reasoning_tokens")
+            },
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(total)
+            message = {"role": "assistant", "content": response["content"]}
+            if response.get("reasoning_content") is not None:
+                message["reasoning_content"] = response["reasoning_content"]
+            return web.json_response(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {"index": 0, "message": message, "finish_reason": "stop"}
+                    ],
+                    "usage": openai_usage,
+                }
+            )
+
+        stream = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await stream.prepare(request)
+
+        async def send(payload):
+            await stream.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+
+        # One chunk per recorded output token, spread over the recorded time
+        pieces = _pieces(response["content"], usage["completion_tokens"])
+        await asyncio.sleep(ttft)
+        interval = max(0.0, total - ttft) / len(pieces)
+        for k, piece in enumerate(pieces):
+            delta = {"content": piece}
+            if k == 0:
+                delta["role"] = "assistant"
+            await send(chunk(delta))
+            if interval:
+                await asyncio.sleep(interval)
+        await send(chunk({}, "stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({**chunk({}), "choices": [], "usage": openai_usage})
+        await stream.write(b"data: [DONE]\n\n")
+        await stream.write_eof()
+        return stream
+
+    async def gemini_create_cache(self, request):
+        body = await request.json()
+        name = f"cachedContents/{uuid.uuid4().hex}"
+        self._context_caches[name] = _gemini_text(body.get("systemInstruction"))
+        return web.json_response({"name": name, "model": body.get("model")})
+
+    async def gemini_generate(self, request):
+        model, _, method = request.match_info["call"].partition(":")
+        body = await request.json()
+
+        # Rebuild the (role, content) messages ChatGemini was called with
+        messages = []
+        system = _gemini_text(body.get("systemInstruction"))
+        if body.get("cachedContent"):
+            system = self._context_caches.get(body["cachedContent"])
+        if system is not None:
+            messages.append(("system", system))
+        for content in body.get("contents", []):
+            messages.append((content.get("role", "user"), _gemini_text(content)))
+
+        response = self._next(model, messages)
+        if response is None:
+            return self._miss()
+        ttft, total = _delays(response, self.latency, self.latency_scale)
+        usage = _usage(response, messages)
+
+        def payload(text, completion_tokens):
+            return {
+                "candidates": [
+                    {
+                        "content": {"role": "model", "parts": [{"text": text}]},
+                        "finishReason": "STOP",
+                        "index": 0,
+                    }
+                ],
+                "usageMetadata": {
+                    "promptTokenCount": usage["prompt_tokens"],
+                    "candidatesTokenCount": completion_tokens
+                    - (usage.get("reasoning_tokens") or 0),
+                    "thoughtsTokenCount": usage.get("reasoning_tokens"),
+                    "cachedContentTokenCount": usage.get("cached_tokens"),
+                    "totalTokenCount": usage["prompt_tokens"] + completion_tokens,
+                },
+                "modelVersion": model,
+            }
+
+        if method != "streamGenerateContent":
+            await asyncio.sleep(total)
+            return web.json_response(
+                payload(response["content"], usage["completion_tokens"])
+            )
+
+        stream = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await stream.prepare(request)
+        # Gemini streams fewer, larger chunks than OpenAI-style APIs
+        pieces = _pieces(response["content"], usage["completion_tokens"] // 20)
+        await asyncio.sleep(ttft)
+        interval = max(0.0, total - ttft) / len(pieces)
+        for k, piece in enumerate(pieces):
+            event = payload(piece, usage["completion_tokens"] * (k + 1) // len(pieces))
+            await stream.write(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+            if interval:
+                await asyncio.sleep(interval)
+        await stream.write_eof()
+        return stream
+
+
+def _gemini_text(content):
+    """Text of a Gemini Content object, or None"""
+    if not content:
+        return None
+    return "".join(part.get("text", "") for part in content.get("parts", []))
+
+
+class ComfyUIReplay:
+    """Stand-in ComfyUI server returning recorded outputs
+
+    Jobs run one at a time like on a real GPU: a job whose models differ
+    from the previous one waits `load_seconds`, then every sampler step
+    takes `step_seconds` per image in the batch. Progress events, streamed
+    images, /history and /view behave like ComfyUI's.
+    """
+
+    def __init__(self, directory, step_seconds=0.05, load_seconds=2.0):
+        self.step_seconds = step_seconds
+        self.load_seconds = load_seconds
+        self.store = OutputCache(os.path.join(directory, "comfyui"), float("inf"))
+        self._clients = {}
+        self._queue = asyncio.Queue()
+        self._pending = []
+        self._running = []
+        self._history = {}
+        self._files = {}
+        self._loaded_models = None
+        self._number = 0
+        self.jobs = 0
+        self.misses = 0
+
+    def routes(self):
+        return [
+            web.post("/prompt", self.queue_prompt),
+            web.get("/queue", self.get_queue),
+            web.get("/history/{prompt_id}", self.get_history),
+            web.get("/view", self.view),
+            web.get("/ws", self.websocket),
+        ]
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse(heartbeat=20)
+        await ws.prepare(request)
+        client_id = request.query.get("clientId") or uuid.uuid4().hex
+        self._clients[client_id] = ws
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            if self._clients.get(client_id) is ws:
+                del self._clients[client_id]
+        return ws
+
+    async def _send(self, client_id, message):
+        ws = self._clients.get(client_id)
+        if ws is None or ws.closed:
+            return
+        try:
+            if isinstance(message, bytes):
+                await ws.send_bytes(message)
+            else:
+                await ws.send_str(json.dumps(message))
+        except ConnectionError:
+            pass
+
+    async def queue_prompt(self, request):
+        body = await request.json()
+        prompt_id = str(uuid.uuid4())
+        self._number += 1
+        self._pending.append(prompt_id)
+        await self._queue.put((prompt_id, body["prompt"], body.get("client_id")))
+        return web.json_response(
+            {"prompt_id": prompt_id, "number": self._number, "node_errors": {}}
+        )
+
+    async def get_queue(self, request):
+        return web.json_response(
+            {
+                "queue_running": [[0, prompt_id] for prompt_id in self._running],
+                "queue_pending": [[0, prompt_id] for prompt_id in self._pending],
+            }
+        )
+
+    async def get_history(self, request):
+        prompt_id = request.match_info["prompt_id"]
+        if prompt_id not in self._history:
+            return web.json_response({})
+        return web.json_response({prompt_id: self._history[prompt_id]})
+
+    async def view(self, request):
+        data = self._files.get(request.query.get("filename"))
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data)
+
+    async def worker(self):
+        while True:
+            prompt_id, graph, client_id = await self._queue.get()
+            self._pending.remove(prompt_id)
+            self._running.append(prompt_id)
+            try:
+                await self._run(prompt_id, graph, client_id)
+            finally:
+                self._running.remove(prompt_id)
+
+    async def _run(self, prompt_id, graph, client_id):
+        self.jobs += 1
+        await self._send(
+            client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}}
+        )
+        outputs = await asyncio.to_thread(self.store.get, replay_key(graph))
+        if outputs is None:
+            self.misses += 1
+            print(f"Replay miss for ComfyUI job {prompt_id}")
+            self._history[prompt_id] = {
+                "prompt": [0, prompt_id, graph, {}, []],
+                "outputs": {},
+                "status": {"status_str": "error", "completed": False},
+            }
+            await self._send(
+                client_id,
+                {
+                    "type": "execution_error",
+                    "data": {
+                        "prompt_id": prompt_id,
+                        "exception_message": "No recorded outputs for this workflow",
+                    },
+                },
+            )
+            return
+
+        models = _model_key(graph)
+        if models != self._loaded_models:
+            await asyncio.sleep(self.load_seconds)
+            self._loaded_models = models
+        batch_size = max(
+            [node["inputs"].get("batch_size", 1) for node in graph.values()] + [1]
+        )
+
+        history_outputs = {}
+        for node_id, node in graph.items():
+            await self._send(
+                client_id,
+                {
+                    "type": "executing",
+                    "data": {"node": node_id, "prompt_id": prompt_id},
+                },
+            )
+            if node["class_type"] in SAMPLER_NODES:
+                steps = node["inputs"].get("steps", 20)
+                for step in range(steps):
+                    await asyncio.sleep(self.step_seconds * batch_size)
+                    await self._send(
+                        client_id,
+                        {
+                            "type": "progress",
+                            "data": {
+                                "value": step + 1,
+                                "max": steps,
+                                "prompt_id": prompt_id,
+                                "node": node_id,
+                            },
+                        },
+                    )
+            if node_id not in outputs:
+                continue
+            if node["class_type"] == STREAM_OUTPUT_NODE:
+                for data_type, data in outputs[node_id]:
+                    # 4 bytes event type + 4 bytes image format, then the image
+                    header = PREVIEW_IMAGE_EVENT.to_bytes(4, "big") + (2).to_bytes(
+                        4, "big"
+                    )
+                    await self._send(client_id, header + data)
+                continue
+            node_output = {}
+            for k, (data_type, data) in enumerate(outputs[node_id]):
+                filename = f"{prompt_id}_{node_id}_{k}"
+                self._files[filename] = data
+                key = "images" if data_type == "image" else "audio"
+                node_output.setdefault(key, []).append(
+                    {"filename": filename, "subfolder": "", "type": "output"}
+                )
+            history_outputs[node_id] = node_output
+
+        self._history[prompt_id] = {
+            "prompt": [0, prompt_id, graph, {}, []],
+            "outputs": history_outputs,
+            "status": {"status_str": "success", "completed": True},
+        }
+        await self._send(
+            client_id,
+            {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}},
+        )
+
+
+async def serve(args):
+    runners = []
+
+    llm = LLMReplay(args.fixtures, args.latency, args.latency_scale)
+    llm_app = web.Application(client_max_size=256 * 1024 * 1024)
+    llm_app.add_routes(llm.routes())
+    runners.append(web.AppRunner(llm_app))
+
+    comfyui_servers = []
+    for port in args.comfyui_ports:
+        comfyui = ComfyUIReplay(args.fixtures, args.step_seconds, args.load_seconds)
+        comfyui_app = web.Application(client_max_size=64 * 1024 * 1024)
+        comfyui_app.add_routes(comfyui.routes())
+        runners.append(web.AppRunner(comfyui_app))
+        comfyui_servers.append(comfyui)
+
+    ports = [args.llm_port, *args.comfyui_ports]
+    for runner, port in zip(runners, ports):
+        await runner.setup()
+        await web.TCPSite(runner, args.host, port).start()
+    workers = [asyncio.create_task(comfyui.worker()) for comfyui in comfyui_servers]
+
+    print(f"Loaded {len(llm.fixtures)} LLM fixtures from {args.fixtures}")
+    print("Point config.py at the stand-ins, keeping the recorded model names:")
+    print(f'  *_API_BASE_URL = "http://{args.host}:{args.llm_port}/v1"')
+    print(f'  (Gemini: "http://{args.host}:{args.llm_port}")')
+    addresses = ", ".join(f'"{args.host}:{port}"' for port in args.comfyui_ports)
+    print(f"  COMFY_UI_SERVER_ADDRESSES = [{addresses}]")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        print(f"LLM requests replayed: {llm.hits}, missed: {llm.misses}")
+        for port, comfyui in zip(args.comfyui_ports, comfyui_servers):
+            print(
+                f"ComfyUI {port}: {comfyui.jobs} jobs, {comfyui.misses} without a recording"
+            )
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a run recorded with RECORD_FIXTURES_DIR from local stand-in servers"
+    )
+    parser.add_argument("fixtures", help="Fixture directory of the recorded run")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--llm-port", type=int, default=9100)
+    parser.add_argument(
+        "--comfyui-ports",
+        type=int,
+        nargs="+",
+        default=[8188],
+        help="One stand-in ComfyUI server (GPU) per port",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=None,
+        help="Fixed seconds per LLM response instead of the recorded latency",
+    )
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="Multiplier of the recorded LLM latency, e.g. 0 for instant answers",
+    )
+    parser.add_argument(
+        "--step-seconds",
+        type=float,
+        default=0.05,
+        help="Seconds per sampler step and image",
+    )
+    parser.add_argument(
+        "--load-seconds",
+        type=float,
+        default=2.0,
+        help="Seconds to load the models of a job after a different workflow",
+    )
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import os
 import glob
 import openai
 import sys
+import argparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # 添加项目根目录到系统路径
@@ -12,7 +13,9 @@ from config import (
     TRANSLATE_MODEL_API_KEY,
     TRANSLATE_MODEL_NAME,
     TRANSLATE_MODEL_TEMPERATURE,
+    WORKSPACE_ROOT,
 )
+from workspace import Workspace
 
 # 初始化OpenAI客户端
 client = openai.OpenAI(
@@ -79,11 +82,12 @@ def process_file(file_path, output_dir):
         return None
 
 
-def main():
+def translate_chapters(workspace: Workspace):
+    """翻译工作区中的所有章节，并合并到一个文件中"""
     # 输入和输出路径
-    input_dir = "./temp/chapters/"
-    output_dir = "./temp/translated/"
-    combined_output = "./temp/combined_translation.txt"
+    input_dir = workspace.chapters_dir
+    output_dir = workspace.translated_chapters_dir
+    combined_output = workspace.combined_translation_file
 
     # 创建输出目录（如果不存在）
     os.makedirs(output_dir, exist_ok=True)
@@ -120,5 +124,17 @@ def main():
     print("翻译过程完成")
 
 
+def main():
+    parser = argparse.ArgumentParser(description="将工作区中的章节翻译成英文")
+    parser.add_argument(
+        "--workspace",
+        type=str,
+        default=WORKSPACE_ROOT,
+        help="游戏的工作区目录，默认为 config.py 中的 WORKSPACE_ROOT",
+    )
+    args = parser.parse_args()
+    translate_chapters(Workspace(args.workspace))
+
+
 if __name__ == "__main__":
     main()
@@ -2,6 +2,7 @@ import os
 import glob
 import openai
 import sys
+import argparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # 添加项目根目录到系统路径
@@ -12,7 +13,9 @@ from config import (
     TRANSLATE_MODEL_API_KEY,
     TRANSLATE_MODEL_NAME,
     TRANSLATE_MODEL_TEMPERATURE,
+    WORKSPACE_ROOT,
 )
+from workspace import Workspace
 
 # 初始化OpenAI客户端
 client = openai.OpenAI(
@@ -79,10 +82,11 @@ def process_script(file_path, output_dir):
         return False
 
 
-def main():
+def translate_scripts(workspace: Workspace):
+    """翻译工作区中的所有 Ren'Py 脚本"""
     # 输入和输出路径
-    input_dir = "./temp/scripts/"
-    output_dir = "./temp/translated_scripts/"
+    input_dir = workspace.scripts_dir
+    output_dir = workspace.translated_scripts_dir
 
     # 创建输出目录（如果不存在）
     os.makedirs(output_dir, exist_ok=True)
@@ -117,5 +121,17 @@ def main():
     )
 
 
+def main():
+    parser = argparse.ArgumentParser(description="将工作区中的 Ren'Py 脚本翻译成英文")
+    parser.add_argument(
+        "--workspace",
+        type=str,
+        default=WORKSPACE_ROOT,
+        help="游戏的工作区目录，默认为 config.py 中的 WORKSPACE_ROOT",
+    )
+    args = parser.parse_args()
+    translate_scripts(Workspace(args.workspace))
+
+
 if __name__ == "__main__":
     main()
@@ -1,5 +1,6 @@
 import os
 import json
+import threading
 import subprocess
 from rich.console import Console
 from rich.panel import Panel
@@ -11,7 +12,10 @@ from rich.progress import (
     BarColumn,
     TimeElapsedColumn,
 )
-from comfy import ComfyUI
+from comfy import WorkflowClient, templates
+from manifest import file_hash, input_hash
+from workspace import Workspace
+from .image_generator import track_sampling
 
 # Create console instance
 console = Console()
@@ -69,17 +73,64 @@ def convert_flac_to_opus(input_file, output_file):
         raise
 
 
-def generate_audio(structured_draft, comfyui: ComfyUI):
-    """Generate audio based on prompts and save to the specified directory"""
-    os.makedirs("./temp/audio", exist_ok=True)
+# Guards the audio names claimed by generate_audio() calls running concurrently
+_claim_lock = threading.Lock()
+
+
+def generate_audio(
+    workspace: Workspace,
+    structured_draft,
+    comfyui: WorkflowClient,
+    chapter_indices=None,
+    show_progress=True,
+    claimed=None,
+):
+    """Generate audio based on prompts and save to the specified directory
+
+    Args:
+        chapter_indices (list[int]): only these chapters (0-based), all when None
+        show_progress (bool): False while another live display is active
+        claimed (dict): audio name -> chapter that claimed it, shared by calls
+            for different chapters so that an audio file is only generated once
+    """
+    os.makedirs(workspace.audio_dir, exist_ok=True)
     MUSIC_TEMPLATE = "./audio/music.json"
     MUSIC_DURATION = 30
     SFX_TEMPLATE = "./audio/sfx_audio.json"
     SFX_DURATION = 5
+    # Parse and check the workflows before any job is queued
+    for template in (MUSIC_TEMPLATE, SFX_TEMPLATE):
+        templates.get(template, "audio")
     chapters = structured_draft["chapters"]
+    template_hashes = {
+        "music": file_hash(MUSIC_TEMPLATE),
+        "sfx": file_hash(SFX_TEMPLATE),
+    }
+    durations = {"music": MUSIC_DURATION, "sfx": SFX_DURATION}
+
+    def audio_inputs(prompt_type, prompt_obj):
+        """Audio depends on its prompt, workflow and duration"""
+        return input_hash(
+            prompt_obj["prompt"], template_hashes[prompt_type], durations[prompt_type]
+        )
+
+    # Several chapters may name the same audio; it is up to date while it
+    # was generated from any of their prompts, so it is not redone each run
+    named_inputs = {}
+    for i in range(len(chapters)):
+        for prompt_type in ["music", "sfx"]:
+            prompt_file = workspace.audio_prompt_file(i, prompt_type)
+            if os.path.exists(prompt_file):
+                with open(prompt_file, "r", encoding="utf-8") as pf:
+                    for prompt_obj in json.load(pf):
+                        named_inputs.setdefault(prompt_obj["audio_name"], []).append(
+                            audio_inputs(prompt_type, prompt_obj)
+                        )
 
     # Collect audio generation tasks
     audio_tasks = []
+    # Use a dict to track added audio names to avoid duplicates
+    added_audio = {} if claimed is None else claimed
 
     console.print(
         Panel(
@@ -96,10 +147,10 @@ def generate_audio(structured_draft, comfyui: ComfyUI):
     table.add_column("Status", style="yellow")
 
     for i, chapter in enumerate(chapters):
+        if chapter_indices is not None and i not in chapter_indices:
+            continue
         for prompt_type in ["music", "sfx"]:
-            prompt_file = (
-                f"./temp/prompts/audio/chapter{i + 1}_{prompt_type}_prompt.json"
-            )
+            prompt_file = workspace.audio_prompt_file(i, prompt_type)
             if not os.path.exists(prompt_file):
                 table.add_row(
                     f"Chapter {i + 1}", prompt_type, "No prompt file", "⚠️ Skipped"
@@ -110,21 +161,41 @@ def generate_audio(structured_draft, comfyui: ComfyUI):
                 prompts = json.load(pf)
 
             for prompt_obj in prompts:
-                target_name = prompt_obj["audio_name"] + ".opus"
-                final_path = f"./temp/audio/{target_name}"
+                final_path = workspace.audio_file(prompt_obj["audio_name"])
+
+                candidates = [
+                    audio_inputs(prompt_type, prompt_obj),
+                    *named_inputs.get(prompt_obj["audio_name"], []),
+                ]
+                if any(
+                    workspace.manifest.is_fresh(final_path, inputs)
+                    for inputs in candidates
+                ):
+                    table.add_row(
+                        f"Chapter {i + 1}",
+                        prompt_type,
+                        prompt_obj["audio_name"],
+                        "✓ Up to date",
+                    )
+                    continue
 
-                if os.path.exists(final_path):
+                # Check for duplicate audio tasks, and claim the name otherwise
+                with _claim_lock:
+                    owner = added_audio.get(prompt_obj["audio_name"])
+                    if owner is None:
+                        added_audio[prompt_obj["audio_name"]] = f"Chapter {i + 1}"
+                if owner is not None:
                     table.add_row(
                         f"Chapter {i + 1}",
                         prompt_type,
                         prompt_obj["audio_name"],
-                        "✓ Exists",
+                        f"⚠️ Duplicate (already in {owner})",
                     )
                     continue
 
                 # Add to pending audio generation tasks
                 template = MUSIC_TEMPLATE if prompt_type == "music" else SFX_TEMPLATE
-                duration = MUSIC_DURATION if prompt_type == "music" else SFX_DURATION
+                duration = durations[prompt_type]
                 audio_tasks.append((i, prompt_type, prompt_obj, template, duration))
                 table.add_row(
                     f"Chapter {i + 1}",
@@ -159,18 +230,24 @@ def generate_audio(structured_draft, comfyui: ComfyUI):
         )
         return
 
-    def generate_audio_file(task_item):
-        i, prompt_type, prompt_obj, template, duration = task_item
-        target_name = prompt_obj["audio_name"] + ".opus"
-        final_path = f"./temp/audio/{target_name}"
-
-        audio_data_list = comfyui.generate_audio(
+    def submit_audio_file(task_item):
+        _, _, prompt_obj, template, duration = task_item
+        return comfyui.submit_audio(
             prompt_file=template,
             positive_prompt=prompt_obj["prompt"],
             duration_seconds=duration,
             batch_size=1,
+            on_progress=track_sampling(
+                progress, f"  Sampling {prompt_obj['audio_name']}"
+            ),
         )
 
+    def generate_audio_file(task_item, pending):
+        i, prompt_type, prompt_obj, template, duration = task_item
+        final_path = workspace.audio_file(prompt_obj["audio_name"])
+
+        audio_data_list = pending.result()
+
         if not audio_data_list:
             raise RuntimeError(f"Audio generation failed: {prompt_obj['audio_name']}")
 
@@ -178,7 +255,7 @@ def generate_audio(structured_draft, comfyui: ComfyUI):
         audio_data = audio_data_list[0]
 
         # Save as temporary FLAC file
-        temp_flac = f"./temp/audio/{target_name}.temp.flac"
+        temp_flac = f"{final_path}.temp.flac"
         with open(temp_flac, "wb") as f:
             f.write(audio_data)
 
@@ -190,25 +267,38 @@ def generate_audio(structured_draft, comfyui: ComfyUI):
 
         return (i, prompt_type, prompt_obj["audio_name"])
 
-    # Sequentially execute audio generation tasks
+    # Queue all audio jobs at once, then collect the results in order
     with Progress(
         SpinnerColumn(),
         TextColumn("[bold blue]{task.description}[/bold blue]"),
         BarColumn(),
         TextColumn("[bold]{task.completed}/{task.total}[/bold]"),
+        TextColumn("{task.fields[its]}"),
         TimeElapsedColumn(),
+        disable=not show_progress,
     ) as progress:
-        task = progress.add_task("Generating audio", total=len(audio_tasks))
+        task = progress.add_task("Generating audio", total=len(audio_tasks), its="")
 
-        for task_item in audio_tasks:
+        pending_jobs = [submit_audio_file(task_item) for task_item in audio_tasks]
+
+        for task_item, pending in zip(audio_tasks, pending_jobs):
             i, prompt_type, prompt_obj, template, duration = task_item
             try:
-                result = generate_audio_file(task_item)
+                result = generate_audio_file(task_item, pending)
                 i, type_name, audio_name = result
+                workspace.manifest.record(
+                    workspace.audio_file(audio_name),
+                    audio_inputs(prompt_type, prompt_obj),
+                )
                 progress.console.print(
                     f"[bold green]✓[/bold green] Finished generating Chapter {i + 1} {type_name} audio [{audio_name}]"
                 )
             except Exception as e:
+                # Give up the name so that a later chapter needing the same
+                # audio generates it
+                with _claim_lock:
+                    if added_audio.get(prompt_obj["audio_name"]) == f"Chapter {i + 1}":
+                        del added_audio[prompt_obj["audio_name"]]
                 progress.console.print(
                     f"[bold red]✗[/bold red] Error generating Chapter {i + 1} {prompt_type} audio [{prompt_obj['audio_name']}]: {str(e)}"
                 )
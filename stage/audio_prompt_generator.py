@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 from rich.console import Console
 from rich.progress import (
     Progress,
@@ -9,8 +10,17 @@ from rich.progress import (
     TimeElapsedColumn,
 )
 from models.general import GeneralModel
+from models.telemetry import tagged
 from config import LANGUAGE_MODE
-from util import remove_json_markers
+from prompt_layout import layered_messages
+from manifest import file_hash, input_hash, model_inputs
+from workspace import Workspace
+from structured_output import (
+    response_format,
+    aparse_json,
+    MUSIC_PROMPTS_SCHEMA,
+    SFX_PROMPTS_SCHEMA,
+)
 
 if LANGUAGE_MODE == "zh":
     from prompt_zh import (
@@ -27,32 +37,58 @@ else:
 console = Console()
 
 
-def generate_audio_prompts(structured_draft, general_model: GeneralModel):
-    """Generate music and sound effect prompt files for each chapter, using non-streaming output"""
-    os.makedirs("./temp/prompts/audio", exist_ok=True)
+def generate_audio_prompts(
+    workspace: Workspace,
+    structured_draft,
+    general_model: GeneralModel,
+    chapter_indices=None,
+    show_progress=True,
+):
+    """Generate music and sound effect prompt files for each chapter, using non-streaming output
+
+    Args:
+        chapter_indices (list[int]): only these chapters (0-based), all when None
+        show_progress (bool): False while another live display is active
+    """
+    os.makedirs(workspace.audio_prompts_dir, exist_ok=True)
+    prompt_templates = {"music": GENERATE_MUSIC_PROMPT, "sfx": GENERATE_SFX_PROMPT}
+    schemas = {"music": MUSIC_PROMPTS_SCHEMA, "sfx": SFX_PROMPTS_SCHEMA}
+
+    def prompt_inputs(i, prompt_type):
+        """Everything the prompt_type prompts of chapter i are generated from"""
+        return input_hash(
+            prompt_templates[prompt_type],
+            schemas[prompt_type],
+            file_hash(workspace.chapter_script(i)),
+            model_inputs(general_model),
+        )
 
-    # Check if all prompt files already exist
-    all_prompts_exist = True
+    # Check which prompt files are missing or out of date
+    all_prompts_fresh = True
     prompts_to_generate = []
 
     chapters = structured_draft["chapters"]
     for i, chapter in enumerate(chapters):
-        music_file_path = f"./temp/prompts/audio/chapter{i + 1}_music_prompt.json"
-        sfx_file_path = f"./temp/prompts/audio/chapter{i + 1}_sfx_prompt.json"
+        if chapter_indices is not None and i not in chapter_indices:
+            continue
+        music_fresh = workspace.manifest.is_fresh(
+            workspace.audio_prompt_file(i, "music"), prompt_inputs(i, "music")
+        )
+        sfx_fresh = workspace.manifest.is_fresh(
+            workspace.audio_prompt_file(i, "sfx"), prompt_inputs(i, "sfx")
+        )
 
-        if not os.path.exists(music_file_path) or not os.path.exists(sfx_file_path):
-            all_prompts_exist = False
+        if not music_fresh or not sfx_fresh:
+            all_prompts_fresh = False
 
-            if not os.path.exists(music_file_path) and not os.path.exists(
-                sfx_file_path
-            ):
+            if not music_fresh and not sfx_fresh:
                 status = "both"
-            elif not os.path.exists(music_file_path):
+            elif not music_fresh:
                 status = "music"
             else:
                 status = "sfx"
 
-            script_path = f"./temp/scripts/chapter{i + 1}.rpy"
+            script_path = workspace.chapter_script(i)
             if os.path.exists(script_path):
                 prompts_to_generate.append((i, chapter, status))
             else:
@@ -61,82 +97,113 @@ def generate_audio_prompts(structured_draft, general_model: GeneralModel):
                 )
         else:
             console.print(
-                f"[yellow]Audio prompt files for chapter {i + 1} already exist, skipping audio prompt generation for this chapter...[/yellow]"
+                f"[yellow]Audio prompt files for chapter {i + 1} are up to date, skipping audio prompt generation for this chapter...[/yellow]"
             )
 
-    if all_prompts_exist:
+    if all_prompts_fresh:
         console.print(
-            "[bold yellow]All audio prompt files already exist, skipping audio prompt generation step...[/bold yellow]"
+            "[bold yellow]All audio prompt files are up to date, skipping audio prompt generation step...[/bold yellow]"
         )
         return
 
-    def generate_prompt_for_chapter(item):
+    async def generate_prompt_for_chapter(item):
         i, chapter, status = item
-        script_path = f"./temp/scripts/chapter{i + 1}.rpy"
-        music_file_path = f"./temp/prompts/audio/chapter{i + 1}_music_prompt.json"
-        sfx_file_path = f"./temp/prompts/audio/chapter{i + 1}_sfx_prompt.json"
+        script_path = workspace.chapter_script(i)
+        music_file_path = workspace.audio_prompt_file(i, "music")
+        sfx_file_path = workspace.audio_prompt_file(i, "sfx")
 
         with open(script_path, "r", encoding="utf-8") as f:
             script_content = f.read()
 
-        result = []
-
-        # For thread safety, create a new console in this function
-        local_console = Console()
+        llm = general_model.llm
 
+        # Music and sound effect prompts are independent, request them together
+        requests = {}
         if status in ["both", "music"]:
-            local_console.print(
-                f"[bold blue]Generating music prompt for chapter {i + 1}...[/bold blue]"
-            )
-
-            # Use non-streaming API directly
-            music_prompt_response = general_model.run(
-                f"{GENERATE_MUSIC_PROMPT}\n\nRen'Py script: {script_content}"
+            requests["music"] = (
+                music_file_path,
+                llm.ainvoke(
+                    layered_messages(
+                        GENERATE_MUSIC_PROMPT,
+                        request=f"Ren'Py script: {script_content}",
+                    ),
+                    response_format=response_format(
+                        llm, "music_prompts", MUSIC_PROMPTS_SCHEMA
+                    ),
+                ),
             )
-            music_prompt = json.loads(
-                remove_json_markers(music_prompt_response.content)
-            )
-            with open(music_file_path, "w", encoding="utf-8") as f:
-                json.dump(music_prompt, f, indent=4, ensure_ascii=False)
-            result.append(f"music for chapter {i + 1}")
-
         if status in ["both", "sfx"]:
-            local_console.print(
-                f"[bold blue]Generating sound effect prompt for chapter {i + 1}...[/bold blue]"
+            requests["sfx"] = (
+                sfx_file_path,
+                llm.ainvoke(
+                    layered_messages(
+                        GENERATE_SFX_PROMPT,
+                        request=f"Ren'Py script: {script_content}",
+                    ),
+                    response_format=response_format(
+                        llm, "sfx_prompts", SFX_PROMPTS_SCHEMA
+                    ),
+                ),
             )
 
-            # Use non-streaming API directly
-            sfx_prompt_response = general_model.run(
-                f"{GENERATE_SFX_PROMPT}\n\nRen'Py script: {script_content}"
+        async def save(kind, file_path, request):
+            # Each kind is written as soon as it arrives, so a failing kind
+            # does not lose the other
+            response = await request
+            prompt = await aparse_json(
+                llm, response.content, f"{kind}_prompts", schemas[kind]
             )
-            sfx_prompt = json.loads(remove_json_markers(sfx_prompt_response.content))
-            with open(sfx_file_path, "w", encoding="utf-8") as f:
-                json.dump(sfx_prompt, f, indent=4, ensure_ascii=False)
-            result.append(f"sfx for chapter {i + 1}")
-
+            with open(file_path, "w", encoding="utf-8") as f:
+                json.dump(prompt, f, indent=4, ensure_ascii=False)
+            workspace.manifest.record(file_path, prompt_inputs(i, kind))
+            return f"{kind} for chapter {i + 1}"
+
+        result = await asyncio.gather(
+            *(
+                save(kind, file_path, request)
+                for kind, (file_path, request) in requests.items()
+            ),
+            return_exceptions=True,
+        )
+        for saved in result:
+            if isinstance(saved, Exception):
+                raise saved
         return result
 
-    # Sequentially process prompt generation for each chapter
+    async def generate_all(progress, task):
+        # Every chapter is requested at once, models.limits keeps the
+        # provider within its concurrency and rate limits
+        async def run(item):
+            # Each run() is its own task, so the tag stays with this chapter
+            with tagged(chapter=item[1]["name"]):
+                try:
+                    return item, await generate_prompt_for_chapter(item), None
+                except Exception as e:
+                    return item, None, e
+
+        for finished in asyncio.as_completed(
+            [run(item) for item in prompts_to_generate]
+        ):
+            (i, chapter, status), results, error = await finished
+            if error is None:
+                progress.console.print(
+                    f"[bold green]✓[/bold green] Finished generating audio prompts for chapter {i + 1}: [cyan]{', '.join(results)}[/cyan]"
+                )
+                progress.update(task, advance=1)
+            else:
+                progress.console.print(
+                    f"[bold red]✗[/bold red] Error generating audio prompts for chapter {i + 1}: {str(error)}"
+                )
+
     with Progress(
         SpinnerColumn(),
         TextColumn("[bold blue]{task.description}[/bold blue]"),
         BarColumn(),
         TextColumn("[bold]{task.completed}/{task.total}[/bold]"),
         TimeElapsedColumn(),
+        disable=not show_progress,
     ) as progress:
         task = progress.add_task(
             "Generating audio prompts", total=len(prompts_to_generate)
         )
-
-        for item in prompts_to_generate:
-            i, chapter, status = item
-            try:
-                results = generate_prompt_for_chapter(item)
-                progress.console.print(
-                    f"[bold green]✓[/bold green] Finished generating audio prompts for chapter {i + 1}: [cyan]{', '.join(results)}[/cyan]"
-                )
-                progress.update(task, advance=1)
-            except Exception as e:
-                progress.console.print(
-                    f"[bold red]✗[/bold red] Error generating audio prompts for chapter {i + 1}: {str(e)}"
-                )
+        asyncio.run(generate_all(progress, task))
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rich.console import Console
+from rich.table import Table
+from models.telemetry import get_telemetry, tagged
+from workspace import Workspace
+
+from .stage import SharedClients, generate_game, print_run_stats
+from .theme_manager import get_game_theme
+
+# Create console instance
+console = Console()
+
+
+def load_theme_queue(path):
+    """Games listed in a JSONL queue, one object per line
+
+    Each line holds "theme" and optionally "output", the workspace of the
+    game (./games/game<line> by default), and "export", its Ren'Py project
+    directory (<output>/project by default).
+    """
+    games = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if not entry.get("theme"):
+                raise ValueError(f"{path}:{line_number} has no theme")
+            output = entry.get("output") or f"./games/game{line_number}"
+            games.append(
+                {
+                    "theme": entry["theme"],
+                    "output": output,
+                    "export": entry.get("export") or os.path.join(output, "project"),
+                }
+            )
+
+    outputs = [os.path.normpath(game["output"]) for game in games]
+    duplicates = sorted({output for output in outputs if outputs.count(output) > 1})
+    if duplicates:
+        raise ValueError(f"Games share output directories: {', '.join(duplicates)}")
+    return games
+
+
+def _count_files(directory, prefix=""):
+    if not os.path.isdir(directory):
+        return 0
+    return sum(
+        name.startswith(prefix) and os.path.isfile(os.path.join(directory, name))
+        for name in os.listdir(directory)
+    )
+
+
+def _inside(path, directory):
+    path, directory = os.path.abspath(path), os.path.abspath(directory)
+    return os.path.commonpath([path, directory]) == directory
+
+
+def _run_game(clients: SharedClients, game, cleanup=False):
+    """Generate one game of the queue; failures are returned, not raised
+
+    With cleanup, the workspace of a game exported successfully is removed.
+    """
+    output = game["output"]
+    workspace = Workspace(output)
+    result = {"game": output, "theme": game["theme"], "status": "done", "error": None}
+    start_time = time.monotonic()
+    with tagged(game=output):
+        try:
+            with workspace:
+                theme = get_game_theme(workspace, game["theme"])
+                generate_game(
+                    clients, workspace, theme, game["export"], show_progress=False
+                )
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+    result["seconds"] = time.monotonic() - start_time
+    result["chapters"] = _count_files(workspace.scripts_dir, prefix="chapter")
+    result["images"] = _count_files(workspace.images_dir)
+    result["audio"] = _count_files(workspace.audio_dir)
+    if cleanup and result["status"] == "done":
+        workspace.remove()
+    return result
+
+
+def print_batch_results(results, elapsed_seconds):
+    """Show the time, assets and LLM usage of every game of the batch"""
+    table = Table(title="Batch Results")
+    table.add_column("Game", style="cyan")
+    table.add_column("Status", style="yellow")
+    table.add_column("Time (s)", style="green")
+    table.add_column("Chapters", style="magenta")
+    table.add_column("Images", style="magenta")
+    table.add_column("Audio", style="magenta")
+    table.add_column("Assets/min", style="green")
+    table.add_column("LLM calls", style="yellow")
+    table.add_column("Tokens", style="yellow")
+    table.add_column("Cost ($)", style="green")
+    for result in results:
+        assets = result["images"] + result["audio"]
+        table.add_row(
+            result["game"],
+            result["status"],
+            f"{result['seconds']:.1f}",
+            str(result["chapters"]),
+            str(result["images"]),
+            str(result["audio"]),
+            f"{assets / result['seconds'] * 60:.1f}" if result["seconds"] else "-",
+            str(result["llm_calls"]),
+            str(result["prompt_tokens"] + result["completion_tokens"]),
+            f"{result['cost']:.4f}" if result["cost"] is not None else "-",
+        )
+    console.print(table)
+    done = sum(result["status"] == "done" for result in results)
+    console.print(
+        f"[bold yellow]{done}/{len(results)} games generated in {elapsed_seconds:.1f} seconds "
+        f"({done / elapsed_seconds * 3600:.1f} games/hour)[/bold yellow]"
+    )
+
+
+def run_batch(queue_path, games, log_dir, cleanup=False):
+    """Generate every game of a theme queue without asking anything
+
+    Up to `games` games are generated at once. They share the model
+    clients, so provider limits and the LLM cache apply to the whole batch,
+    and the ComfyUI pool, whose queue takes their jobs in turn. With
+    cleanup, only the exported Ren'Py projects of finished games are kept.
+
+    Returns:
+        list[dict]: per-game results, also written to <log_dir>/batch_report.json
+    """
+    queue = load_theme_queue(queue_path)
+    if cleanup:
+        kept_inside = [
+            game["output"] for game in queue if _inside(game["export"], game["output"])
+        ]
+        if kept_inside:
+            raise ValueError(
+                f"Games export into the workspace removed by cleanup: {', '.join(kept_inside)}"
+            )
+    console.print(
+        f"[bold blue]{len(queue)} games queued, generating {games} at once[/bold blue]"
+    )
+    clients = SharedClients(log_dir)
+
+    start_time = time.monotonic()
+    results = []
+    with ThreadPoolExecutor(max_workers=games, thread_name_prefix="game") as executor:
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run, _run_game, clients, game, cleanup
+            )
+            for game in queue
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["status"] == "done":
+                console.print(
+                    f"[bold green]✓[/bold green] Generated [cyan]{result['game']}[/cyan] in {result['seconds']:.1f} seconds"
+                )
+            else:
+                console.print(
+                    f"[bold red]✗[/bold red] Failed to generate [cyan]{result['game']}[/cyan]: {result['error']}"
+                )
+    elapsed_seconds = time.monotonic() - start_time
+
+    # Queue order, with each game's share of the LLM usage
+    order = [game["output"] for game in queue]
+    results.sort(key=lambda result: order.index(result["game"]))
+    usage = get_telemetry().game_summary()
+    for result in results:
+        total = usage.get(result["game"], {})
+        result["llm_calls"] = total.get("calls", 0)
+        result["prompt_tokens"] = total.get("prompt_tokens", 0)
+        result["completion_tokens"] = total.get("completion_tokens", 0)
+        result["cost"] = total.get("cost")
+
+    print_batch_results(results, elapsed_seconds)
+    print_run_stats(clients, f"{log_dir}/llm_usage.json")
+    os.makedirs(log_dir, exist_ok=True)
+    report_path = f"{log_dir}/batch_report.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"elapsed_seconds": elapsed_seconds, "games": results},
+            f,
+            indent=2,
+            ensure_ascii=False,
+        )
+    console.print(f"[dim]Per-game statistics: {report_path}[/dim]")
+    return results
@@ -9,50 +9,109 @@ from rich.progress import (
     TimeElapsedColumn,
 )
 from models.reasoning import ReasoningModel
-from config import LANGUAGE_MODE
+from models.telemetry import tagged
+from models.general import GeneralModel
+from config import LANGUAGE_MODE, CONTINUITY_TOKEN_BUDGET
+from continuity import ContinuityMemory
+from util import stream_to_file
+from prompt_layout import layered_messages
+from manifest import input_hash, model_inputs
+from workspace import Workspace
 
 if LANGUAGE_MODE == "zh":
-    from prompt_zh import GENERATE_CHAPTER_PROMPT
+    from prompt_zh import (
+        GENERATE_CHAPTER_PROMPT,
+        GENERATE_CHAPTER_REQUEST_PROMPT,
+        SUMMARIZE_CHAPTER_PROMPT,
+    )
 else:
-    from prompt_en import GENERATE_CHAPTER_PROMPT
+    from prompt_en import (
+        GENERATE_CHAPTER_PROMPT,
+        GENERATE_CHAPTER_REQUEST_PROMPT,
+        SUMMARIZE_CHAPTER_PROMPT,
+    )
 
 # Create console instance
 console = Console()
 
 
-def generate_chapters(structured_draft, reasoning_model: ReasoningModel):
-    """Generate content for each chapter based on the structured draft and save to corresponding files"""
-    os.makedirs("./temp/chapters", exist_ok=True)
+def generate_chapters(
+    workspace: Workspace,
+    structured_draft,
+    reasoning_model: ReasoningModel,
+    general_model: GeneralModel,
+    chapter_indices=None,
+    show_progress=True,
+):
+    """Generate content for each chapter based on the structured draft and save to corresponding files
+
+    Earlier chapters are passed on through a ContinuityMemory (summaries by
+    the general model plus retrieved passages) instead of their full text.
+
+    Args:
+        chapter_indices (list[int]): only these chapters (0-based), all when None
+        show_progress (bool): False while another live display is active
+    """
+    os.makedirs(workspace.chapters_dir, exist_ok=True)
+    chapters = structured_draft["chapters"]
 
-    # Check if all chapter files already exist
-    all_chapters_exist = True
+    # Earlier chapters are only context, editing one does not rewrite the rest
+    inputs = input_hash(
+        GENERATE_CHAPTER_PROMPT,
+        GENERATE_CHAPTER_REQUEST_PROMPT,
+        SUMMARIZE_CHAPTER_PROMPT,
+        CONTINUITY_TOKEN_BUDGET,
+        structured_draft,
+        model_inputs(reasoning_model),
+        model_inputs(general_model),
+    )
+
+    # Check which chapter files are missing or out of date
+    all_chapters_fresh = True
     chapters_to_generate = []
 
-    chapters = structured_draft["chapters"]
     for i, chapter in enumerate(chapters):
-        chapter_file = f"./temp/chapters/{chapter['name']}.txt"
-        if not os.path.exists(chapter_file):
-            all_chapters_exist = False
+        if chapter_indices is not None and i not in chapter_indices:
+            continue
+        chapter_file = workspace.chapter_file(chapter["name"])
+        if not workspace.manifest.is_fresh(chapter_file, inputs):
+            all_chapters_fresh = False
             chapters_to_generate.append((i, chapter))
         else:
             console.print(
-                f"[yellow]Chapter [bold]{chapter['name']}[/bold] file already exists, skipping generation...[/yellow]"
+                f"[yellow]Chapter [bold]{chapter['name']}[/bold] is up to date, skipping generation...[/yellow]"
             )
 
-    if all_chapters_exist:
+    if all_chapters_fresh:
         console.print(
-            "[bold yellow]All chapter files already exist, skipping chapter generation step...[/bold yellow]"
+            "[bold yellow]All chapters are up to date, skipping chapter generation step...[/bold yellow]"
         )
         return
 
     structured_draft_content = json.dumps(structured_draft, ensure_ascii=False)
 
+    def summarize(chapter_name, chapter_content):
+        with tagged(chapter=chapter_name):
+            return general_model.run(
+                SUMMARIZE_CHAPTER_PROMPT.format(
+                    chapter_name=chapter_name, chapter_content=chapter_content
+                )
+            ).content
+
+    memory = ContinuityMemory(
+        CONTINUITY_TOKEN_BUDGET,
+        summarizer=summarize,
+        summary_file=workspace.chapter_summaries_file,
+    )
+    remembered = 0
+
     with Progress(
         SpinnerColumn(),
         TextColumn("[bold blue]{task.description}[/bold blue]"),
         BarColumn(),
         TextColumn("[bold]{task.completed}/{task.total}[/bold]"),
         TimeElapsedColumn(),
+        disable=not show_progress,
     ) as progress:
         task = progress.add_task(
             "Generating chapter content", total=len(chapters_to_generate)
@@ -60,42 +119,49 @@ def generate_chapters(structured_draft, reasoning_model: ReasoningModel):
 
         for i, chapter in chapters_to_generate:
             chapter_name = chapter["name"]
-            chapter_file = f"./temp/chapters/{chapter_name}.txt"
+            chapter_file = workspace.chapter_file(chapter_name)
 
             progress.update(task, description=f"Generating chapter: {chapter_name}")
 
-            # Get content of previous chapters
-            previous_chapter_content = ""
-            if i > 0:
-                previous_chapters = []
-                for j in range(i):
-                    prev_chapter_file = f"./temp/chapters/{chapters[j]['name']}.txt"
+            try:
+                # Bounded context of previous chapters
+                for j in range(remembered, i):
+                    prev_chapter_file = workspace.chapter_file(chapters[j]["name"])
                     if os.path.exists(prev_chapter_file):
                         with open(prev_chapter_file, "r", encoding="utf-8") as f:
-                            previous_chapters.append(
-                                f"[{chapters[j]['name']}]:\n{f.read()}\n\n"
-                            )
-                previous_chapter_content = "".join(previous_chapters)
-            else:
-                previous_chapter_content = None
-
-            try:
-                generate_chapter_prompt = GENERATE_CHAPTER_PROMPT.format(
-                    chapter_name=chapter_name, draft_content=structured_draft_content
+                            memory.add(chapters[j]["name"], f.read())
+                remembered = max(remembered, i)
+                previous_chapter_content = memory.context(
+                    f"{chapter_name}\n{chapter.get('content', '')}"
                 )
 
+                # The instructions and outline are the same for every chapter
+                # and go first, so the provider can reuse its prefix cache
+                request = GENERATE_CHAPTER_REQUEST_PROMPT.format(
+                    chapter_name=chapter_name
+                )
                 if previous_chapter_content:
-                    generate_chapter_prompt += f"\n\nReference content from previous chapters:\n{previous_chapter_content}"
-
-                # Use non-streaming request
-                with console.status(
-                    f"[bold green]Generating chapter: {chapter_name}[/bold green]",
-                    spinner="dots",
-                ):
-                    full_content = reasoning_model.run(generate_chapter_prompt)
+                    request += f"\n\nReference content from previous chapters:\n{previous_chapter_content}"
+                generate_chapter_prompt = layered_messages(
+                    GENERATE_CHAPTER_PROMPT.format(
+                        draft_content=structured_draft_content
+                    ),
+                    request=request,
+                )
 
-                with open(chapter_file, "w", encoding="utf-8") as f:
-                    f.write(full_content)
+                # Stream to disk so that a dropped connection resumes
+                # from the partial chapter instead of starting over
+                with tagged(chapter=chapter_name):
+                    stream_to_file(
+                        reasoning_model,
+                        generate_chapter_prompt,
+                        chapter_file,
+                        on_progress=lambda chunks, speed: progress.update(
+                            task,
+                            description=f"Generating chapter: {chapter_name} ({speed:.1f} tok/s)",
+                        ),
+                    )
+                workspace.manifest.record(chapter_file, inputs)
                 progress.console.print(
                     f"[bold green]✓[/bold green] Finished generating chapter [cyan]{chapter_name}[/cyan]"
                 )
@@ -1,11 +1,14 @@
-import os
 import json
 from rich.console import Console
 from rich.table import Table
 from models.reasoning import ReasoningModel
 from models.general import GeneralModel
 from config import LANGUAGE_MODE
-from util import parse_draft
+from util import parse_draft, stream_to_file
+from structured_output import DRAFT_SCHEMA
+from manifest import file_hash, input_hash, model_inputs
+from workspace import Workspace
+from prompt_zh import PARSE_DRAFT_PROMPT
 
 if LANGUAGE_MODE == "zh":
     from prompt_zh import DRAFT_PROMPT
@@ -16,41 +19,56 @@ else:
 console = Console()
 
 
-def generate_draft(game_theme, reasoning_model: ReasoningModel):
+def generate_draft(workspace: Workspace, game_theme, reasoning_model: ReasoningModel):
     """Generate draft and save to file"""
-    draft_file = "./temp/draft.txt"
+    draft_file = workspace.draft_file
+    inputs = input_hash(DRAFT_PROMPT, game_theme, model_inputs(reasoning_model))
 
-    if os.path.exists(draft_file):
+    if workspace.manifest.is_fresh(draft_file, inputs):
         console.print(
-            "[bold yellow]Draft file already exists, skipping draft generation step...[/bold yellow]"
+            "[bold yellow]Draft is up to date, skipping draft generation step...[/bold yellow]"
         )
         with open(draft_file, "r", encoding="utf-8") as f:
             return f.read()
 
     draft_prompt = DRAFT_PROMPT.format(game_theme=game_theme)
 
-    # Use non-streaming request
-    with console.status("[bold green]Generating draft...[/bold green]", spinner="dots"):
-        full_content = reasoning_model.run(draft_prompt)
+    # Stream to disk so that a dropped connection does not lose the draft
+    with console.status(
+        "[bold green]Generating draft...[/bold green]", spinner="dots"
+    ) as status:
+        full_content = stream_to_file(
+            reasoning_model,
+            draft_prompt,
+            draft_file,
+            on_progress=lambda chunks, speed: status.update(
+                f"[bold green]Generating draft... {chunks} tokens, {speed:.1f} tok/s[/bold green]"
+            ),
+        )
+    workspace.manifest.record(draft_file, inputs)
 
     console.print("[bold green]✓[/bold green] Draft generation completed")
-    with open(draft_file, "w", encoding="utf-8") as f:
-        f.write(full_content)
     return full_content
 
 
-def parse_and_save_draft(general_model: GeneralModel):
+def parse_and_save_draft(workspace: Workspace, general_model: GeneralModel):
     """Parse draft and save structured data"""
-    structured_draft_file = "./temp/structured_draft.json"
+    structured_draft_file = workspace.structured_draft_file
+    inputs = input_hash(
+        PARSE_DRAFT_PROMPT,
+        DRAFT_SCHEMA,
+        file_hash(workspace.draft_file),
+        model_inputs(general_model),
+    )
 
-    if os.path.exists(structured_draft_file):
+    if workspace.manifest.is_fresh(structured_draft_file, inputs):
         console.print(
-            "[bold yellow]Structured draft file already exists, skipping draft parsing step...[/bold yellow]"
+            "[bold yellow]Structured draft is up to date, skipping draft parsing step...[/bold yellow]"
         )
         with open(structured_draft_file, "r", encoding="utf-8") as f:
             return json.load(f)
 
-    with open("./temp/draft.txt", "r", encoding="utf-8") as f:
+    with open(workspace.draft_file, "r", encoding="utf-8") as f:
         draft = f.read()
 
     draft_response = parse_draft(general_model, draft)
@@ -77,6 +95,7 @@ def parse_and_save_draft(general_model: GeneralModel):
 
     with open(structured_draft_file, "w", encoding="utf-8") as f:
         json.dump(draft_response, f, indent=4, ensure_ascii=False)
+    workspace.manifest.record(structured_draft_file, inputs)
 
     console.print("[bold green]✓[/bold green] Draft structuring completed and saved")
     return draft_response
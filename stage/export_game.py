@@ -3,18 +3,23 @@ import shutil
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt
+from workspace import Workspace
 
 # Create console instance
 console = Console()
 
 
-def export_game_assets():
-    """Copy generated game assets to the specified game project directory"""
+def export_game_assets(workspace: Workspace, target_dir=None):
+    """Copy generated game assets to the specified game project directory
+
+    The directory is asked for unless target_dir is given.
+    """
     # Ask user to specify the target game directory
-    target_dir = Prompt.ask(
-        "[bold blue]Please enter the root directory of the target game project[/bold blue]",
-        default="./CVV25",
-    )
+    if target_dir is None:
+        target_dir = Prompt.ask(
+            "[bold blue]Please enter the root directory of the target game project[/bold blue]",
+            default="./CVV25",
+        )
 
     # Ensure the target directory exists
     os.makedirs(target_dir, exist_ok=True)
@@ -27,7 +32,7 @@ def export_game_assets():
         "[bold green]Exporting game assets...[/bold green]", spinner="dots"
     ):
         # Copy script files
-        scripts_dir = "./temp/scripts"
+        scripts_dir = workspace.scripts_dir
         if os.path.exists(scripts_dir):
             console.print("[yellow]Copying script files...[/yellow]")
 
@@ -65,7 +70,7 @@ def export_game_assets():
 
         # Handle image files
         target_images_dir = os.path.join(game_dir, "images")
-        source_images_dir = "./temp/images"
+        source_images_dir = workspace.images_dir
 
         # If the target image directory exists, delete it first
         if os.path.exists(target_images_dir):
@@ -92,7 +97,7 @@ def export_game_assets():
 
         # Handle audio files
         target_audio_dir = os.path.join(game_dir, "audio")
-        source_audio_dir = "./temp/audio"
+        source_audio_dir = workspace.audio_dir
 
         # If the target audio directory exists, delete it first
         if os.path.exists(target_audio_dir):
@@ -126,5 +131,5 @@ def export_game_assets():
     )
 
     # Save export directory to a temporary file for subsequent steps
-    with open("./temp/export_dir.txt", "w") as f:
+    with open(workspace.export_dir_file, "w") as f:
         f.write(target_dir)
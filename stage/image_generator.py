@@ -1,6 +1,8 @@
 import os
 import uuid
 import json
+import time
+import threading
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
@@ -12,8 +14,11 @@ from rich.progress import (
     TimeElapsedColumn,
 )
 from models.vl import VLModel
-from comfy import ComfyUI
-from util import evaluate_image
+from models.telemetry import tagged
+from comfy import WorkflowClient, templates
+from util import evaluate_image, select_best_image
+from manifest import file_hash, input_hash
+from workspace import Workspace
 
 # Create console instance
 console = Console()
@@ -21,21 +26,51 @@ console = Console()
 # Global variable to control whether to perform VL model evaluation and correction
 ENABLE_VL_EVALUATION = False
 
+# Number of candidates rendered in one KSampler batch per attempt; when greater
+# than 1 the VL model picks the best one before any evaluation
+BEST_OF_N = 1
+
+
+def track_sampling(progress: Progress, description: str):
+    """Return an on_progress callback showing the sampler steps of one job
+
+    The task is added on the first step and removed after the last one, so
+    only jobs that are actually sampling are displayed.
+    """
+    state = {}
+
+    def on_progress(step, total_steps):
+        now = time.monotonic()
+        if "task" not in state or step < state["step"]:
+            # First step, or the job was queued again on another server
+            if "task" in state:
+                progress.remove_task(state["task"])
+            state["start"] = (now, step)
+            state["task"] = progress.add_task(description, total=total_steps, its="")
+        state["step"] = step
+        start_time, start_step = state["start"]
+        its = (step - start_step) / (now - start_time) if now > start_time else 0.0
+        progress.update(
+            state["task"], completed=step, total=total_steps, its=f"{its:.2f} it/s"
+        )
+        if step >= total_steps:
+            progress.remove_task(state.pop("task"))
 
-def generate_images(structured_draft, vl_model: VLModel, comfyui: ComfyUI):
-    """Generate images based on prompts and evaluate quality with VL model, regenerate if necessary"""
-    os.makedirs("./temp/candidates", exist_ok=True)
-    os.makedirs("./temp/images", exist_ok=True)
-    os.makedirs(
-        "./temp/refine", exist_ok=True
-    )  # Create directory for saving iterative images
-    SPRITE_TEMPLATE = "./image/sprite.json"
-    BACKGROUND_TEMPLATE = "./image/background.json"
-    # CG uses the same template as background
-    CG_TEMPLATE = "./image/background.json"
-    chapters = structured_draft["chapters"]
+    return on_progress
 
-    # Clear candidate directory
+
+def _source_label(i):
+    """Chapter i (0-based) for display, or the draft for early images"""
+    return "Draft" if i is None else f"Chapter {i + 1}"
+
+
+# Guards the image names claimed by generate_images() calls running concurrently
+_claim_lock = threading.Lock()
+
+
+def clean_candidates(workspace: Workspace):
+    """Remove the candidate images left behind by an earlier run"""
+    os.makedirs(workspace.candidates_dir, exist_ok=True)
     console.print(
         Panel(
             "[bold yellow]Cleaning candidate image directory...[/bold yellow]",
@@ -45,13 +80,97 @@ def generate_images(structured_draft, vl_model: VLModel, comfyui: ComfyUI):
     with console.status(
         "[bold green]Cleaning candidate image directory...[/bold green]", spinner="dots"
     ):
-        for filename in os.listdir("./temp/candidates"):
-            os.remove(os.path.join("./temp/candidates", filename))
+        for filename in os.listdir(workspace.candidates_dir):
+            os.remove(os.path.join(workspace.candidates_dir, filename))
+
+
+def generate_images(
+    workspace: Workspace,
+    structured_draft,
+    vl_model: VLModel,
+    comfyui: WorkflowClient,
+    chapter_indices=None,
+    show_progress=True,
+    claimed=None,
+    early=False,
+):
+    """Generate images based on prompts and evaluate quality with VL model, regenerate if necessary
+
+    Args:
+        chapter_indices (list[int]): only these chapters (0-based), all when None;
+            the candidate directory is then left for the caller to clean
+        show_progress (bool): False while another live display is active
+        claimed (dict): image name -> where it was claimed, shared by calls
+            for different chapters so that an image is only generated once
+        early (bool): render the sprites and backgrounds of
+            generate_early_image_prompts() instead of any chapter's images
+    """
+    os.makedirs(workspace.candidates_dir, exist_ok=True)
+    os.makedirs(workspace.images_dir, exist_ok=True)
+    os.makedirs(
+        workspace.refine_dir, exist_ok=True
+    )  # Create directory for saving iterative images
+    SPRITE_TEMPLATE = "./image/sprite.json"
+    BACKGROUND_TEMPLATE = "./image/background.json"
+    # CG uses the same template as background
+    CG_TEMPLATE = "./image/background.json"
+    # Parse and check the workflows before any job is queued
+    for template in (SPRITE_TEMPLATE, BACKGROUND_TEMPLATE, CG_TEMPLATE):
+        templates.get(template, "image")
+    chapters = structured_draft["chapters"]
+
+    # Clear candidate directory
+    if chapter_indices is None and not early:
+        clean_candidates(workspace)
+
+    # (chapter index, prompt type, prompt file), chapter None for early images
+    all_prompt_files = [
+        (None, prompt_type, workspace.early_prompt_file(prompt_type))
+        for prompt_type in ["sprite", "background"]
+    ] + [
+        (i, prompt_type, workspace.image_prompt_file(i, prompt_type))
+        for i in range(len(chapters))
+        for prompt_type in ["background", "sprite", "cg"]
+    ]
+    if early:
+        prompt_files = [item for item in all_prompt_files if item[0] is None]
+    else:
+        prompt_files = [
+            item
+            for item in all_prompt_files
+            if item[0] is not None
+            and (chapter_indices is None or item[0] in chapter_indices)
+        ]
+
+    templates_by_type = {
+        "sprite": SPRITE_TEMPLATE,
+        "background": BACKGROUND_TEMPLATE,
+        "cg": CG_TEMPLATE,
+    }
+    template_hashes = {
+        prompt_type: file_hash(template)
+        for prompt_type, template in templates_by_type.items()
+    }
+
+    def image_inputs(prompt_type, prompt_obj):
+        """An image depends on its prompt and the workflow it is rendered with"""
+        return input_hash(prompt_obj["prompt"], template_hashes[prompt_type])
+
+    # Several prompt files may name the same image; it is up to date while
+    # it was rendered from any of them, so renders do not alternate
+    named_inputs = {}
+    for _, prompt_type, prompt_file in all_prompt_files:
+        if os.path.exists(prompt_file):
+            with open(prompt_file, "r", encoding="utf-8") as pf:
+                for prompt_obj in json.load(pf):
+                    named_inputs.setdefault(prompt_obj["image_name"], []).append(
+                        image_inputs(prompt_type, prompt_obj)
+                    )
 
     # Collect image generation tasks
     image_tasks = []
     # Use a dict to track added image names to avoid duplicates
-    added_images = {}
+    added_images = {} if claimed is None else claimed
 
     console.print(
         Panel(
@@ -66,66 +185,61 @@ def generate_images(structured_draft, vl_model: VLModel, comfyui: ComfyUI):
     table.add_column("Image Name", style="green")
     table.add_column("Status", style="yellow")
 
-    for i, chapter in enumerate(chapters):
-        for prompt_type in ["background", "sprite", "cg"]:
-            prompt_file = (
-                f"./temp/prompts/image/chapter{i + 1}_{prompt_type}_prompt.json"
-            )
-            if not os.path.exists(prompt_file):
+    for i, prompt_type, prompt_file in prompt_files:
+        where = _source_label(i)
+        if not os.path.exists(prompt_file):
+            table.add_row(where, prompt_type, "No prompt file", "⚠️ Skipped")
+            continue
+
+        with open(prompt_file, "r", encoding="utf-8") as pf:
+            prompts = json.load(pf)
+
+        for prompt_obj in prompts:
+            final_path = workspace.image_file(prompt_obj["image_name"])
+            # Check if image is up to date
+            candidates = [
+                image_inputs(prompt_type, prompt_obj),
+                *named_inputs.get(prompt_obj["image_name"], []),
+            ]
+            if any(
+                workspace.manifest.is_fresh(final_path, inputs) for inputs in candidates
+            ):
                 table.add_row(
-                    f"Chapter {i + 1}", prompt_type, "No prompt file", "⚠️ Skipped"
+                    where,
+                    prompt_type,
+                    prompt_obj["image_name"],
+                    "✓ Up to date",
                 )
                 continue
 
-            with open(prompt_file, "r", encoding="utf-8") as pf:
-                prompts = json.load(pf)
-
-            for prompt_obj in prompts:
-                target_name = prompt_obj["image_name"] + ".webp"
-                final_path = f"./temp/images/{target_name}"
-                # Check if image already exists
-                if os.path.exists(final_path):
-                    table.add_row(
-                        f"Chapter {i + 1}",
-                        prompt_type,
-                        prompt_obj["image_name"],
-                        "✓ Exists",
-                    )
-                    continue
-
-                # Check for duplicate image tasks
-                if prompt_obj["image_name"] in added_images:
-                    table.add_row(
-                        f"Chapter {i + 1}",
-                        prompt_type,
-                        prompt_obj["image_name"],
-                        "⚠️ Duplicate (already in chapter "
-                        + str(added_images[prompt_obj["image_name"]] + 1)
-                        + ")",
-                    )
-                    continue
-
-                # Add to image tasks to be generated
-                template = SPRITE_TEMPLATE
-                if prompt_type == "background":
-                    template = BACKGROUND_TEMPLATE
-                elif prompt_type == "cg":
-                    template = CG_TEMPLATE
-
-                image_tasks.append((i, prompt_type, prompt_obj, template))
-                # Record added image name and its chapter
-                added_images[prompt_obj["image_name"]] = i
+            # Check for duplicate image tasks, and claim the name otherwise
+            with _claim_lock:
+                owner = added_images.get(prompt_obj["image_name"])
+                if owner is None:
+                    added_images[prompt_obj["image_name"]] = where
+            if owner is not None:
                 table.add_row(
-                    f"Chapter {i + 1}",
+                    where,
                     prompt_type,
                     prompt_obj["image_name"],
-                    "⏳ To be generated",
+                    f"⚠️ Duplicate (already in {owner})",
                 )
-            # After the loop, count the total number of images to generate
-            total_images_to_generate = len(image_tasks)
-            console.print(
-                f"[bold blue]Total images to generate: {total_images_to_generate}[/bold blue]"
+                continue
+
+            # Add to image tasks to be generated
+            template = templates_by_type[prompt_type]
+            image_tasks.append((i, prompt_type, prompt_obj, template))
+            table.add_row(
+                where,
+                prompt_type,
+                prompt_obj["image_name"],
+                "⏳ To be generated",
             )
+        # After the loop, count the total number of images to generate
+        total_images_to_generate = len(image_tasks)
+        console.print(
+            f"[bold blue]Total images to generate: {total_images_to_generate}[/bold blue]"
+        )
 
     console.print(table)
 
@@ -135,37 +249,85 @@ def generate_images(structured_draft, vl_model: VLModel, comfyui: ComfyUI):
         )
         return
 
-    def generate_image(task_item, current_prompt=None, attempt=1, max_attempts=3):
-        """Generate a single image and evaluate quality, regenerate if necessary"""
+    def submit_image(task_item, current_prompt=None):
+        """Queue the image job on ComfyUI without waiting for the result"""
+        _, _, prompt_obj, template = task_item
+        return comfyui.submit_image(
+            prompt_file=template,
+            positive_prompt=current_prompt if current_prompt else prompt_obj["prompt"],
+            batch_size=BEST_OF_N,  # All candidates share one sampler pass
+            on_progress=track_sampling(
+                progress, f"  Sampling {prompt_obj['image_name']}"
+            ),
+        )
+
+    def generate_image(
+        task_item, current_prompt=None, attempt=1, max_attempts=3, pending=None
+    ):
+        """Generate a single image and evaluate quality, regenerate if necessary
+
+        `pending` is a future returned by submit_image() for this attempt, so the
+        job may already be queued (or finished) on the server.
+
+        With BEST_OF_N > 1 each attempt renders a batch of candidates and the VL
+        model selects the best one. Only that winner is evaluated: if the best
+        candidate is rejected, the whole batch is considered rejected and the
+        next attempt uses the optimized prompt.
+        """
         i, prompt_type, prompt_obj, template = task_item
-        target_name = prompt_obj["image_name"] + ".webp"
-        final_path = f"./temp/images/{target_name}"
+        final_path = workspace.image_file(prompt_obj["image_name"])
 
         # Record each iteration version of the image
         refine_name = f"{prompt_obj['image_name']}_{attempt}.webp"
-        refine_path = f"./temp/refine/{refine_name}"
+        refine_path = os.path.join(workspace.refine_dir, refine_name)
 
         # Evaluation info text file
         eval_file_name = f"{prompt_obj['image_name']}_{attempt}.txt"
-        eval_file_path = f"./temp/refine/{eval_file_name}"
+        eval_file_path = os.path.join(workspace.refine_dir, eval_file_name)
 
         # Use the provided prompt or the original prompt
         prompt_to_use = current_prompt if current_prompt else prompt_obj["prompt"]
 
-        # Generate a single image
-        image = comfyui.generate_image(
-            prompt_file=template,
-            positive_prompt=prompt_to_use,
-            batch_size=1,  # Only generate one image
-        )[0]  # Get the first (and only) generated image
-
-        # Save as a temporary file for evaluation
-        temp_filename = f"./temp/candidates/{uuid.uuid4().hex}.webp"
-        image.save(temp_filename)
+        # Generate the candidate image(s)
+        if pending is None:
+            pending = submit_image(task_item, current_prompt)
+        images = pending.result()
+        if not images:
+            raise RuntimeError(f"No image returned for {prompt_obj['image_name']}")
+
+        # Save as temporary files for selection and evaluation
+        candidate_paths = []
+        for image in images:
+            candidate_path = os.path.join(
+                workspace.candidates_dir, f"{uuid.uuid4().hex}.webp"
+            )
+            image.save(candidate_path)
+            candidate_paths.append(candidate_path)
 
-        # Also save the iteration version to the refine directory
-        image.save(refine_path)
-        console.print(f"[bold cyan]Saved iteration version {refine_name}[/bold cyan]")
+        if len(candidate_paths) > 1:
+            temp_filename = select_best_image(
+                vl_model, candidate_paths, mode=prompt_type, sd_prompt=prompt_to_use
+            )
+            best_index = candidate_paths.index(temp_filename)
+            console.print(
+                f"[bold cyan]Selected candidate {best_index + 1}/{len(candidate_paths)} for {prompt_obj['image_name']}[/bold cyan]"
+            )
+            for k, candidate_path in enumerate(candidate_paths):
+                # Keep every candidate of this iteration in the refine directory
+                images[k].save(
+                    os.path.join(
+                        workspace.refine_dir,
+                        f"{prompt_obj['image_name']}_{attempt}_{k + 1}.webp",
+                    )
+                )
+                if candidate_path != temp_filename:
+                    os.remove(candidate_path)
+        else:
+            temp_filename = candidate_paths[0]
+            images[0].save(refine_path)
+            console.print(
+                f"[bold cyan]Saved iteration version {refine_name}[/bold cyan]"
+            )
 
         # If VL evaluation is disabled or max attempts reached, use current image and save evaluation info
         if not ENABLE_VL_EVALUATION or attempt >= max_attempts:
@@ -176,7 +338,7 @@ def generate_images(structured_draft, vl_model: VLModel, comfyui: ComfyUI):
                 f.write(f"Prompt: {prompt_to_use}\n")
                 f.write("Evaluation: VL evaluation disabled or max attempts reached\n")
 
-            os.rename(temp_filename, final_path)
+            os.replace(temp_filename, final_path)
             return (
                 i,
                 prompt_type,
@@ -190,9 +352,9 @@ def generate_images(structured_draft, vl_model: VLModel, comfyui: ComfyUI):
         script_content = ""
         outline_content = ""
 
-        # Read script content
-        script_path = f"./temp/scripts/chapter{i + 1}.rpy"
-        if os.path.exists(script_path):
+        # Read script content, early images have none yet
+        script_path = workspace.chapter_script(i) if i is not None else None
+        if script_path and os.path.exists(script_path):
             try:
                 with open(script_path, "r", encoding="utf-8") as f:
                     script_content = f.read()
@@ -204,7 +366,7 @@ def generate_images(structured_draft, vl_model: VLModel, comfyui: ComfyUI):
         # Prepare outline content
         try:
             # Get current chapter outline
-            chapter_info = chapters[i]
+            chapter_info = chapters[i] if i is not None else {}
             # For sprite type, add character info
             if prompt_type == "sprite" and "character_renpy_name" in prompt_obj:
                 character_name = prompt_obj["character_renpy_name"]
@@ -256,7 +418,7 @@ def generate_images(structured_draft, vl_model: VLModel, comfyui: ComfyUI):
 
         # If image is acceptable, save and return result
         if evaluation["acceptable"]:
-            os.rename(temp_filename, final_path)
+            os.replace(temp_filename, final_path)
             return (i, prompt_type, prompt_obj["image_name"], "Image acceptable")
 
         # If image is not acceptable but optimized prompt is provided, retry with new prompt
@@ -284,7 +446,7 @@ def generate_images(structured_draft, vl_model: VLModel, comfyui: ComfyUI):
             )
 
         # If no optimized prompt but image is not acceptable, use current image
-        os.rename(temp_filename, final_path)
+        os.replace(temp_filename, final_path)
         if evaluation.get("issues"):
             console.print(
                 f"[bold yellow]Image has issues but could not optimize: {', '.join(evaluation['issues'])}[/bold yellow]"
@@ -301,20 +463,38 @@ def generate_images(structured_draft, vl_model: VLModel, comfyui: ComfyUI):
         TextColumn("[bold blue]{task.description}[/bold blue]"),
         BarColumn(),
         TextColumn("[bold]{task.completed}/{task.total}[/bold]"),
+        TextColumn("{task.fields[its]}"),
         TimeElapsedColumn(),
+        disable=not show_progress,
     ) as progress:
-        task = progress.add_task("Generating images", total=len(image_tasks))
+        task = progress.add_task("Generating images", total=len(image_tasks), its="")
 
-        for task_item in image_tasks:
+        # Queue the first attempt of every image up front so that the ComfyUI
+        # queue stays busy while results are downloaded, evaluated and saved
+        pending_jobs = [submit_image(task_item) for task_item in image_tasks]
+
+        for task_item, pending in zip(image_tasks, pending_jobs):
             i, prompt_type, prompt_obj, _ = task_item
             try:
-                i, type_name, image_name, msg = generate_image(task_item)
+                with tagged(chapter=chapters[i]["name"] if i is not None else None):
+                    i, type_name, image_name, msg = generate_image(
+                        task_item, pending=pending
+                    )
+                workspace.manifest.record(
+                    workspace.image_file(image_name),
+                    image_inputs(prompt_type, prompt_obj),
+                )
                 progress.console.print(
-                    f"[bold green]✓[/bold green] Finished generating image for Chapter {i + 1} {type_name} [{image_name}]: {msg}"
+                    f"[bold green]✓[/bold green] Finished generating image for {_source_label(i)} {type_name} [{image_name}]: {msg}"
                 )
                 progress.update(task, advance=1)
             except Exception as e:
+                # Give up the name so that a later chapter needing the same
+                # image renders it
+                with _claim_lock:
+                    if added_images.get(prompt_obj["image_name"]) == _source_label(i):
+                        del added_images[prompt_obj["image_name"]]
                 progress.console.print(
-                    f"[bold red]✗[/bold red] Error generating image for Chapter {i + 1} {prompt_type} [{prompt_obj['image_name']}]: {str(e)}"
+                    f"[bold red]✗[/bold red] Error generating image for {_source_label(i)} {prompt_type} [{prompt_obj['image_name']}]: {str(e)}"
                 )
                 progress.update(task, advance=1)
@@ -1,6 +1,7 @@
 import os
 import json
-import concurrent.futures
+import asyncio
+from contextlib import nullcontext
 from rich.console import Console
 from rich.progress import (
     Progress,
@@ -10,47 +11,208 @@ from rich.progress import (
     TimeElapsedColumn,
 )
 from models.sd import SDPromptModel
+from models.telemetry import tagged
 from util import (
-    get_background_sd_prompt,
-    get_sprite_sd_prompt,
-    get_cg_sd_prompt,
+    aget_background_sd_prompt,
+    aget_sprite_sd_prompt,
+    aget_cg_sd_prompt,
+    aget_key_background_sd_prompt,
 )
-from config import MAX_CONCURRENT_REQUESTS
+from config import LANGUAGE_MODE, EARLY_BACKGROUND_COUNT
+from manifest import file_hash, input_hash, model_inputs
+from workspace import Workspace
+
+if LANGUAGE_MODE == "zh":
+    from prompt_zh import (
+        GENERATE_SPRITE_SD_PROMPT,
+        GENERATE_BACKGROUND_SD_PROMPT,
+        GENERATE_CG_SD_PROMPT,
+        GENERATE_KEY_BACKGROUND_SD_PROMPT,
+    )
+else:
+    from prompt_en import (
+        GENERATE_SPRITE_SD_PROMPT,
+        GENERATE_BACKGROUND_SD_PROMPT,
+        GENERATE_CG_SD_PROMPT,
+        GENERATE_KEY_BACKGROUND_SD_PROMPT,
+    )
 
 # Create console instance
 console = Console()
 
+# Expression of the base sprite drawn for every character from the draft
+BASE_SPRITE_EXPRESSION = "neutral"
+
+
+def early_image_names(workspace: Workspace):
+    """Names of the early sprites and backgrounds, for the scripts to reuse"""
+    names = []
+    for prompt_type in ("sprite", "background"):
+        path = workspace.early_prompt_file(prompt_type)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                names.extend(prompt["image_name"] for prompt in json.load(f))
+    return names
+
+
+def generate_early_image_prompts(
+    workspace: Workspace,
+    structured_draft,
+    sd_prompt_model: SDPromptModel,
+    show_progress=True,
+):
+    """Generate prompts for each character's base sprite and the key locations
+
+    Only the characters and world view of the draft are needed, so their
+    images can render while the chapters are still being written. The
+    scripts are then told to use these image names.
+
+    Args:
+        show_progress (bool): False while another live display is active
+    """
+    os.makedirs(workspace.image_prompts_dir, exist_ok=True)
+    characters_setting_json = json.dumps(
+        structured_draft["characters"], ensure_ascii=False
+    )
+    world_view_json = json.dumps(structured_draft["world_view"], ensure_ascii=False)
+    outline = "\n".join(
+        f"{chapter['name']}: {chapter['content']}"
+        for chapter in structured_draft["chapters"]
+    )
+    # The sprite prompt works from `show` statements, list one per character
+    base_sprites = "\n".join(
+        f"show {character['renpy_name']} {BASE_SPRITE_EXPRESSION}"
+        for character in structured_draft["characters"]
+    )
+
+    model = model_inputs(sd_prompt_model)
+    inputs = {
+        "sprite": input_hash(
+            GENERATE_SPRITE_SD_PROMPT,
+            sd_prompt_model.SCHEMAS["sprite"],
+            characters_setting_json,
+            base_sprites,
+            model,
+        ),
+        "background": input_hash(
+            GENERATE_KEY_BACKGROUND_SD_PROMPT,
+            sd_prompt_model.SCHEMAS["background"],
+            world_view_json,
+            outline,
+            EARLY_BACKGROUND_COUNT,
+            model,
+        ),
+    }
+
+    requests = {}
+    if not workspace.manifest.is_fresh(
+        workspace.early_prompt_file("sprite"), inputs["sprite"]
+    ):
+        requests["sprite"] = aget_sprite_sd_prompt(
+            sd_prompt_model, characters_setting_json, base_sprites
+        )
+    if not workspace.manifest.is_fresh(
+        workspace.early_prompt_file("background"), inputs["background"]
+    ):
+        requests["background"] = aget_key_background_sd_prompt(
+            sd_prompt_model, world_view_json, outline, EARLY_BACKGROUND_COUNT
+        )
+    if not requests:
+        console.print(
+            "[bold yellow]Early image prompts are up to date, skipping...[/bold yellow]"
+        )
+        return
+
+    async def generate_all():
+        return await asyncio.gather(*requests.values(), return_exceptions=True)
+
+    with (
+        console.status(
+            "[bold green]Generating early image prompts...[/bold green]",
+            spinner="dots",
+        )
+        if show_progress
+        else nullcontext()
+    ):
+        results = asyncio.run(generate_all())
+
+    for prompt_type, prompts in zip(requests, results):
+        if isinstance(prompts, Exception):
+            console.print(
+                f"[bold red]✗[/bold red] Error generating early {prompt_type} prompts: {str(prompts)}"
+            )
+            continue
+        with open(workspace.early_prompt_file(prompt_type), "w", encoding="utf-8") as f:
+            json.dump(prompts, f, indent=4, ensure_ascii=False)
+        workspace.manifest.record(
+            workspace.early_prompt_file(prompt_type), inputs[prompt_type]
+        )
+        console.print(
+            f"[bold green]✓[/bold green] Generated {len(prompts)} early {prompt_type} prompts: [cyan]{', '.join(prompt['image_name'] for prompt in prompts)}[/cyan]"
+        )
+
+
+def generate_image_prompts(
+    workspace: Workspace,
+    structured_draft,
+    sd_prompt_model: SDPromptModel,
+    chapter_indices=None,
+    show_progress=True,
+):
+    """Generate background, character, and CG prompt files for each chapter, using non-streaming output
+
+    Args:
+        chapter_indices (list[int]): only these chapters (0-based), all when None
+        show_progress (bool): False while another live display is active
+    """
+    os.makedirs(workspace.image_prompts_dir, exist_ok=True)
 
-def generate_image_prompts(structured_draft, sd_prompt_model: SDPromptModel):
-    """Generate background, character, and CG prompt files for each chapter, using non-streaming output"""
-    os.makedirs("./temp/prompts/image", exist_ok=True)
+    characters_setting_json = json.dumps(
+        structured_draft["characters"], ensure_ascii=False
+    )
+    world_view_json = json.dumps(structured_draft["world_view"], ensure_ascii=False)
+    # Chapter sprites build on the base sprites so characters look the same
+    sprite_setting = characters_setting_json
+    if os.path.exists(workspace.early_prompt_file("sprite")):
+        with open(workspace.early_prompt_file("sprite"), "r", encoding="utf-8") as f:
+            label = "基础立绘提示词" if LANGUAGE_MODE == "zh" else "Base sprite prompts"
+            sprite_setting += f"\n\n{label}: {f.read()}"
 
-    # Check if all prompt files already exist
-    all_prompts_exist = True
+    def prompt_inputs(i, prompt_type):
+        """Everything the prompt_type prompts of chapter i are generated from"""
+        settings = {
+            "background": (GENERATE_BACKGROUND_SD_PROMPT, world_view_json),
+            "sprite": (GENERATE_SPRITE_SD_PROMPT, sprite_setting),
+            "cg": (GENERATE_CG_SD_PROMPT, world_view_json, characters_setting_json),
+        }
+        return input_hash(
+            *settings[prompt_type],
+            sd_prompt_model.SCHEMAS[prompt_type],
+            file_hash(workspace.chapter_script(i)),
+            model_inputs(sd_prompt_model),
+        )
+
+    # Check which prompt files are missing or out of date
+    all_prompts_fresh = True
     prompts_to_generate = []
 
     chapters = structured_draft["chapters"]
     for i, chapter in enumerate(chapters):
-        bg_file_path = f"./temp/prompts/image/chapter{i + 1}_background_prompt.json"
-        sprite_file_path = f"./temp/prompts/image/chapter{i + 1}_sprite_prompt.json"
-        cg_file_path = f"./temp/prompts/image/chapter{i + 1}_cg_prompt.json"
-
-        if (
-            not os.path.exists(bg_file_path)
-            or not os.path.exists(sprite_file_path)
-            or not os.path.exists(cg_file_path)
-        ):
-            all_prompts_exist = False
+        if chapter_indices is not None and i not in chapter_indices:
+            continue
+        status = [
+            prompt_type
+            for prompt_type in ("background", "sprite", "cg")
+            if not workspace.manifest.is_fresh(
+                workspace.image_prompt_file(i, prompt_type),
+                prompt_inputs(i, prompt_type),
+            )
+        ]
 
-            status = []
-            if not os.path.exists(bg_file_path):
-                status.append("background")
-            if not os.path.exists(sprite_file_path):
-                status.append("sprite")
-            if not os.path.exists(cg_file_path):
-                status.append("cg")
+        if status:
+            all_prompts_fresh = False
 
-            script_path = f"./temp/scripts/chapter{i + 1}.rpy"
+            script_path = workspace.chapter_script(i)
             if os.path.exists(script_path):
                 prompts_to_generate.append((i, chapter, status))
             else:
@@ -59,105 +221,103 @@ def generate_image_prompts(structured_draft, sd_prompt_model: SDPromptModel):
                 )
         else:
             console.print(
-                f"[yellow]Prompt files for chapter {i + 1} already exist, skipping prompt generation for this chapter...[/yellow]"
+                f"[yellow]Prompt files for chapter {i + 1} are up to date, skipping prompt generation for this chapter...[/yellow]"
             )
 
-    if all_prompts_exist:
+    if all_prompts_fresh:
         console.print(
-            "[bold yellow]All prompt files already exist, skipping prompt generation step...[/bold yellow]"
+            "[bold yellow]All prompt files are up to date, skipping prompt generation step...[/bold yellow]"
         )
         return
 
-    characters_setting_json = json.dumps(
-        structured_draft["characters"], ensure_ascii=False
-    )
-    world_view_json = json.dumps(structured_draft["world_view"], ensure_ascii=False)
-
-    def generate_prompt_for_chapter(item):
+    async def generate_prompt_for_chapter(item):
         i, chapter, status_list = item
-        script_path = f"./temp/scripts/chapter{i + 1}.rpy"
-        bg_file_path = f"./temp/prompts/image/chapter{i + 1}_background_prompt.json"
-        sprite_file_path = f"./temp/prompts/image/chapter{i + 1}_sprite_prompt.json"
-        cg_file_path = f"./temp/prompts/image/chapter{i + 1}_cg_prompt.json"
+        script_path = workspace.chapter_script(i)
+        bg_file_path = workspace.image_prompt_file(i, "background")
+        sprite_file_path = workspace.image_prompt_file(i, "sprite")
+        cg_file_path = workspace.image_prompt_file(i, "cg")
 
         with open(script_path, "r", encoding="utf-8") as f:
             script_content = f.read()
 
-        result = []
-
-        # For thread safety, create a new console in this function
-        local_console = Console()
-
+        # The three prompt kinds are independent, request them together
+        requests = {}
         if "background" in status_list:
-            local_console.print(
-                f"[bold blue]Generating background prompt for chapter {i + 1}...[/bold blue]"
-            )
-
-            # Use non-streaming API directly
-            background_prompt = get_background_sd_prompt(
-                sd_prompt_model, world_view_json, script_content
+            requests["background"] = (
+                bg_file_path,
+                aget_background_sd_prompt(
+                    sd_prompt_model, world_view_json, script_content
+                ),
             )
-            with open(bg_file_path, "w", encoding="utf-8") as f:
-                json.dump(background_prompt, f, indent=4, ensure_ascii=False)
-            result.append(f"background for chapter {i + 1}")
-
         if "sprite" in status_list:
-            local_console.print(
-                f"[bold blue]Generating character prompt for chapter {i + 1}...[/bold blue]"
-            )
-
-            # Use non-streaming API directly
-            sprite_prompts = get_sprite_sd_prompt(
-                sd_prompt_model, characters_setting_json, script_content
+            requests["sprite"] = (
+                sprite_file_path,
+                aget_sprite_sd_prompt(sd_prompt_model, sprite_setting, script_content),
             )
-            with open(sprite_file_path, "w", encoding="utf-8") as f:
-                json.dump(sprite_prompts, f, indent=4, ensure_ascii=False)
-            result.append(f"sprite for chapter {i + 1}")
-
         if "cg" in status_list:
-            local_console.print(
-                f"[bold blue]Generating CG prompt for chapter {i + 1}...[/bold blue]"
+            requests["cg"] = (
+                cg_file_path,
+                aget_cg_sd_prompt(
+                    sd_prompt_model,
+                    world_view_json,
+                    characters_setting_json,
+                    script_content,
+                ),
             )
 
-            # Use non-streaming API directly
-            cg_prompts = get_cg_sd_prompt(
-                sd_prompt_model,
-                world_view_json,
-                characters_setting_json,
-                script_content,
-            )
-            with open(cg_file_path, "w", encoding="utf-8") as f:
-                json.dump(cg_prompts, f, indent=4, ensure_ascii=False)
-            result.append(f"cg for chapter {i + 1}")
+        async def save(kind, file_path, request):
+            # Each kind is written as soon as it arrives, so a failing kind
+            # does not lose the others
+            prompt = await request
+            with open(file_path, "w", encoding="utf-8") as f:
+                json.dump(prompt, f, indent=4, ensure_ascii=False)
+            workspace.manifest.record(file_path, prompt_inputs(i, kind))
+            return f"{kind} for chapter {i + 1}"
 
+        result = await asyncio.gather(
+            *(
+                save(kind, file_path, request)
+                for kind, (file_path, request) in requests.items()
+            ),
+            return_exceptions=True,
+        )
+        for saved in result:
+            if isinstance(saved, Exception):
+                raise saved
         return result
 
-    # Use thread pool for concurrent requests
+    async def generate_all(progress, task):
+        # Every chapter is requested at once, models.limits keeps each
+        # provider within its concurrency and rate limits
+        async def run(item):
+            # Each run() is its own task, so the tag stays with this chapter
+            with tagged(chapter=item[1]["name"]):
+                try:
+                    return item, await generate_prompt_for_chapter(item), None
+                except Exception as e:
+                    return item, None, e
+
+        for finished in asyncio.as_completed(
+            [run(item) for item in prompts_to_generate]
+        ):
+            (i, chapter, status), results, error = await finished
+            if error is None:
+                progress.console.print(
+                    f"[bold green]✓[/bold green] Finished generating prompts for chapter {i + 1}: [cyan]{', '.join(results)}[/cyan]"
+                )
+                progress.update(task, advance=1)
+            else:
+                progress.console.print(
+                    f"[bold red]✗[/bold red] Error generating prompts for chapter {i + 1}: {str(error)}"
+                )
+
     with Progress(
         SpinnerColumn(),
         TextColumn("[bold blue]{task.description}[/bold blue]"),
         BarColumn(),
         TextColumn("[bold]{task.completed}/{task.total}[/bold]"),
         TimeElapsedColumn(),
+        disable=not show_progress,
     ) as progress:
         task = progress.add_task("Generating prompts", total=len(prompts_to_generate))
-
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=MAX_CONCURRENT_REQUESTS
-        ) as executor:
-            futures = {
-                executor.submit(generate_prompt_for_chapter, item): item
-                for item in prompts_to_generate
-            }
-            for future in concurrent.futures.as_completed(futures):
-                i, chapter, status = futures[future]
-                try:
-                    results = future.result()
-                    progress.console.print(
-                        f"[bold green]✓[/bold green] Finished generating prompts for chapter {i + 1}: [cyan]{', '.join(results)}[/cyan]"
-                    )
-                    progress.update(task, advance=1)
-                except Exception as e:
-                    progress.console.print(
-                        f"[bold red]✗[/bold red] Error generating prompts for chapter {i + 1}: {str(e)}"
-                    )
+        asyncio.run(generate_all(progress, task))
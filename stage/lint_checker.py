@@ -7,6 +7,8 @@ from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt
 from config import RENPY_PATH, LANGUAGE_MODE
+from manifest import file_hash, input_hash, model_inputs
+from workspace import Workspace
 
 if LANGUAGE_MODE == "zh":
     from prompt_zh import SCRIPT_VALIDATION_PROMPT, SCRIPT_FIX_PROMPT
@@ -17,19 +19,24 @@ else:
 console = Console()
 
 
-def run_lint_check(lint_model):
-    """Run Ren'Py lint check and fix discovered issues"""
-    # Check if there is an export directory record
-    export_dir_file = "./temp/export_dir.txt"
-    if os.path.exists(export_dir_file):
-        with open(export_dir_file, "r") as f:
-            game_dir = f.read().strip()
-    else:
-        # If there is no export directory record, ask the user
-        game_dir = Prompt.ask(
-            "[bold blue]Please enter the game project directory to check[/bold blue]",
-            default="./CVV25",
-        )
+def run_lint_check(workspace: Workspace, lint_model, game_dir=None):
+    """Run Ren'Py lint check and fix discovered issues
+
+    Checks game_dir, else the directory the assets were exported to; the
+    directory is only asked for when neither is known.
+    """
+    if game_dir is None:
+        # Check if there is an export directory record
+        export_dir_file = workspace.export_dir_file
+        if os.path.exists(export_dir_file):
+            with open(export_dir_file, "r") as f:
+                game_dir = f.read().strip()
+        else:
+            # If there is no export directory record, ask the user
+            game_dir = Prompt.ask(
+                "[bold blue]Please enter the game project directory to check[/bold blue]",
+                default="./CVV25",
+            )
 
     console.print(
         Panel(
@@ -39,13 +46,26 @@ def run_lint_check(lint_model):
     )
 
     # Create temp directory
-    os.makedirs("./temp", exist_ok=True)
-    lint_output_path = "./temp/lint.txt"
+    os.makedirs(workspace.root, exist_ok=True)
+    lint_output_path = workspace.lint_output_file
+    # The lint output is out of date once the exported scripts change
+    scripts = (
+        sorted(os.listdir(workspace.scripts_dir))
+        if os.path.isdir(workspace.scripts_dir)
+        else []
+    )
+    lint_inputs = input_hash(
+        game_dir,
+        {
+            name: file_hash(os.path.join(workspace.scripts_dir, name))
+            for name in scripts
+        },
+    )
 
     # Run lint command
-    if os.path.exists(lint_output_path):
+    if workspace.manifest.is_fresh(lint_output_path, lint_inputs):
         console.print(
-            "[bold blue]Found existing Lint output file, skipping Lint check step[/bold blue]"
+            "[bold blue]Lint output is up to date, skipping Lint check step[/bold blue]"
         )
     else:
         with console.status(
@@ -71,6 +91,7 @@ def run_lint_check(lint_model):
 
                 # Wait for process to complete
                 return_code = process.wait()
+                workspace.manifest.record(lint_output_path, lint_inputs)
 
                 # if return_code != 0:
                 #     console.print("[bold yellow]Lint check completed, potential issues found[/bold yellow]")
@@ -83,10 +104,13 @@ def run_lint_check(lint_model):
                 return
 
     # Parse lint results
-    errors_json_path = "./temp/lint_errors.json"
-    if os.path.exists(errors_json_path):
+    errors_json_path = workspace.lint_errors_file
+    errors_inputs = input_hash(
+        SCRIPT_VALIDATION_PROMPT, file_hash(lint_output_path), model_inputs(lint_model)
+    )
+    if workspace.manifest.is_fresh(errors_json_path, errors_inputs):
         console.print(
-            "[bold blue]Found existing error info file, skipping parsing step[/bold blue]"
+            "[bold blue]Error info is up to date, skipping parsing step[/bold blue]"
         )
         with open(errors_json_path, "r", encoding="utf-8") as f:
             parsed_errors = json.load(f)
@@ -108,6 +132,7 @@ def run_lint_check(lint_model):
                 # Save parsed results
                 with open(errors_json_path, "w", encoding="utf-8") as f:
                     json.dump(parsed_errors, f, ensure_ascii=False, indent=2)
+                workspace.manifest.record(errors_json_path, errors_inputs)
 
                 console.print(
                     f"[bold blue]Parsed {len(parsed_errors)} errors[/bold blue]"
@@ -196,7 +221,7 @@ def run_lint_check(lint_model):
 
                     # Also update file in temp/scripts directory for possible future export
                     script_name = os.path.basename(full_path)
-                    temp_script_path = os.path.join("./temp/scripts", script_name)
+                    temp_script_path = os.path.join(workspace.scripts_dir, script_name)
                     if os.path.exists(temp_script_path):
                         with open(temp_script_path, "w", encoding="utf-8") as f:
                             f.write(fixed_content)
@@ -215,7 +240,7 @@ def run_lint_check(lint_model):
 
         # Validate fixed results
         console.print("[bold blue]Validating fix results...[/bold blue]")
-        validation_output_path = "./temp/lint_validation.txt"
+        validation_output_path = workspace.lint_validation_file
 
         try:
             # Run lint command again
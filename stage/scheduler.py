@@ -0,0 +1,151 @@
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from rich.console import Console
+from rich.progress import (
+    Progress,
+    SpinnerColumn,
+    TextColumn,
+    BarColumn,
+    TimeElapsedColumn,
+)
+
+# Create console instance
+console = Console()
+
+
+class PipelineTask:
+    """One node of the pipeline graph, see PipelineScheduler.add()"""
+
+    def __init__(self, name, run, pool, deps, after):
+        self.name = name
+        self.run = run
+        self.pool = pool
+        self.deps = list(deps)
+        self.after = list(after)
+        # pending, running, done, failed or skipped
+        self.status = "pending"
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+
+class PipelineScheduler:
+    """Runs tasks as soon as the tasks they depend on have finished
+
+    Tasks form a dependency graph, e.g. chapter text -> script -> image and
+    audio prompts -> renders for every chapter. Ready tasks run concurrently
+    in the worker threads of their resource pool ("llm", "gpu", ...), so the
+    GPU renders the first chapters while later ones are still being written.
+    A task that raises skips every task depending on it.
+    """
+
+    def __init__(self, pools):
+        """pools: pool name -> number of tasks of that pool running at once"""
+        self.pools = pools
+        # In the order added, which is a topological order
+        self.tasks = {}
+        self.started_at = None
+
+    def add(self, name, run, pool, deps=(), after=()):
+        """Add a task
+
+        Args:
+            name (str): unique task name
+            run (Callable[[], Any]): the work, called in a worker thread
+            pool (str): resource pool the task runs in
+            deps (Iterable[str]): tasks that must succeed first
+            after (Iterable[str]): tasks that must have finished first,
+                successfully or not, e.g. the previous chapter for continuity
+
+        Returns:
+            str: name, for use in deps/after of later tasks
+        """
+        if name in self.tasks:
+            raise ValueError(f"Duplicate pipeline task: {name}")
+        if pool not in self.pools:
+            raise ValueError(f"Unknown resource pool {pool} of task {name}")
+        for dep in (*deps, *after):
+            if dep not in self.tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+        self.tasks[name] = PipelineTask(name, run, pool, deps, after)
+        return name
+
+    def _ready(self, task):
+        """True/False, or None when a failed dependency skips the task"""
+        for dep in task.deps:
+            status = self.tasks[dep].status
+            if status in ("failed", "skipped"):
+                return None
+            if status != "done":
+                return False
+        return all(
+            self.tasks[dep].status in ("done", "failed", "skipped")
+            for dep in task.after
+        )
+
+    def run(self, show_progress=True):
+        """Run every task; returns the number of tasks that did not succeed
+
+        show_progress: False when several pipelines run side by side
+        """
+        self.started_at = time.monotonic()
+        executors = {
+            pool: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=pool)
+            for pool, workers in self.pools.items()
+        }
+        running = {}
+        try:
+            with Progress(
+                SpinnerColumn(),
+                TextColumn("[bold blue]{task.description}[/bold blue]"),
+                BarColumn(),
+                TextColumn("[bold]{task.completed}/{task.total}[/bold]"),
+                TimeElapsedColumn(),
+                disable=not show_progress,
+            ) as progress:
+                overall = progress.add_task("Running pipeline", total=len(self.tasks))
+                while True:
+                    for task in self.tasks.values():
+                        if task.status != "pending":
+                            continue
+                        ready = self._ready(task)
+                        if ready is None:
+                            task.status = "skipped"
+                            progress.console.print(
+                                f"[bold yellow]-[/bold yellow] Skipped [cyan]{task.name}[/cyan], a task it depends on failed"
+                            )
+                            progress.advance(overall)
+                        elif ready:
+                            task.status = "running"
+                            task.started_at = time.monotonic()
+                            # Every task starts from the scheduler's context,
+                            # telemetry tags set inside it stay with the task
+                            context = contextvars.copy_context()
+                            future = executors[task.pool].submit(context.run, task.run)
+                            running[future] = task
+                    if not running:
+                        break
+                    progress.update(
+                        overall,
+                        description=f"Running pipeline ({len(running)} tasks in progress)",
+                    )
+
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        task = running.pop(future)
+                        task.finished_at = time.monotonic()
+                        try:
+                            future.result()
+                            task.status = "done"
+                        except Exception as e:
+                            task.status = "failed"
+                            task.error = e
+                            progress.console.print(
+                                f"[bold red]✗[/bold red] Pipeline task [cyan]{task.name}[/cyan] failed: {str(e)}"
+                            )
+                        progress.advance(overall)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
+        return sum(task.status != "done" for task in self.tasks.values())
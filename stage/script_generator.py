@@ -9,77 +9,122 @@ from rich.progress import (
     TimeElapsedColumn,
 )
 from models.reasoning import ReasoningModel
-from util import remove_renpy_markers
-from config import LANGUAGE_MODE
+from models.telemetry import tagged
+from util import remove_renpy_markers, stream_to_file
+from config import LANGUAGE_MODE, CONTINUITY_TOKEN_BUDGET
+from continuity import ContinuityMemory
+from prompt_layout import layered_messages
+from manifest import file_hash, input_hash, model_inputs
+from workspace import Workspace
+from .image_prompt_generator import early_image_names
 
 if LANGUAGE_MODE == "zh":
-    from prompt_zh import GENERATE_CHAPTER_SCRIPT_PROMPT
+    from prompt_zh import (
+        GENERATE_CHAPTER_SCRIPT_PROMPT,
+        GENERATE_CHAPTER_SCRIPT_REQUEST_PROMPT,
+    )
 else:
-    from prompt_en import GENERATE_CHAPTER_SCRIPT_PROMPT
+    from prompt_en import (
+        GENERATE_CHAPTER_SCRIPT_PROMPT,
+        GENERATE_CHAPTER_SCRIPT_REQUEST_PROMPT,
+    )
 
 # Create console instance
 console = Console()
 
 
-def generate_scripts(structured_draft, reasoning_model: ReasoningModel):
-    """Generate Ren'Py script files"""
-    os.makedirs("./temp/scripts", exist_ok=True)
+def write_character_definitions(workspace: Workspace, structured_draft):
+    """Write script.rpy with the character definitions and entry label
 
-    # Check if all script files already exist
-    script_path = "./temp/scripts/script.rpy"
-    all_scripts_exist = os.path.exists(script_path)
+    Rewritten only when the characters of the draft change.
+    """
+    os.makedirs(workspace.scripts_dir, exist_ok=True)
+    script_path = workspace.character_script_file
+    inputs = input_hash(structured_draft["characters"])
+    if workspace.manifest.is_fresh(script_path, inputs):
+        return
+
+    with console.status(
+        "[bold green]Generating character definition file...[/bold green]",
+        spinner="dots",
+    ):
+        characters = structured_draft["characters"]
+        characters_definition = ""
+        for character in characters:
+            renpy_name = character["renpy_name"]
+            name = character["name"]
+            characters_definition += f"define {renpy_name} = Character('{name}')\n"
+        with open(script_path, "w", encoding="utf-8") as f:
+            f.write(characters_definition)
+            f.write("\nlabel start:\n    jump chapter1\n")
+    workspace.manifest.record(script_path, inputs)
+    console.print(
+        f"[bold green]✓[/bold green] Character definition file generated: [cyan]{script_path}[/cyan]"
+    )
+
+
+def generate_scripts(
+    workspace: Workspace,
+    structured_draft,
+    reasoning_model: ReasoningModel,
+    chapter_indices=None,
+    show_progress=True,
+):
+    """Generate Ren'Py script files
+
+    Args:
+        chapter_indices (list[int]): only these chapters (0-based), all when None
+        show_progress (bool): False while another live display is active
+    """
+    # Generate character definitions and entry label
+    write_character_definitions(workspace, structured_draft)
+    script_path = workspace.character_script_file
+    early_names = early_image_names(workspace)
+
+    def script_inputs(i):
+        """Everything the script of chapter i is written from; earlier
+        scripts are only a format reference and are left out"""
+        return input_hash(
+            GENERATE_CHAPTER_SCRIPT_PROMPT,
+            GENERATE_CHAPTER_SCRIPT_REQUEST_PROMPT,
+            CONTINUITY_TOKEN_BUDGET,
+            structured_draft,
+            file_hash(workspace.chapter_file(structured_draft["chapters"][i]["name"])),
+            file_hash(script_path),
+            early_names,
+            model_inputs(reasoning_model),
+        )
+
+    # Check which script files are missing or out of date
     chapters_to_generate = []
 
-    if all_scripts_exist:
-        for i, chapter in enumerate(structured_draft["chapters"]):
-            chapter_script_path = f"./temp/scripts/chapter{i + 1}.rpy"
-            if not os.path.exists(chapter_script_path):
-                all_scripts_exist = False
-                chapters_to_generate.append((i, chapter))
-            else:
-                console.print(
-                    f"[yellow]Chapter [bold]{chapter['name']}[/bold] script file already exists, skipping script generation...[/yellow]"
-                )
+    for i, chapter in enumerate(structured_draft["chapters"]):
+        if chapter_indices is not None and i not in chapter_indices:
+            continue
+        chapter_script_path = workspace.chapter_script(i)
+        if not workspace.manifest.is_fresh(chapter_script_path, script_inputs(i)):
+            chapters_to_generate.append((i, chapter))
+        else:
+            console.print(
+                f"[yellow]Chapter [bold]{chapter['name']}[/bold] script is up to date, skipping script generation...[/yellow]"
+            )
 
-    if all_scripts_exist:
+    if not chapters_to_generate:
         console.print(
-            "[bold yellow]All script files already exist, skipping script generation step...[/bold yellow]"
+            "[bold yellow]All scripts are up to date, skipping script generation step...[/bold yellow]"
         )
         return
 
-    # Generate character definitions and entry label
-    if not os.path.exists(script_path):
-        with console.status(
-            "[bold green]Generating character definition file...[/bold green]",
-            spinner="dots",
-        ):
-            characters = structured_draft["characters"]
-            characters_definition = ""
-            for character in characters:
-                renpy_name = character["renpy_name"]
-                name = character["name"]
-                characters_definition += f"define {renpy_name} = Character('{name}')\n"
-            with open(script_path, "w", encoding="utf-8") as f:
-                f.write(characters_definition)
-                f.write("\nlabel start:\n    jump chapter1\n")
-        console.print(
-            f"[bold green]✓[/bold green] Character definition file generated: [cyan]{script_path}[/cyan]"
-        )
-
-    # Prepare all chapters' content
-    chapters = []
-    for chapter in structured_draft["chapters"]:
-        chapter_file = f"./temp/chapters/{chapter['name']}.txt"
-        if os.path.exists(chapter_file):
-            with open(chapter_file, "r", encoding="utf-8") as f:
-                chapter_content = f.read()
-            chapters.append({"name": chapter["name"], "content": chapter_content})
-        else:
+    # Only chapters whose content has been generated can be converted
+    for i, chapter in list(chapters_to_generate):
+        chapter_file = workspace.chapter_file(chapter["name"])
+        if not os.path.exists(chapter_file):
+            chapters_to_generate.remove((i, chapter))
             console.print(
                 f"[bold red]Warning:[/bold red] Chapter file {chapter_file} does not exist"
             )
 
-    if len(chapters) == 0:
+    if len(chapters_to_generate) == 0:
         console.print(
             "[bold red]Error:[/bold red] No chapter content files found, unable to generate scripts"
         )
@@ -87,6 +132,11 @@ def generate_scripts(structured_draft, reasoning_model: ReasoningModel):
 
     structured_draft_content = json.dumps(structured_draft, ensure_ascii=False)
 
+    # Previous scripts are only a format reference: the latest one's opening
+    # plus the passages closest to the chapter being converted
+    memory = ContinuityMemory(CONTINUITY_TOKEN_BUDGET)
+    remembered = 0
+
     # Generate each chapter's script in order
     with Progress(
         SpinnerColumn(),
@@ -94,6 +144,7 @@ def generate_scripts(structured_draft, reasoning_model: ReasoningModel):
         BarColumn(),
         TextColumn("[bold]{task.completed}/{task.total}[/bold]"),
         TimeElapsedColumn(),
+        disable=not show_progress,
     ) as progress:
         task = progress.add_task(
             "Generating Ren'Py scripts", total=len(chapters_to_generate)
@@ -105,41 +156,43 @@ def generate_scripts(structured_draft, reasoning_model: ReasoningModel):
             with open(script_path, "r", encoding="utf-8") as f:
                 characters_definition = f.read()
 
+        # Sprites and backgrounds drawn from the draft, reused where they fit
+        early_images = ""
+        if early_names:
+            if LANGUAGE_MODE == "zh":
+                early_images = "以下图片已经准备好，合适时请直接使用这些名称:\n"
+            else:
+                early_images = "These images are already available, use their names where they fit:\n"
+            early_images += "\n".join(early_names)
+
         for i, chapter in chapters_to_generate:
             chapter_name = chapter["name"]
-            chapter_file = f"./temp/chapters/{chapter_name}.txt"
-            script_chapter_path = f"./temp/scripts/chapter{i + 1}.rpy"
+            chapter_file = workspace.chapter_file(chapter_name)
+            script_chapter_path = workspace.chapter_script(i)
 
             progress.update(
                 task, description=f"Generating chapter script: {chapter_name}"
             )
 
-            # Get previous chapters' script content
-            previous_scripts_content = ""
-            if i > 0:
-                previous_scripts = []
-                for j in range(i):
-                    prev_script_file = f"./temp/scripts/chapter{j + 1}.rpy"
-                    if os.path.exists(prev_script_file):
-                        with open(prev_script_file, "r", encoding="utf-8") as f:
-                            previous_scripts.append(
-                                f"[{structured_draft['chapters'][j]['name']} Script]:\n{f.read()}\n\n"
-                            )
-                previous_scripts_content = "".join(previous_scripts)
-            else:
-                previous_scripts_content = None
-
             # Get current chapter content
             with open(chapter_file, "r", encoding="utf-8") as f:
                 chapter_content = f.read()
 
-            try:
-                generate_script_prompt = GENERATE_CHAPTER_SCRIPT_PROMPT.format(
-                    draft_content=structured_draft_content,
-                    chapter_name=chapter_name,
-                    chapter_content=chapter_content,
-                )
+            # Get previous chapters' script content
+            for j in range(remembered, i):
+                prev_script_file = workspace.chapter_script(j)
+                if os.path.exists(prev_script_file):
+                    with open(prev_script_file, "r", encoding="utf-8") as f:
+                        memory.add(
+                            f"{structured_draft['chapters'][j]['name']} Script",
+                            f.read(),
+                        )
+            remembered = max(remembered, i)
+            previous_scripts_content = memory.context(
+                f"{chapter_name}\n{chapter_content}"
+            )
 
+            try:
                 # Add character definition file reference in the prompt
                 if LANGUAGE_MODE == "zh":
                     definition_prompt = (
@@ -147,30 +200,49 @@ def generate_scripts(structured_draft, reasoning_model: ReasoningModel):
                     )
                 else:
                     definition_prompt = "Reference character definitions in the outline (do not redefine these characters):\n"
-                generate_script_prompt += (
-                    f"\n\n{definition_prompt}\n{characters_definition}\n\n"
+
+                # Only the chapter itself changes between requests, it goes
+                # last so that the provider can reuse its prefix cache
+                request = GENERATE_CHAPTER_SCRIPT_REQUEST_PROMPT.format(
+                    chapter_name=chapter_name,
+                    chapter_content=chapter_content,
                 )
 
                 # Add previous chapters' script reference in the prompt
-                if previous_scripts_content is not None:
+                if previous_scripts_content:
                     if LANGUAGE_MODE == "zh":
                         reference_script_prompt = "请参考前面章节的脚本格式和风格:\n"
                     else:
                         reference_script_prompt = "Refer to the script format and style of previous chapters:\n"
-                    generate_script_prompt += (
-                        f"{reference_script_prompt}\n{previous_scripts_content}"
+                    request += (
+                        f"\n\n{reference_script_prompt}\n{previous_scripts_content}"
                     )
 
-                # Use non-streaming request
-                with console.status(
-                    f"[bold green]Generating script: {chapter_name}[/bold green]",
-                    spinner="dots",
-                ):
-                    full_content = reasoning_model.run(generate_script_prompt)
+                generate_script_prompt = layered_messages(
+                    GENERATE_CHAPTER_SCRIPT_PROMPT.format(
+                        draft_content=structured_draft_content
+                    ),
+                    context=[
+                        f"{definition_prompt}\n{characters_definition}",
+                        early_images,
+                    ],
+                    request=request,
+                )
 
-                with open(script_chapter_path, "w", encoding="utf-8") as f:
-                    cleaned_content = remove_renpy_markers(full_content)
-                    f.write(cleaned_content)
+                # Stream to disk so that a dropped connection resumes
+                # from the partial script instead of starting over
+                with tagged(chapter=chapter_name):
+                    stream_to_file(
+                        reasoning_model,
+                        generate_script_prompt,
+                        script_chapter_path,
+                        on_progress=lambda chunks, speed: progress.update(
+                            task,
+                            description=f"Generating chapter script: {chapter_name} ({speed:.1f} tok/s)",
+                        ),
+                        postprocess=remove_renpy_markers,
+                    )
+                workspace.manifest.record(script_chapter_path, script_inputs(i))
 
                 progress.console.print(
                     f"[bold green]✓[/bold green] Finished generating script for chapter [cyan]{chapter_name}[/cyan]"
@@ -1,25 +1,44 @@
 from rich.console import Console
 from rich.panel import Panel
+from rich.table import Table
+import os
 import time
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from models.reasoning import ReasoningModel
 from models.general import GeneralModel
 from models.sd import SDPromptModel
 from models.vl import VLModel
 from models.lint import LintModel
-from config import COMFY_UI_SERVER_ADDRESS
-from comfy import ComfyUI
+from config import (
+    COMFY_UI_SERVER_ADDRESSES,
+    COMFY_UI_STREAM_OUTPUTS,
+    COMFY_UI_HTTP_TIMEOUT,
+    COMFY_UI_CACHE_DIR,
+    COMFY_UI_CACHE_MAX_MB,
+    LLM_CACHE_BYPASS_STAGES,
+    RECORD_FIXTURES_DIR,
+    PIPELINE_SCHEDULER,
+    PIPELINE_LLM_WORKERS,
+    PIPELINE_GPU_WORKERS,
+    EARLY_ASSETS,
+    WORKSPACE_ROOT,
+)
+from models.cache import get_response_cache
+from models.telemetry import get_telemetry, tagged
+from comfy import ComfyUIPool, ThroughputMonitor, OutputCache
+from workspace import Workspace
 
 from .theme_manager import get_game_theme
 from .draft_generator import generate_draft, parse_and_save_draft
 from .chapter_generator import generate_chapters
-from .script_generator import generate_scripts
-from .image_prompt_generator import generate_image_prompts
+from .script_generator import generate_scripts, write_character_definitions
+from .image_prompt_generator import generate_image_prompts, generate_early_image_prompts
 from .audio_prompt_generator import generate_audio_prompts
-from .image_generator import generate_images
+from .image_generator import generate_images, clean_candidates
 from .audio_generator import generate_audio
 from .export_game import export_game_assets
 from .lint_checker import run_lint_check
+from .scheduler import PipelineScheduler
 
 # Create a console instance for global style control
 console = Console()
@@ -33,7 +52,511 @@ def timer(step_name):
         yield
     finally:
         elapsed_time = time.time() - start_time
-        console.print(f"[bold yellow]Step time: {elapsed_time:.2f} seconds[/bold yellow]")
+        console.print(
+            f"[bold yellow]Step time: {elapsed_time:.2f} seconds[/bold yellow]"
+        )
+
+
+@contextmanager
+def llm_stage(stage_name):
+    """Tag the model calls of a stage for telemetry, and bypass the LLM
+    response cache for stages listed in LLM_CACHE_BYPASS_STAGES"""
+    cache = get_response_cache()
+    with tagged(stage=stage_name):
+        if cache is None or stage_name not in LLM_CACHE_BYPASS_STAGES:
+            yield
+            return
+        with cache.bypassing():
+            yield
+
+
+def print_llm_cache_stats():
+    """Show how many model calls were answered by the LLM response cache"""
+    cache = get_response_cache()
+    if cache is None or not cache.counts:
+        return
+    table = Table(title="LLM Response Cache")
+    table.add_column("Model", style="cyan")
+    table.add_column("Hits", style="green")
+    table.add_column("Misses", style="red")
+    for model, (hits, misses) in sorted(cache.counts.items()):
+        table.add_row(model, str(hits), str(misses))
+    console.print(table)
+
+
+def print_llm_usage(report_path):
+    """Show tokens, latency and cost of the model calls of each stage"""
+    telemetry = get_telemetry()
+    summary = telemetry.summary()
+    if not summary:
+        return
+    table = Table(title="LLM Usage")
+    table.add_column("Stage", style="cyan")
+    table.add_column("Model", style="cyan")
+    table.add_column("Calls", style="magenta")
+    table.add_column("Cache hits", style="magenta")
+    table.add_column("Errors", style="red")
+    table.add_column("Prompt tok", style="yellow")
+    table.add_column("Prefix-cached tok", style="yellow")
+    table.add_column("Output tok", style="yellow")
+    table.add_column("Reasoning tok", style="yellow")
+    table.add_column("Avg TTFT (s)", style="green")
+    table.add_column("Avg latency (s)", style="green")
+    table.add_column("Cost ($)", style="green")
+    total_cost = None
+    for (stage, model), total in sorted(summary.items()):
+        table.add_row(
+            stage,
+            model,
+            str(total["calls"]),
+            str(total["cache_hits"]),
+            str(total["errors"]),
+            str(total["prompt_tokens"]),
+            # Prompt tokens served from the provider's prefix/context cache
+            f"{total['cached_tokens']} ({total['cached_tokens'] / total['prompt_tokens']:.0%})"
+            if total["prompt_tokens"]
+            else "-",
+            str(total["completion_tokens"]),
+            str(total["reasoning_tokens"]),
+            f"{total['avg_ttft_seconds']:.2f}"
+            if total["avg_ttft_seconds"] is not None
+            else "-",
+            f"{total['avg_latency_seconds']:.2f}",
+            f"{total['cost']:.4f}" if total["cost"] is not None else "-",
+        )
+        if total["cost"] is not None:
+            total_cost = (total_cost or 0.0) + total["cost"]
+    console.print(table)
+    if total_cost is not None:
+        console.print(
+            f"[bold yellow]Estimated LLM cost: ${total_cost:.4f}[/bold yellow]"
+        )
+    telemetry.write_report(report_path)
+    console.print(f"[dim]Per-call statistics: {report_path}[/dim]")
+
+
+def print_comfyui_http_stats(comfyui):
+    """Show how much time the ComfyUI REST calls spent on the network"""
+    stats = comfyui.http_stats()
+    if not stats:
+        return
+    table = Table(title="ComfyUI Network Time")
+    table.add_column("Endpoint", style="cyan")
+    table.add_column("Requests", style="magenta")
+    table.add_column("Errors", style="red")
+    table.add_column("Total (s)", style="green")
+    table.add_column("Avg (ms)", style="green")
+    table.add_column("Max (ms)", style="green")
+    table.add_column("Received (MB)", style="yellow")
+    for endpoint, endpoint_stats in sorted(stats.items()):
+        count = endpoint_stats["count"]
+        table.add_row(
+            endpoint,
+            str(count),
+            str(endpoint_stats["errors"]),
+            f"{endpoint_stats['total_seconds']:.2f}",
+            f"{endpoint_stats['total_seconds'] / count * 1000:.1f}",
+            f"{endpoint_stats['max_seconds'] * 1000:.1f}",
+            f"{endpoint_stats['bytes'] / 1024 / 1024:.2f}",
+        )
+    console.print(table)
+
+
+def print_comfyui_throughput(comfyui: ComfyUIPool, monitor: ThroughputMonitor):
+    """Show the sampler throughput of each workflow template on each server"""
+    summary = monitor.summary()
+    if not summary:
+        return
+    table = Table(title="ComfyUI Throughput")
+    table.add_column("Template", style="cyan")
+    table.add_column("Server", style="cyan")
+    table.add_column("Jobs", style="magenta")
+    table.add_column("Outputs", style="magenta")
+    table.add_column("Run time (s)", style="green")
+    table.add_column("s/output", style="green")
+    table.add_column("it/s", style="yellow")
+    for (template, server), total in sorted(summary.items()):
+        table.add_row(
+            template,
+            server,
+            str(total["jobs"]),
+            str(total["outputs"]),
+            f"{total['run_seconds']:.2f}",
+            f"{total['seconds_per_output']:.2f}"
+            if total["seconds_per_output"] is not None
+            else "-",
+            f"{total['its']:.2f}" if total["its"] is not None else "-",
+        )
+    console.print(table)
+
+    # Jobs were run grouped by the models they load, compare with FIFO order
+    swaps, fifo_swaps = comfyui.model_swaps()
+    swap_seconds, resident_seconds = monitor.model_load_seconds()
+    message = f"Model swaps: {swaps} (submission order would need {fifo_swaps})"
+    if swap_seconds is not None and resident_seconds is not None:
+        avoided = max(0, fifo_swaps - swaps) * max(0.0, swap_seconds - resident_seconds)
+        message += f", estimated model-load time avoided: {avoided:.1f} seconds"
+    console.print(f"[bold yellow]{message}[/bold yellow]")
+    if monitor.log_path:
+        console.print(f"[dim]Per-job statistics: {monitor.log_path}[/dim]")
+
+
+def schedule_chapters(
+    workspace: Workspace,
+    structured_draft,
+    reasoning_model,
+    general_model,
+    sd_prompt_model,
+    vl_model,
+    comfyui,
+):
+    """Steps 4-9 as per-chapter tasks for the PipelineScheduler
+
+    Chapter text -> script -> image/audio prompts -> images/audio, per
+    chapter. Chapter texts and scripts are written in story order because
+    each one refers to the previous ones; everything else of a chapter
+    starts as soon as its script exists. With EARLY_ASSETS, the base
+    sprites and key backgrounds render from the draft alone meanwhile.
+    """
+    scheduler = PipelineScheduler(
+        {"llm": PIPELINE_LLM_WORKERS, "gpu": PIPELINE_GPU_WORKERS}
+    )
+    # Image and audio names already claimed by a chapter, so that each is
+    # generated once
+    claimed_images = {}
+    claimed_audio = {}
+
+    def step(stage_name, outputs, function, *args, **kwargs):
+        """Run a stage function for one chapter; its outputs must exist after"""
+
+        def run():
+            with llm_stage(stage_name) if stage_name else nullcontext():
+                function(workspace, *args, show_progress=False, **kwargs)
+            missing = [path for path in outputs if not os.path.exists(path)]
+            if missing:
+                raise RuntimeError(f"{', '.join(missing)} not generated")
+
+        return run
+
+    # Scripts should know the early image names, chapter renders then find
+    # those images on disk; both still run if the early tasks fail
+    early_prompts = early_images = None
+    if EARLY_ASSETS:
+        early_prompts = scheduler.add(
+            "Early image prompts",
+            step(
+                "image_prompts",
+                [
+                    workspace.early_prompt_file("sprite"),
+                    workspace.early_prompt_file("background"),
+                ],
+                generate_early_image_prompts,
+                structured_draft,
+                sd_prompt_model,
+            ),
+            "llm",
+        )
+        early_images = scheduler.add(
+            "Early images",
+            step(
+                "images",
+                [],
+                generate_images,
+                structured_draft,
+                vl_model,
+                comfyui,
+                early=True,
+            ),
+            "gpu",
+            deps=[early_prompts],
+        )
+
+    previous_text = previous_script = None
+    for i, chapter in enumerate(structured_draft["chapters"]):
+        only = [i]
+        text = scheduler.add(
+            f"Chapter {i + 1} text",
+            step(
+                "chapters",
+                [workspace.chapter_file(chapter["name"])],
+                generate_chapters,
+                structured_draft,
+                reasoning_model,
+                general_model,
+                chapter_indices=only,
+            ),
+            "llm",
+            after=[previous_text] if previous_text else [],
+        )
+        script = scheduler.add(
+            f"Chapter {i + 1} script",
+            step(
+                "scripts",
+                [workspace.chapter_script(i)],
+                generate_scripts,
+                structured_draft,
+                reasoning_model,
+                chapter_indices=only,
+            ),
+            "llm",
+            deps=[text],
+            after=[
+                task for task in (previous_script, early_prompts) if task is not None
+            ],
+        )
+        image_prompts = scheduler.add(
+            f"Chapter {i + 1} image prompts",
+            step(
+                "image_prompts",
+                [
+                    workspace.image_prompt_file(i, kind)
+                    for kind in ("background", "sprite", "cg")
+                ],
+                generate_image_prompts,
+                structured_draft,
+                sd_prompt_model,
+                chapter_indices=only,
+            ),
+            "llm",
+            deps=[script],
+        )
+        audio_prompts = scheduler.add(
+            f"Chapter {i + 1} audio prompts",
+            step(
+                "audio_prompts",
+                [workspace.audio_prompt_file(i, kind) for kind in ("music", "sfx")],
+                generate_audio_prompts,
+                structured_draft,
+                general_model,
+                chapter_indices=only,
+            ),
+            "llm",
+            deps=[script],
+        )
+        scheduler.add(
+            f"Chapter {i + 1} images",
+            step(
+                "images",
+                [],
+                generate_images,
+                structured_draft,
+                vl_model,
+                comfyui,
+                chapter_indices=only,
+                claimed=claimed_images,
+            ),
+            "gpu",
+            deps=[image_prompts],
+            after=[early_images] if early_images else [],
+        )
+        scheduler.add(
+            f"Chapter {i + 1} audio",
+            step(
+                None,
+                [],
+                generate_audio,
+                structured_draft,
+                comfyui,
+                chapter_indices=only,
+                claimed=claimed_audio,
+            ),
+            "gpu",
+            deps=[audio_prompts],
+        )
+        previous_text, previous_script = text, script
+    return scheduler
+
+
+def print_pipeline_timeline(scheduler: PipelineScheduler):
+    """Show when each pipeline task ran, relative to the start of the pipeline"""
+    table = Table(title="Pipeline Tasks")
+    table.add_column("Task", style="cyan")
+    table.add_column("Pool", style="magenta")
+    table.add_column("Status", style="yellow")
+    table.add_column("Start (s)", style="green")
+    table.add_column("Duration (s)", style="green")
+    for task in scheduler.tasks.values():
+        ran = task.started_at is not None and task.finished_at is not None
+        table.add_row(
+            task.name,
+            task.pool,
+            task.status,
+            f"{task.started_at - scheduler.started_at:.1f}" if ran else "-",
+            f"{task.finished_at - task.started_at:.1f}" if ran else "-",
+        )
+    console.print(table)
+
+
+class SharedClients:
+    """Model clients and the ComfyUI pool, shared by every game of a run"""
+
+    def __init__(self, log_dir):
+        # Initialize models
+        console.print("[yellow]Initializing models...[/yellow]")
+        start_time = time.time()
+        self.reasoning_model = ReasoningModel()
+        self.general_model = GeneralModel()
+        self.sd_prompt_model = SDPromptModel()
+        self.vl_model = VLModel()
+        self.lint_model = LintModel()
+        # Sampler statistics of every ComfyUI job, one JSON object per line
+        self.comfyui_monitor = ThroughputMonitor(f"{log_dir}/comfyui_jobs.jsonl")
+        self.comfyui = ComfyUIPool(
+            COMFY_UI_SERVER_ADDRESSES,
+            stream_outputs=COMFY_UI_STREAM_OUTPUTS,
+            timeout=COMFY_UI_HTTP_TIMEOUT,
+            monitor=self.comfyui_monitor,
+            cache=OutputCache(COMFY_UI_CACHE_DIR, COMFY_UI_CACHE_MAX_MB * 1024 * 1024)
+            if COMFY_UI_CACHE_DIR
+            else None,
+            # Fixtures for scripts/replay_server.py, never evicted
+            recorder=OutputCache(
+                os.path.join(RECORD_FIXTURES_DIR, "comfyui"), float("inf")
+            )
+            if RECORD_FIXTURES_DIR
+            else None,
+        )
+        console.print(
+            f"[bold yellow]Model initialization time: {time.time() - start_time:.2f} seconds[/bold yellow]"
+        )
+
+
+def generate_game(
+    clients: SharedClients,
+    workspace: Workspace,
+    game_theme,
+    export_dir=None,
+    show_progress=True,
+):
+    """Steps 2-11 for one game, writing everything into the workspace
+
+    export_dir is asked for when None; show_progress is False when several
+    games are generated side by side.
+    """
+    reasoning_model = clients.reasoning_model
+    general_model = clients.general_model
+    sd_prompt_model = clients.sd_prompt_model
+    vl_model = clients.vl_model
+    comfyui = clients.comfyui
+
+    # Get draft content
+    console.rule("[bold green]Step 2: Generate Game Draft[/bold green]")
+    with timer("Generate Game Draft"), llm_stage("draft"):
+        generate_draft(workspace, game_theme, reasoning_model)
+
+    # Parse draft to get structured data
+    console.rule("[bold green]Step 3: Parse Draft Structure[/bold green]")
+    with timer("Parse Draft Structure"), llm_stage("parse"):
+        structured_draft = parse_and_save_draft(workspace, general_model)
+
+    if PIPELINE_SCHEDULER:
+        # Steps 4-9 overlap: each chapter moves on as soon as its inputs exist
+        console.rule(
+            "[bold green]Steps 4-9: Generate Chapters, Scripts, Prompts and Assets[/bold green]"
+        )
+        with timer("Generate Chapters and Assets"):
+            write_character_definitions(workspace, structured_draft)
+            clean_candidates(workspace)
+            scheduler = schedule_chapters(
+                workspace,
+                structured_draft,
+                reasoning_model,
+                general_model,
+                sd_prompt_model,
+                vl_model,
+                comfyui,
+            )
+            scheduler.run(show_progress)
+        print_pipeline_timeline(scheduler)
+    else:
+        stage_options = {"show_progress": show_progress}
+        if EARLY_ASSETS:
+            # Base sprites and key backgrounds, reused by the chapter scripts
+            console.rule(
+                "[bold green]Early Assets: Sprites and Backgrounds[/bold green]"
+            )
+            with timer("Generate Early Assets"):
+                with llm_stage("image_prompts"):
+                    generate_early_image_prompts(
+                        workspace, structured_draft, sd_prompt_model, **stage_options
+                    )
+                with llm_stage("images"):
+                    generate_images(
+                        workspace,
+                        structured_draft,
+                        vl_model,
+                        comfyui,
+                        early=True,
+                        **stage_options,
+                    )
+
+        # Generate plot
+        console.rule("[bold green]Step 4: Generate Chapter Plot[/bold green]")
+        with timer("Generate Chapter Content"), llm_stage("chapters"):
+            generate_chapters(
+                workspace,
+                structured_draft,
+                reasoning_model,
+                general_model,
+                **stage_options,
+            )
+
+        # Generate script files
+        console.rule("[bold green]Step 5: Generate Ren'Py Scripts[/bold green]")
+        with timer("Generate Ren'Py Scripts"), llm_stage("scripts"):
+            generate_scripts(
+                workspace, structured_draft, reasoning_model, **stage_options
+            )
+
+        # Generate image prompts
+        console.rule("[bold green]Step 6: Generate Image Prompts[/bold green]")
+        with timer("Generate Image Prompts"), llm_stage("image_prompts"):
+            generate_image_prompts(
+                workspace, structured_draft, sd_prompt_model, **stage_options
+            )
+
+        # Generate audio prompts
+        console.rule("[bold green]Step 7: Generate Audio Prompts[/bold green]")
+        with timer("Generate Audio Prompts"), llm_stage("audio_prompts"):
+            generate_audio_prompts(
+                workspace, structured_draft, general_model, **stage_options
+            )
+
+        # Generate images
+        console.rule("[bold green]Step 8: Generate Game Images[/bold green]")
+        with timer("Generate Game Images"), llm_stage("images"):
+            generate_images(
+                workspace, structured_draft, vl_model, comfyui, **stage_options
+            )
+
+        # Generate audio
+        console.rule("[bold green]Step 9: Generate Game Audio[/bold green]")
+        with timer("Generate Game Audio"):
+            generate_audio(workspace, structured_draft, comfyui, **stage_options)
+
+    # Export game assets
+    console.rule("[bold green]Step 10: Export Game Assets[/bold green]")
+    with timer("Export Game Assets"):
+        export_game_assets(workspace, export_dir)
+
+    # Lint check and fix
+    console.rule("[bold green]Step 11: Ren'Py Script Syntax Check and Fix[/bold green]")
+    with timer("Ren'Py Script Syntax Check"), llm_stage("lint"):
+        run_lint_check(workspace, clients.lint_model, export_dir)
+
+
+def print_run_stats(clients: SharedClients, report_path):
+    """Show the ComfyUI and LLM statistics of everything generated so far"""
+    comfyui = clients.comfyui
+    print_comfyui_http_stats(comfyui)
+    print_comfyui_throughput(comfyui, clients.comfyui_monitor)
+    if comfyui.cache is not None:
+        console.print(
+            f"[bold yellow]ComfyUI output cache: {comfyui.cache.hits} hits, "
+            f"{comfyui.cache.misses} misses[/bold yellow]"
+        )
+    print_llm_cache_stats()
+    print_llm_usage(report_path)
 
 
 def run_workflow():
@@ -53,82 +576,25 @@ def run_workflow():
         )
     )
 
-    console.rule("[bold green]Step 1: Get Game Theme[/bold green]")
-    with timer("Get Game Theme"):
-        game_theme = get_game_theme()
+    # Held until the game is done, so a second run cannot share the workspace
+    with Workspace(WORKSPACE_ROOT) as workspace:
+        console.rule("[bold green]Step 1: Get Game Theme[/bold green]")
+        with timer("Get Game Theme"):
+            game_theme = get_game_theme(workspace)
 
-    # Initialize models
-    console.print("[yellow]Initializing models...[/yellow]")
-    start_time = time.time()
-    reasoning_model = ReasoningModel()
-    general_model = GeneralModel()
-    sd_prompt_model = SDPromptModel()
-    vl_model = VLModel()
-    lint_model = LintModel()
-    comfyui = ComfyUI(COMFY_UI_SERVER_ADDRESS)
-    console.print(
-        f"[bold yellow]Model initialization time: {time.time() - start_time:.2f} seconds[/bold yellow]"
-    )
-
-    # Get draft content
-    console.rule("[bold green]Step 2: Generate Game Draft[/bold green]")
-    with timer("Generate Game Draft"):
-        generate_draft(game_theme, reasoning_model)
-
-    # Parse draft to get structured data
-    console.rule("[bold green]Step 3: Parse Draft Structure[/bold green]")
-    with timer("Parse Draft Structure"):
-        structured_draft = parse_and_save_draft(general_model)
-
-    # Generate plot
-    console.rule("[bold green]Step 4: Generate Chapter Plot[/bold green]")
-    with timer("Generate Chapter Content"):
-        generate_chapters(structured_draft, reasoning_model)
-
-    # Generate script files
-    console.rule("[bold green]Step 5: Generate Ren'Py Scripts[/bold green]")
-    with timer("Generate Ren'Py Scripts"):
-        generate_scripts(structured_draft, reasoning_model)
-
-    # Generate image prompts
-    console.rule("[bold green]Step 6: Generate Image Prompts[/bold green]")
-    with timer("Generate Image Prompts"):
-        generate_image_prompts(structured_draft, sd_prompt_model)
-
-    # Generate audio prompts
-    console.rule("[bold green]Step 7: Generate Audio Prompts[/bold green]")
-    with timer("Generate Audio Prompts"):
-        generate_audio_prompts(structured_draft, general_model)
-
-    # Generate images
-    console.rule("[bold green]Step 8: Generate Game Images[/bold green]")
-    with timer("Generate Game Images"):
-        generate_images(structured_draft, vl_model, comfyui)
-
-    # Generate audio
-    console.rule("[bold green]Step 9: Generate Game Audio[/bold green]")
-    with timer("Generate Game Audio"):
-        generate_audio(structured_draft, comfyui)
-
-    # Export game assets
-    console.rule("[bold green]Step 10: Export Game Assets[/bold green]")
-    with timer("Export Game Assets"):
-        export_game_assets()
-
-    # Lint check and fix
-    console.rule("[bold green]Step 11: Ren'Py Script Syntax Check and Fix[/bold green]")
-    with timer("Ren'Py Script Syntax Check"):
-        run_lint_check(lint_model)
+        clients = SharedClients(workspace.logs_dir)
+        generate_game(clients, workspace, game_theme)
+        print_run_stats(clients, os.path.join(workspace.logs_dir, "llm_usage.json"))
 
     console.print(
         Panel(
             "[bold green]Game generation completed![/bold green]\n\n"
             "All assets have been saved to the following directories:\n"
-            "- Draft and structure: [cyan]./temp/[/cyan]\n"
-            "- Chapter content: [cyan]./temp/chapters/[/cyan]\n"
-            "- Ren'Py scripts: [cyan]./temp/scripts/[/cyan]\n"
-            "- Image assets: [cyan]./temp/images/[/cyan]\n"
-            "- Audio assets: [cyan]./temp/audio/[/cyan]",
+            f"- Draft and structure: [cyan]{workspace.root}/[/cyan]\n"
+            f"- Chapter content: [cyan]{workspace.chapters_dir}/[/cyan]\n"
+            f"- Ren'Py scripts: [cyan]{workspace.scripts_dir}/[/cyan]\n"
+            f"- Image assets: [cyan]{workspace.images_dir}/[/cyan]\n"
+            f"- Audio assets: [cyan]{workspace.audio_dir}/[/cyan]",
             title="[bold green]Completed[/bold green]",
             border_style="green",
         )
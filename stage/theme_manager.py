@@ -1,19 +1,34 @@
 import os
-import shutil
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt, Confirm
+from workspace import Workspace
 
 # Create console instance
 console = Console()
 
 
-def get_game_theme():
-    theme_file = "./temp/game_theme.txt"
+def get_game_theme(workspace: Workspace, theme=None):
+    """Ask for the game theme, or resume the one saved in the workspace
+
+    With `theme` given nothing is asked: a workspace holding the same theme
+    is resumed, one holding another theme raises ValueError instead of
+    being cleared.
+    """
+    theme_file = workspace.theme_file
 
     if os.path.exists(theme_file):
         with open(theme_file, "r", encoding="utf-8") as f:
             previous_theme = f.read().strip()
+        if theme is not None:
+            if previous_theme != theme.strip():
+                raise ValueError(
+                    f"{workspace.root} holds another game ({previous_theme}), choose an empty output directory"
+                )
+            console.print(
+                f"[bold green]Resuming [cyan]{theme}[/cyan] in {workspace.root}...[/bold green]"
+            )
+            return previous_theme
 
         console.print(
             Panel(
@@ -22,7 +37,7 @@ def get_game_theme():
             )
         )
         console.print(
-            "[yellow]If you choose 'Yes', missing files will be checked and generated; if you choose 'No', the ./temp directory will be cleared and all content will be regenerated.[/yellow]"
+            f"[yellow]If you choose 'Yes', missing files will be checked and generated; if you choose 'No', the {workspace.root} directory will be cleared and all content will be regenerated.[/yellow]"
         )
         use_previous = Confirm.ask("Use the previous theme?", default=True)
 
@@ -33,26 +48,23 @@ def get_game_theme():
             return previous_theme
         else:
             console.print(
-                "[bold red]Clearing ./temp directory and starting over...[/bold red]"
+                f"[bold red]Clearing {workspace.root} directory and starting over...[/bold red]"
             )
-            # Clear the temp directory
+            # Clear the workspace
             with console.status(
                 "[bold yellow]Clearing temporary directory...[/bold yellow]"
             ):
-                for item in os.listdir("./temp"):
-                    item_path = os.path.join("./temp", item)
-                    if os.path.isfile(item_path):
-                        os.remove(item_path)
-                    elif os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
+                workspace.clear()
 
-    # Ensure temp directory exists (in case it was deleted or doesn't exist yet)
-    os.makedirs("./temp", exist_ok=True)
+    # Ensure the workspace exists (in case it was deleted or doesn't exist yet)
+    os.makedirs(workspace.root, exist_ok=True)
 
     # Ask for new theme input
-    new_theme = Prompt.ask(
-        "[bold blue]Enter the game theme and other necessary information[/bold blue]"
-    )
+    new_theme = theme
+    if new_theme is None:
+        new_theme = Prompt.ask(
+            "[bold blue]Enter the game theme and other necessary information[/bold blue]"
+        )
 
     # Save the new theme
     with open(theme_file, "w", encoding="utf-8") as f:
@@ -0,0 +1,239 @@
+import json
+from prompt_layout import layered_messages
+from config import LANGUAGE_MODE, JSON_SCHEMA_ENDPOINTS
+
+if LANGUAGE_MODE == "zh":
+    from prompt_zh import FIX_JSON_PROMPT
+else:
+    from prompt_en import FIX_JSON_PROMPT
+
+
+def _object(**properties):
+    """Object schema in the form strict structured outputs require"""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def _list_of(**properties):
+    return {"type": "array", "items": _object(**properties)}
+
+
+_STRING = {"type": "string"}
+
+# Payloads the pipeline asks the models for, see the prompts for their meaning
+
+DRAFT_SCHEMA = _object(
+    game_name=_STRING,
+    characters=_list_of(
+        name=_STRING,
+        renpy_name=_STRING,
+        background=_STRING,
+        personality=_STRING,
+        features=_STRING,
+    ),
+    player_character=_STRING,
+    chapters=_list_of(name=_STRING, branch=_STRING, content=_STRING),
+    world_view=_STRING,
+    remarks=_STRING,
+)
+SPRITE_PROMPTS_SCHEMA = _list_of(
+    character_renpy_name=_STRING, image_name=_STRING, prompt=_STRING
+)
+BACKGROUND_PROMPTS_SCHEMA = _list_of(image_name=_STRING, prompt=_STRING)
+CG_PROMPTS_SCHEMA = _list_of(image_name=_STRING, prompt=_STRING)
+MUSIC_PROMPTS_SCHEMA = _list_of(audio_name=_STRING, prompt=_STRING)
+SFX_PROMPTS_SCHEMA = _list_of(audio_name=_STRING, prompt=_STRING)
+
+
+def response_format(llm, name: str, schema: dict) -> dict:
+    """response_format for a ChatOpenAI request expecting `schema`
+
+    Endpoints listed in JSON_SCHEMA_ENDPOINTS get the schema itself, the
+    others plain JSON mode. Both only allow an object at the top level, so
+    lists are requested as {"items": [...]}; parse_json() unwraps them.
+    """
+    if llm.base_url not in JSON_SCHEMA_ENDPOINTS:
+        return {"type": "json_object"}
+    if schema["type"] == "array":
+        schema = _object(items=schema)
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": schema, "strict": True},
+    }
+
+
+def _schema_error(value, schema, path="$"):
+    """First mismatch between value and the subset of JSON schema used above"""
+    expected = schema.get("type")
+    if expected == "object":
+        if not isinstance(value, dict):
+            return f"{path} should be an object"
+        for key in schema.get("required", []):
+            if key not in value:
+                return f"{path} is missing {key!r}"
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                error = _schema_error(value[key], subschema, f"{path}.{key}")
+                if error:
+                    return error
+    elif expected == "array":
+        if not isinstance(value, list):
+            return f"{path} should be an array"
+        for k, item in enumerate(value):
+            error = _schema_error(item, schema.get("items", {}), f"{path}[{k}]")
+            if error:
+                return error
+    elif expected == "string" and not isinstance(value, str):
+        return f"{path} should be a string"
+    return None
+
+
+def _unwrap(value, schema):
+    """The list inside {"items": [...]}, or any other single-key wrapper
+    JSON mode made the model put around a requested list"""
+    if (
+        schema.get("type") == "array"
+        and isinstance(value, dict)
+        and len(value) == 1
+        and isinstance(next(iter(value.values())), list)
+    ):
+        return next(iter(value.values()))
+    return value
+
+
+def _candidates(text: str):
+    """Repaired versions of the first JSON value in text, best first
+
+    Skips prose and code fences around the value and drops trailing commas.
+    A truncated value is closed where it stops, then cut back to each
+    earlier comma in turn, so an incomplete last element can be dropped.
+    """
+    starts = [k for k in (text.find("{"), text.find("[")) if k >= 0]
+    if not starts:
+        return
+    out = []
+    closers = []
+    # (length of out, closers) before every comma, where the value can be cut
+    cuts = []
+    in_string = escaped = comma = False
+    for char in text[min(starts) :]:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char.isspace():
+            continue
+        if comma and char not in "}]":
+            cuts.append((len(out), list(closers)))
+            out.append(",")
+        comma = False
+        if char == ",":
+            comma = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            if not closers or closers[-1] != char:
+                continue
+            closers.pop()
+            out.append(char)
+            if not closers:
+                # Complete, anything after it is prose
+                yield "".join(out)
+                return
+        else:
+            if char == '"':
+                in_string = True
+            out.append(char)
+
+    if in_string:
+        if escaped:
+            out.pop()
+        yield "".join(out) + '"' + "".join(reversed(closers))
+    else:
+        yield "".join(out) + "".join(reversed(closers))
+    depth = len(closers) + 1
+    for length, cut_closers in reversed(cuts):
+        # One cut per nesting level: past the innermost, shallower cuts
+        # drop whole incomplete elements instead of half-written fields
+        if len(cut_closers) < depth:
+            depth = len(cut_closers)
+            yield "".join(out[:length]) + "".join(reversed(cut_closers))
+
+
+def repair_json(text: str, schema: dict | None = None):
+    """Parse a model's JSON reply, tolerating common defects
+
+    Handles code fences and prose around the JSON, trailing commas, raw
+    newlines inside strings and truncated output. With a schema, the first
+    repair that matches it is returned.
+
+    Raises:
+        ValueError: no repair parses (and matches the schema)
+    """
+    error = "no JSON object or array in the response"
+    for candidate in _candidates(text):
+        try:
+            value = json.loads(candidate, strict=False)
+        except json.JSONDecodeError as e:
+            error = str(e)
+            continue
+        if schema is None:
+            return value
+        value = _unwrap(value, schema)
+        error = _schema_error(value, schema)
+        if error is None:
+            return value
+    raise ValueError(error)
+
+
+def _fix_messages(text, error, schema):
+    return layered_messages(
+        FIX_JSON_PROMPT,
+        [f"JSON Schema: {json.dumps(schema, ensure_ascii=False)}"],
+        f"Error: {error}\n\nJSON:\n{text}",
+    )
+
+
+def parse_json(llm, text: str, name: str, schema: dict):
+    """Repair and validate a reply; if that fails, ask llm to fix the JSON
+
+    The follow-up only carries the broken reply and the schema, which is far
+    cheaper than repeating the original request.
+
+    Raises:
+        ValueError: the fixed reply is still unusable
+    """
+    try:
+        return repair_json(text, schema)
+    except ValueError as e:
+        print(f"Unusable {name} JSON ({e}), asking the model to fix it...")
+        error = e
+    response = llm.invoke(
+        _fix_messages(text, error, schema),
+        response_format=response_format(llm, name, schema),
+    )
+    return repair_json(response.content, schema)
+
+
+async def aparse_json(llm, text: str, name: str, schema: dict):
+    """Async parse_json()"""
+    try:
+        return repair_json(text, schema)
+    except ValueError as e:
+        print(f"Unusable {name} JSON ({e}), asking the model to fix it...")
+        error = e
+    response = await llm.ainvoke(
+        _fix_messages(text, error, schema),
+        response_format=response_format(llm, name, schema),
+    )
+    return repair_json(response.content, schema)
@@ -8,21 +8,130 @@ from prompt_zh import (
     SELECT_BEST_CG_PROMPT,
     EVALUATE_IMAGE_PROMPT,
 )
+from config import LANGUAGE_MODE
+from manifest import input_hash, model_inputs
+from prompt_layout import layered_messages
+from structured_output import (
+    response_format,
+    parse_json,
+    aparse_json,
+    DRAFT_SCHEMA,
+    MUSIC_PROMPTS_SCHEMA,
+    SFX_PROMPTS_SCHEMA,
+)
+import os
 import json
+import time
 import base64
-from typing import Literal
+from typing import Callable, Literal
 from PIL import Image
 
+if LANGUAGE_MODE == "zh":
+    from prompt_zh import CONTINUE_GENERATION_PROMPT
+else:
+    from prompt_en import CONTINUE_GENERATION_PROMPT
+
 
 def parse_draft(general_model: GeneralModel, draft: str, raw=False):
     """Parse draft text and extract structured information"""
-    json_llm = general_model.llm.bind(response_format={"type": "json_object"})
+    llm = general_model.llm
     draft = "Parse the following outline into JSON format:\n\n" + draft
     messages = [("system", PARSE_DRAFT_PROMPT), ("human", draft)]
 
-    response = json_llm.invoke(messages).content
+    response = llm.invoke(
+        messages, response_format=response_format(llm, "draft", DRAFT_SCHEMA)
+    ).content
+
+    return parse_json(llm, response, "draft", DRAFT_SCHEMA)
 
-    return json.loads(remove_json_markers(response))
+
+def stream_to_file(
+    model,
+    prompt: str | list[tuple[str, str]],
+    path: str,
+    on_progress: Callable[[int, float], None] | None = None,
+    postprocess: Callable[[str], str] | None = None,
+    max_resumes: int = 3,
+) -> str:
+    """Stream a model response to disk, resuming after dropped connections
+
+    Chunks are appended to `path + ".partial"` as they arrive. If the stream
+    breaks, or a previous run left a partial file behind, the model is asked
+    to continue from the partial text instead of starting over. A partial
+    file is only resumed for the same request: the hash of the prompt and
+    model kept in `path + ".partial.key"` must match, otherwise it is
+    discarded. When the response is complete, postprocess(text) is written to
+    `path` and the partial files are removed.
+
+    Args:
+        model: ReasoningModel or GeneralModel, anything with stream_run()
+        prompt (str | list): the request, a string or (role, content) messages
+        path (str): final file
+        on_progress (Callable): called as on_progress(chunks, chunks_per_second);
+            providers send about one token per chunk
+        postprocess (Callable): applied to the full text before it is saved
+        max_resumes (int): continuation attempts after a broken stream
+
+    Returns:
+        str: the full (unprocessed) response
+    """
+    partial_path = path + ".partial"
+    key_path = partial_path + ".key"
+    key = input_hash(prompt, model_inputs(model))
+    text = ""
+    if os.path.exists(partial_path):
+        saved_key = None
+        if os.path.exists(key_path):
+            with open(key_path, "r", encoding="utf-8") as f:
+                saved_key = f.read().strip()
+        if saved_key == key:
+            with open(partial_path, "r", encoding="utf-8") as f:
+                text = f.read()
+        else:
+            # Left by a different prompt or model, continuing it would mix
+            # two responses
+            print(f"Discarding {partial_path}, it belongs to another request")
+            os.remove(partial_path)
+    with open(key_path, "w", encoding="utf-8") as f:
+        f.write(key)
+
+    resumes = 0
+    while True:
+        if text:
+            messages = [("user", prompt)] if isinstance(prompt, str) else prompt
+            request = [
+                *messages,
+                ("assistant", text),
+                ("user", CONTINUE_GENERATION_PROMPT),
+            ]
+        else:
+            request = prompt
+        chunks, start = 0, time.monotonic()
+        try:
+            with open(partial_path, "a", encoding="utf-8") as f:
+                for chunk in model.stream_run(request):
+                    f.write(chunk)
+                    f.flush()
+                    text += chunk
+                    chunks += 1
+                    if on_progress is not None:
+                        elapsed = time.monotonic() - start
+                        on_progress(chunks, chunks / elapsed if elapsed > 0 else 0.0)
+            break
+        except Exception as e:
+            resumes += 1
+            if resumes > max_resumes:
+                raise
+            print(
+                f"Stream for {path} broke after {len(text)} characters ({e}), resuming..."
+            )
+            time.sleep(min(2**resumes, 30))
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(postprocess(text) if postprocess else text)
+    os.remove(partial_path)
+    os.remove(key_path)
+    return text
 
 
 def remove_json_markers(input: str) -> str:
@@ -54,8 +163,9 @@ def remove_renpy_markers(input: str) -> str:
 def get_background_sd_prompt(model: SDPromptModel, world_view: str, script: str):
     """Generate SD background prompt from script"""
     response = model.run_background(world_view, script)
-    response = remove_json_markers(response.content)
-    return json.loads(response)
+    return parse_json(
+        model.llm, response.content, "background_prompts", model.SCHEMAS["background"]
+    )
 
 
 def get_sprite_sd_prompt(
@@ -63,8 +173,9 @@ def get_sprite_sd_prompt(
 ):
     """Generate SD character (sprite) prompt from script"""
     response = model.run_sprite(character_setting_json, script)
-    response = remove_json_markers(response.content)
-    return json.loads(response)
+    return parse_json(
+        model.llm, response.content, "sprite_prompts", model.SCHEMAS["sprite"]
+    )
 
 
 def get_cg_sd_prompt(
@@ -72,8 +183,45 @@ def get_cg_sd_prompt(
 ):
     """Generate SD full-screen CG prompt from script"""
     response = model.run_cg(world_view, character_setting, script)
-    response = remove_json_markers(response.content)
-    return json.loads(response)
+    return parse_json(model.llm, response.content, "cg_prompts", model.SCHEMAS["cg"])
+
+
+async def aget_background_sd_prompt(model: SDPromptModel, world_view: str, script: str):
+    """Async get_background_sd_prompt()"""
+    response = await model.arun_background(world_view, script)
+    return await aparse_json(
+        model.llm, response.content, "background_prompts", model.SCHEMAS["background"]
+    )
+
+
+async def aget_sprite_sd_prompt(
+    model: SDPromptModel, character_setting_json: str, script: str
+):
+    """Async get_sprite_sd_prompt()"""
+    response = await model.arun_sprite(character_setting_json, script)
+    return await aparse_json(
+        model.llm, response.content, "sprite_prompts", model.SCHEMAS["sprite"]
+    )
+
+
+async def aget_key_background_sd_prompt(
+    model: SDPromptModel, world_view: str, outline: str, max_backgrounds: int
+):
+    """Generate SD prompts for the key locations of the outline, before any script exists"""
+    response = await model.arun_key_backgrounds(world_view, outline, max_backgrounds)
+    return await aparse_json(
+        model.llm, response.content, "background_prompts", model.SCHEMAS["background"]
+    )
+
+
+async def aget_cg_sd_prompt(
+    model: SDPromptModel, world_view: str, character_setting: str, script: str
+):
+    """Async get_cg_sd_prompt()"""
+    response = await model.arun_cg(world_view, character_setting, script)
+    return await aparse_json(
+        model.llm, response.content, "cg_prompts", model.SCHEMAS["cg"]
+    )
 
 
 def select_best_image(
@@ -188,18 +336,24 @@ def get_music_prompt(general_model: GeneralModel, script: str):
     """Generate music prompt from script"""
     from prompt_zh import GENERATE_MUSIC_PROMPT
 
-    response = general_model.run(f"{GENERATE_MUSIC_PROMPT}\n\nRen'Py script: {script}")
-    response_text = remove_json_markers(response.content)
-    return json.loads(response_text)
+    llm = general_model.llm
+    response = llm.invoke(
+        layered_messages(GENERATE_MUSIC_PROMPT, request=f"Ren'Py script: {script}"),
+        response_format=response_format(llm, "music_prompts", MUSIC_PROMPTS_SCHEMA),
+    )
+    return parse_json(llm, response.content, "music_prompts", MUSIC_PROMPTS_SCHEMA)
 
 
 def get_sfx_prompt(general_model: GeneralModel, script: str):
     """Generate sound effect prompt from script"""
     from prompt_zh import GENERATE_SFX_PROMPT
 
-    response = general_model.run(f"{GENERATE_SFX_PROMPT}\n\nRen'Py script: {script}")
-    response_text = remove_json_markers(response.content)
-    return json.loads(response_text)
+    llm = general_model.llm
+    response = llm.invoke(
+        layered_messages(GENERATE_SFX_PROMPT, request=f"Ren'Py script: {script}"),
+        response_format=response_format(llm, "sfx_prompts", SFX_PROMPTS_SCHEMA),
+    )
+    return parse_json(llm, response.content, "sfx_prompts", SFX_PROMPTS_SCHEMA)
 
 
 def evaluate_image(
@@ -0,0 +1,234 @@
+import os
+import uuid
+import shutil
+from manifest import BuildManifest
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class WorkspaceLocked(RuntimeError):
+    """Another process is generating a game in the same workspace"""
+
+
+class Workspace:
+    """Every file generated for one game, below a root directory
+
+    Stages get their paths from here instead of spelling out ./temp, so
+    several games can be generated side by side, each in its own workspace,
+    and a workspace can live on fast local storage such as an NVMe disk or
+    tmpfs. lock() keeps a second process out of a workspace in use, and
+    `manifest` records what each file was generated from.
+    """
+
+    def __init__(self, root="./temp"):
+        self.root = root
+        self._lock_file = None
+        self.manifest = BuildManifest(self.manifest_file)
+
+    def __repr__(self):
+        return f"Workspace({self.root!r})"
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    # Story
+
+    @property
+    def theme_file(self):
+        return self.path("game_theme.txt")
+
+    @property
+    def draft_file(self):
+        return self.path("draft.txt")
+
+    @property
+    def structured_draft_file(self):
+        return self.path("structured_draft.json")
+
+    @property
+    def chapters_dir(self):
+        return self.path("chapters")
+
+    def chapter_file(self, chapter_name):
+        return self.path("chapters", f"{chapter_name}.txt")
+
+    @property
+    def chapter_summaries_file(self):
+        return self.path("memory", "chapter_summaries.json")
+
+    # Ren'Py scripts, chapter indices are 0-based as in structured_draft
+
+    @property
+    def scripts_dir(self):
+        return self.path("scripts")
+
+    @property
+    def character_script_file(self):
+        """script.rpy with the character definitions and the start label"""
+        return self.path("scripts", "script.rpy")
+
+    def chapter_script(self, i):
+        return self.path("scripts", f"chapter{i + 1}.rpy")
+
+    # Prompts
+
+    @property
+    def image_prompts_dir(self):
+        return self.path("prompts", "image")
+
+    def image_prompt_file(self, i, prompt_type):
+        """background, sprite or cg prompts of chapter i"""
+        return self.path(
+            "prompts", "image", f"chapter{i + 1}_{prompt_type}_prompt.json"
+        )
+
+    def early_prompt_file(self, prompt_type):
+        """sprite or background prompts generated from the draft alone"""
+        return self.path("prompts", "image", f"early_{prompt_type}_prompt.json")
+
+    @property
+    def audio_prompts_dir(self):
+        return self.path("prompts", "audio")
+
+    def audio_prompt_file(self, i, prompt_type):
+        """music or sfx prompts of chapter i"""
+        return self.path(
+            "prompts", "audio", f"chapter{i + 1}_{prompt_type}_prompt.json"
+        )
+
+    # Assets
+
+    @property
+    def images_dir(self):
+        return self.path("images")
+
+    def image_file(self, image_name):
+        return self.path("images", f"{image_name}.webp")
+
+    @property
+    def candidates_dir(self):
+        """Rendered images waiting for selection and evaluation"""
+        return self.path("candidates")
+
+    @property
+    def refine_dir(self):
+        """Every rendered version of the images, with their evaluations"""
+        return self.path("refine")
+
+    @property
+    def audio_dir(self):
+        return self.path("audio")
+
+    def audio_file(self, audio_name):
+        return self.path("audio", f"{audio_name}.opus")
+
+    # Export, lint and logs
+
+    @property
+    def export_dir_file(self):
+        """Ren'Py project the game was last exported to"""
+        return self.path("export_dir.txt")
+
+    @property
+    def lint_output_file(self):
+        return self.path("lint.txt")
+
+    @property
+    def lint_errors_file(self):
+        return self.path("lint_errors.json")
+
+    @property
+    def lint_validation_file(self):
+        return self.path("lint_validation.txt")
+
+    @property
+    def logs_dir(self):
+        return self.path("logs")
+
+    # Translations, see scripts/translate_chapter.py and translate_script.py
+
+    @property
+    def translated_chapters_dir(self):
+        return self.path("translated")
+
+    @property
+    def translated_scripts_dir(self):
+        return self.path("translated_scripts")
+
+    @property
+    def combined_translation_file(self):
+        """Every translated chapter in one file"""
+        return self.path("combined_translation.txt")
+
+    @property
+    def manifest_file(self):
+        """Inputs of every generated file, see manifest.BuildManifest"""
+        return self.path("manifest.json")
+
+    # Lifecycle
+
+    def lock(self):
+        """Claim the workspace for this process until release() or exit
+
+        Raises:
+            WorkspaceLocked: another process holds the workspace
+        """
+        if self._lock_file is not None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        lock_file = open(self.path(".lock"), "a+")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            raise WorkspaceLocked(
+                f"{self.root} is used by another process, choose another workspace"
+            )
+        self._lock_file = lock_file
+
+    def release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def __enter__(self):
+        self.lock()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def clear(self):
+        """Delete everything generated so far, keeping the workspace itself"""
+        if not os.path.isdir(self.root):
+            return
+        for item in os.listdir(self.root):
+            if item == ".lock":
+                continue
+            item_path = self.path(item)
+            if os.path.isdir(item_path):
+                shutil.rmtree(item_path)
+            else:
+                os.remove(item_path)
+        self.manifest.reset()
+
+    def remove(self):
+        """Delete the workspace of a finished run
+
+        The directory is first renamed away, which is atomic, so a
+        workspace is either complete or gone, never partly deleted.
+        """
+        self.release()
+        if not os.path.isdir(self.root):
+            return
+        root = os.path.normpath(self.root)
+        removing = f"{root}.removing-{uuid.uuid4().hex[:8]}"
+        os.rename(root, removing)
+        shutil.rmtree(removing)